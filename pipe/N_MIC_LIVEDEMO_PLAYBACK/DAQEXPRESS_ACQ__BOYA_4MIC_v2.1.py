@@ -2,16 +2,18 @@ import tkinter as tk
 from tkinter import ttk
 from PIL import Image, ImageTk
 import threading
-import nidaqmx
-from nidaqmx import constants
-from nidaqmx.constants import AcquisitionType, READ_ALL_AVAILABLE, TerminalConfiguration
-from nidaqmx import stream_readers
+import contextlib
 import numpy as np
 import time as t
-import pickle
 
 from live_demo_dependencies.glob_vars import N_MICS
 from live_demo_dependencies.glob_vars import SAMPLING_RATE
+from live_demo_dependencies.glob_vars import DAQ_BACKEND
+from live_demo_dependencies.glob_vars import SHARED_FRAMES_FILE
+from live_demo_dependencies.glob_vars import RECORDING_DIR
+from live_demo_dependencies.shared_frames import SharedFrameWriter
+from live_demo_dependencies.segment_archive import SegmentRecorder
+from live_demo_dependencies.daq_backends import make_daq_backend, SimulatedSource, pipe_source_position, BlockFrameBuffer
 
 #IF PLOTTING, UNCOMMENT THESE---------------
 #from matplotlib import pyplot as plt
@@ -19,10 +21,12 @@ from live_demo_dependencies.glob_vars import SAMPLING_RATE
 
 DATA_ACQ_ENABLED = True
 DATA_EXPORT_ENABLED = True
+PREALLOCATED_ACQ = True #read into a preallocated block ring (BlockFrameBuffer) instead of growing every channel per read
+RECORDING_ENABLED = False #archive every raw DAQ read under RECORDING_DIR (segment_archive.py), ~1.7 MB/s as float32
+RECORDING_SEGMENT_TIME = 60 #s per segment file
+RECORDING_MAX_SEGMENTS = 120 #oldest segments are deleted beyond this, None keeps all
 
-output = open('pickles/audio_file.pkl', 'wb')
-pickle.dump(1, output) #1 indicates file streaming not yet started
-output.close()
+NORMALIZE_GAIN = 4
 
 def normalize(data):
     trace_mean = np.mean(data)
@@ -30,13 +34,16 @@ def normalize(data):
     max_val = max(abs(min(data)), max(data))
     #print("MAXval:",max_val)
     #norm_trace= [x / max_val for x in data]
-    norm_trace= [x*4 for x in data]
+    norm_trace= [x*NORMALIZE_GAIN for x in data]
     return norm_trace
 
 fs = SAMPLING_RATE
 nSamples = 200
 numChannels = N_MICS
 totalTime = 1#0.2 #s
+hopTime = totalTime #s between frames with PREALLOCATED_ACQ, less than totalTime gives overlapping frames
+SIMULATED_SOURCES = [SimulatedSource(pipe_source_position(50))] #used with DAQ_BACKEND=simulator
+FRAME_CAPACITY = 2*totalTime*fs #most samples per channel a frame can have (appending reads continue until totalTime is up)
 
 
 class App(tk.Tk):
@@ -73,53 +80,77 @@ class App(tk.Tk):
             DATA_EXPORT_ENABLED = False
 
     def daq_start(self):
-        with nidaqmx.Task() as task:
-            if DATA_ACQ_ENABLED:
-                task.ai_channels.add_ai_voltage_chan(f"Dev17/ai1:{N_MICS}",terminal_config=TerminalConfiguration.RSE)
-                task.timing.cfg_samp_clk_timing(rate=fs, sample_mode=AcquisitionType.CONTINUOUS,) #FINITE or CONTINUOUS try both
-                in_stream = task.in_stream
-                reader = stream_readers.AnalogMultiChannelReader(in_stream)
-            while True:
-            #for i in range(30):
-                try:
-
-                    ch_data_list=[]
-
-                    #ACQUIRE-----------------
-                    for i in range(N_MICS):
-                        ch_data_list.append(np.array([]))
-                    t_start = t.time()
-                    while (t.time() - t_start <= totalTime):
-                        buffer = np.zeros((numChannels, nSamples), dtype=np.float64)
+        daq = make_daq_backend(DAQ_BACKEND,f"Dev17/ai1:{N_MICS}",numChannels,fs,sources=SIMULATED_SOURCES) #continuous
+        frames = SharedFrameWriter(SHARED_FRAMES_FILE,N_MICS,int(FRAME_CAPACITY),fs) #frames for the GUI
+        recorder = SegmentRecorder(RECORDING_DIR,numChannels,fs,segment_seconds=RECORDING_SEGMENT_TIME,
+                                   max_segments=RECORDING_MAX_SEGMENTS) if RECORDING_ENABLED and DATA_ACQ_ENABLED else None
+        with daq if DATA_ACQ_ENABLED else contextlib.nullcontext(), recorder or contextlib.nullcontext():
+            if PREALLOCATED_ACQ:
+                self.acquire_preallocated(daq,frames,recorder)
+            else:
+                self.acquire_appended(daq,frames,recorder)
+
+    def acquire_preallocated(self,daq,frames,recorder=None):
+        #nSamples per read straight into a preallocated ring, a frame of totalTime every hopTime, normalized in place
+        acq = BlockFrameBuffer(numChannels,nSamples,round(totalTime*fs/nSamples),max(1,round(hopTime*fs/nSamples)))
+        while True:
+            try:
+                if DATA_ACQ_ENABLED:
+                    block = acq.write_slot()
+                    daq.read(block)
+                    if recorder is not None:
+                        recorder.write(block.T) #raw, queued for the recorder thread
+                else:
+                    t.sleep(nSamples/fs)
+                if acq.commit():
+                    data = acq.assemble(NORMALIZE_GAIN)
+                    if DATA_EXPORT_ENABLED:
+                        frames.write(data[:,:N_MICS],t.time()-totalTime)
+            except KeyboardInterrupt:
+                break
+
+    def acquire_appended(self,daq,frames,recorder=None):
+        while True:
+        #for i in range(30):
+            try:
+
+                ch_data_list=[]
+
+                #ACQUIRE-----------------
+                for i in range(N_MICS):
+                    ch_data_list.append(np.array([]))
+                t_start = t.time()
+                while (t.time() - t_start <= totalTime):
+                    buffer = np.zeros((numChannels, nSamples), dtype=np.float64)
+                    
+                    if DATA_ACQ_ENABLED:
+                        daq.read(buffer)
+                        if recorder is not None:
+                            recorder.write(buffer.T)
                         
-                        if DATA_ACQ_ENABLED:
-                            reader.read_many_sample(buffer, nSamples, timeout=constants.WAIT_INFINITELY)
-                            
-                        for i in range(N_MICS):
-                            ch_data_list[i] = np.append(ch_data_list[i], buffer[i])
-                
-                    #Normalize-------------------
                     for i in range(N_MICS):
-                        ch_data_list[i] = normalize(ch_data_list[i])
-                        
-                    #COLLATE--------------
-                    #data = np.array([ch1_data, ch2_data, ch3_data, ch4_data]).T
-                    data = np.array(ch_data_list).T
+                        ch_data_list[i] = np.append(ch_data_list[i], buffer[i])
+            
+                #Normalize-------------------
+                for i in range(N_MICS):
+                    ch_data_list[i] = normalize(ch_data_list[i])
                     
-                    #PLOT TEST-------
-                    #print(data[:,2])
-                    '''plt.clf()
-                    plt.plot(data[:,0])
-                    plt.pause(0.01)'''
-
-                    #PICKLE EXPORT------------------
-                    if DATA_EXPORT_ENABLED:
-                        output = open('pickles/audio_file.pkl', 'wb')
-                        pickle.dump(data, output)
-                        output.close()
-                        print("saved",t.time()-t_start)
-                except KeyboardInterrupt:
-                    break
+                #COLLATE--------------
+                #data = np.array([ch1_data, ch2_data, ch3_data, ch4_data]).T
+                data = np.array(ch_data_list).T
+                
+                #PLOT TEST-------
+                #print(data[:,2])
+                '''plt.clf()
+                plt.plot(data[:,0])
+                plt.pause(0.01)'''
+
+                #EXPORT (shared memory)------------------
+                if DATA_EXPORT_ENABLED:
+                    frames.write(data[:frames.capacity],t_start) #unpaced without acquisition, may run over
+                    print("saved",t.time()-t_start)
+            except KeyboardInterrupt:
+                break
 
 if __name__ == "__main__":
     app = App()
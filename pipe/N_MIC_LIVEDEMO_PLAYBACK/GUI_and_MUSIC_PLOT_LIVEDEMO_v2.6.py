@@ -20,6 +20,7 @@ from live_demo_dependencies.glob_vars import *
 from live_demo_dependencies.doa_data_process import *
 from live_demo_dependencies.BPF import *
 from live_demo_dependencies.dmas import *
+from live_demo_dependencies.shared_frames import SharedFrameReader, FrameUnavailable
 import pickle
 
 #========================================
@@ -31,7 +32,11 @@ current_freq=4500#Hz #5000 , #4500 for 1.5m, 5000 for 2m
 
 BAND_DISTANCE = 400 #Hz #Band distance for wideband MUSIC
 FREQUENCY_FILTERING_ON = True
+WIDEBAND_MUSIC = True #Single FFT band covariances for the heatmaps instead of a filtfilt per band
+PARALLEL_BANDS = False #With WIDEBAND_MUSIC off, run the per band filtfilts on a process pool (see band_pool.py)
 RPI_INTERFACING_ENABLED = True
+AUDIO_PICKLE = None #e.g. 'pickles/pipe_leak_and_motor.pkl' to replay a recording instead of the live frames of DAQEXPRESS
+FIRST_FRAME_TIMEOUT = 30 #s to wait at start up for DAQEXPRESS to publish its first frame
 fc,bw = generate_bpfilt_varyband(BAND_DISTANCE=BAND_DISTANCE,R_b=SAMPLING_RATE,lower_freq=1000,upper_freq=7000,tapered=True)
 
 #BAND_DISTANCE = 200 #Hz
@@ -79,7 +84,10 @@ def get_angles_from_pixels_pipe(cursor_x,cursor_y):
 def get_image_matrix_sfreqs(audio_data):
     t=time.time()
     #find pmusic composite map and single frequency maps
-    p_music,sfreq_maps=data_process_pipe_animated_varyband_sfreqs(audio_data,fc,bw,magType='linadd',theta_offset=180)
+    if WIDEBAND_MUSIC:
+        p_music,sfreq_maps=data_process_pipe_animated_varyband_sfreqs_wideband(audio_data,fc,bw,magType='linadd',theta_offset=180)
+    else:
+        p_music,sfreq_maps=data_process_pipe_animated_varyband_sfreqs(audio_data,fc,bw,magType='linadd',theta_offset=180,parallel=PARALLEL_BANDS)
     print("pmusic time:",time.time()-t)
 
     #Normalize pmusic
@@ -89,11 +97,14 @@ def get_image_matrix_sfreqs(audio_data):
     
     return p_music.T, sfreq_maps
 
-def get_audio_data():
-    pkl_file = open('pickles/audio_file.pkl', 'rb') #Change pickle filename here. If live data capture is taking place, filename = audio_file.pkl
-    #pkl_file = open('pickles/pipe_leak_and_motor.pkl', 'rb') #Change pickle filename here. If live data capture is taking place, filename = audio_file.pkl
-    audio_data = pickle.load(pkl_file)
-    pkl_file.close()
+frame_reader = SharedFrameReader(SHARED_FRAMES_FILE)
+
+def get_audio_data(wait=0):
+    if AUDIO_PICKLE is not None:
+        with open(AUDIO_PICKLE, 'rb') as pkl_file:
+            audio_data = pickle.load(pkl_file)
+    else:
+        audio_data = frame_reader.read(wait=wait) #latest complete frame, never a torn one
 
     #Shorten audio for better time complexity.
     size_reduction_factor = AUDIO_SIZE_REDUCTION_FACTOR
@@ -134,7 +145,7 @@ class App(tk.Tk):
         self.image_label.pack(pady=20)
 
         #audio data========================================================
-        self.audio_data = get_audio_data()
+        self.audio_data = get_audio_data(wait=FIRST_FRAME_TIMEOUT)
 
         #Audio playback management 
         self.audio_slice = self.audio_data[:,0]
@@ -225,20 +236,13 @@ class App(tk.Tk):
 
                 #Frequency filtering
                 if FREQUENCY_FILTERING_ON:
-                    accumulation_list = np.zeros_like(self.audio_slice)
-                    for i in range(len(fc)):
-                        #BPF the audio
-                        nbf_audio =  butter_bandpass_filter(self.audio_slice,lowcut=fc[i]-bw/2, highcut=fc[i]+bw/2, fs=SAMPLING_RATE, order=5)
-                        #multiply with the intensity of sfreq_map at current mouse coordinates.
-                        nbf_audio = np.multiply(nbf_audio,self.sfreqs_intensity[i])
-                        accumulation_list = np.add(accumulation_list,nbf_audio)
-
-                    self.audio_slice = accumulation_list
+                    #every band weighted by the intensity of its sfreq_map at the current mouse coordinates, all bands in one STFT
+                    self.audio_slice = stft_band_weighting(self.audio_slice,SAMPLING_RATE,fc,bw,self.sfreqs_intensity)
                 else:
                     self.audio_slice = butter_bandpass_filter(self.audio_slice,lowcut=1000, highcut=8000, fs=SAMPLING_RATE, order=5)
                     
                 
-        except (EOFError, pickle.UnpicklingError) as e:
+        except FrameUnavailable as e:
             pass
 
 
@@ -1,16 +1,51 @@
-from scipy.signal import butter, lfilter, filtfilt
-
-def butter_bandpass_filter(data,lowcut, highcut, fs, order=5):
-    #return butter(order, [lowcut, highcut], fs=fs, btype='band')
-    b,a= butter(order, [lowcut/(fs/2), highcut/(fs/2)], btype='band')
-    y = filtfilt(b,a,data)
-    return y
-def butter_lowpass_filter(data, highcut, fs, order=5):
-    #b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    #y = lfilter(b, a, data)
-    #y = filtfilt(b, a, data)
-
-    b,a = butter(order,highcut/(fs/2), btype='low')
-    y = filtfilt(b,a,data)
-    return y
+import functools
+import numpy as np
+from scipy.signal import butter, lfilter, filtfilt, sosfiltfilt, sosfreqz, stft, istft
 
+#Butterworth filters as second order sections (stable for the narrow order 5 bands, unlike (b,a)), designed once per
+#(order, cutoffs, fs) and shared. The filter functions run along axis: pass axis=0 to filter every channel of a
+#(samples x channels) frame in one call.
+
+def butter_sos(order,lowcut,highcut,fs,btype='band'):
+    #Cached sos of a Butterworth 'band' (lowcut,highcut), 'low' (highcut) or 'high' (lowcut) filter. Shared between
+    #callers, do not modify it (sosfilt rejects read only arrays, so it is not flagged as such).
+    cutoffs = {'band':(lowcut,highcut),'low':(highcut,),'high':(lowcut,)}[btype]
+    return _butter_sos(int(order),tuple(float(c) for c in cutoffs),float(fs),btype)
+
+@functools.lru_cache(maxsize=256)
+def _butter_sos(order,cutoffs,fs,btype):
+    return butter(order,cutoffs if len(cutoffs) > 1 else cutoffs[0],btype=btype,fs=fs,output='sos')
+
+def butter_bandpass_filter(data,lowcut, highcut, fs, order=5, axis=-1, padlen=None):
+    #zero phase band pass, padlen as in sosfiltfilt (None: its default)
+    return sosfiltfilt(butter_sos(order,lowcut,highcut,fs),data,axis=axis,padlen=padlen)
+
+def butter_lowpass_filter(data, highcut, fs, order=5, axis=-1, padlen=None):
+    #zero phase low pass
+    return sosfiltfilt(butter_sos(order,None,highcut,fs,btype='low'),data,axis=axis,padlen=padlen)
+
+#Spectral weighting=========================================================
+#sum_i gains[i]*butter_bandpass_filter(x,fc[i]-bw/2,fc[i]+bw/2) is a zero phase filter with response
+#sum_i gains[i]*|H_i|^2. stft_band_weighting applies that response in the STFT domain instead: one forward and one
+#inverse transform (Hann, 75% overlap-add) for all bands, and no ringing of the narrow IIR bands.
+
+def band_power_responses(fc,bw,fs,nperseg,order=5):
+    #(bands x nperseg//2+1) |H|^2 of the order band passes of all bands at the STFT bin frequencies, cached
+    return _band_power_responses(tuple(float(f) for f in fc),float(bw),float(fs),int(nperseg),int(order))
+
+@functools.lru_cache(maxsize=16)
+def _band_power_responses(fc,bw,fs,nperseg,order):
+    freqs = np.fft.rfftfreq(nperseg,1/fs)
+    responses = np.array([np.abs(sosfreqz(butter_sos(order,f-bw/2,f+bw/2,fs),worN=freqs,fs=fs)[1])**2 for f in fc])
+    responses.flags.writeable = False #shared between callers
+    return responses
+
+def stft_band_weighting(data,fs,fc,bw,gains,nperseg=1024,order=5):
+    #data (1-D) with every band fc[i] +- bw/2 scaled by gains[i] and summed, like the per band filtfilt loop
+    nperseg = min(nperseg,len(data)) #stft shrinks longer segments to the data, the gain curve must match
+    noverlap = 3*nperseg//4
+    gain_curve = np.asarray(gains,float)@band_power_responses(fc,bw,fs,nperseg,order)
+    _,_,Z = stft(data,fs,nperseg=nperseg,noverlap=noverlap)
+    Z *= gain_curve[:,np.newaxis]
+    _,weighted = istft(Z,fs,nperseg=nperseg,noverlap=noverlap)
+    return weighted[:len(data)]
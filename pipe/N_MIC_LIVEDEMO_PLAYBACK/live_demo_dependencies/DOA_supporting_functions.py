@@ -1,10 +1,14 @@
+import functools
 import numpy as np
 from scipy.signal import lfilter
 import scipy as sp
 #import matlab.engine
 from .glob_vars import *
+from . import glob_vars #near field LUT's are built lazily, so they are not part of the star import
 from scipy import signal
 from .BPF import *
+from .manifold_cache import get_cached_manifold
+from .music_numerics import *
 '''def estimate_music_spectrum_2D_plane(data,bpFilt,fc,indx,PLANE_HEIGHT,theta_offset=0): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
     global MIC_RADIUS,THETA_INTERVALS,PHI_INTERVALS, PLANE_LENGTH_INTERVALS, PLANE_LENGTH
     
@@ -65,7 +69,7 @@ from .BPF import *
 
 
 
-def estimate_music_spectrum_2D_pipe_another(data,bpFilt,fc,indx,theta_offset=0): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
+def estimate_music_spectrum_2D_pipe_another(data,bpFilt,fc,indx,theta_offset=0,A_uca=None): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
     global MIC_RADIUS, PIPE_LENGTH,PIPE_DIAMETER,PIPE_DISTANCE,PIPE_HEIGHT,PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS,N_MICS
     
     tmp1 = sp.signal.filtfilt(bpFilt[:,0],1,data[:,0],padlen=0)
@@ -83,55 +87,19 @@ def estimate_music_spectrum_2D_pipe_another(data,bpFilt,fc,indx,theta_offset=0):
     
     R = np.matmul(np.conjugate(np.transpose(temp_data1)),temp_data1)/len(temp_data1) #temp_data1^Hermitian . temp_data1
     #print(R)
-    u, s, vh = np.linalg.svd(R, full_matrices=True)
-    un = u.take(np.arange(2,N_MICS,1),axis=1) #was 2,4,1
-
-    p_music = np.ones((PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS),float)
-
-    z_index=0
-    for z in np.linspace(PIPE_HEIGHT-40,PIPE_HEIGHT+40,PIPE_DIAMETER_INTERVALS):
-    #for z in np.linspace(0,1000,PIPE_DIAMETER_INTERVALS):
-        y_index = 0
-        for y_val in np.linspace(PIPE_LENGTH/2,-PIPE_LENGTH/2,PIPE_LENGTH_INTERVALS):
-            
-            x=PIPE_DISTANCE
-            r=np.sqrt(x**2+y_val**2+z**2) #to find phi only.
-            theta = np.arctan(y_val/x)
-            phi = np.arccos(z/r) #always +ve
-
-            #theta winding
-            if x>=0 and y_val>=0:
-                theta=theta
-            elif x<0 and y_val>=0: #2nd quadrant
-                theta = np.pi+theta
-            elif x<0 and y_val<0: #3rd quadrant
-                theta = np.pi+theta
-            elif x>=0 and y_val<0:
-                theta = 2*np.pi+theta
+    un = noise_subspaces(R[np.newaxis],precision='double')[0]
 
+    #final payload, evaluated for the whole grid at once
+    if A_uca is None:
+        A_uca = get_manifold_tensor('pipe',fc,theta_offset,z_start=PIPE_HEIGHT-40,z_stop=PIPE_HEIGHT+40)[0]
+    p_music = estimate_music_spectrum_grid(A_uca,un)
 
-            #final payload
-            A_uca = Generate_manifoldmatrix_UCA_2D(rad,theta*180/np.pi, phi*180/np.pi, lambda1,theta_offset)
-            temp1 = np.matmul(np.transpose(np.conjugate(A_uca)),un)
-            temp2 = np.matmul(np.transpose(np.conjugate(un)),A_uca) 
-            p_music[y_index][z_index] = abs(1/np.matmul(temp1,temp2))
-            
-            y_index+=1
-            
-        z_index+=1
-        
     return p_music
 
-def estimate_music_spectrum_2D_pipe_varyband(data,fc,bw,indx,theta_offset=0): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
+def estimate_music_spectrum_2D_pipe_varyband(data,fc,bw,indx,theta_offset=0,A_uca=None): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
     global MIC_RADIUS, PIPE_LENGTH,PIPE_DIAMETER,PIPE_DISTANCE,PIPE_HEIGHT,PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS,N_MICS
-    tmp1 = butter_bandpass_filter(data[:,0],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5)
-    temp_data = np.zeros((len(tmp1),N_MICS), float);
-    temp_data1 = np.zeros((int(len(tmp1)/2),N_MICS), complex);
-    for k in range(N_MICS):
-        temp_data[:,k] = butter_bandpass_filter(data[:,k],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5)
-        temp1 = np.fft.fft(temp_data[:,k])
-        temp2 = temp1[0:int(len(temp1)/2):1]
-        temp_data1[:,k] = temp2
+    temp_data = butter_bandpass_filter(data[:,:N_MICS],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5, axis=0) #all channels at once
+    temp_data1 = np.fft.fft(temp_data,axis=0)[:len(temp_data)//2]
 
     lambda1 = SPEED_OF_SOUND/fc
     #d = 5.72e-2
@@ -139,46 +107,16 @@ def estimate_music_spectrum_2D_pipe_varyband(data,fc,bw,indx,theta_offset=0): #H
     
     R = np.matmul(np.conjugate(np.transpose(temp_data1)),temp_data1)/len(temp_data1) #temp_data1^Hermitian . temp_data1
     #print(R)
-    u, s, vh = np.linalg.svd(R, full_matrices=True)
-    un = u.take(np.arange(2,N_MICS,1),axis=1) #was 2,4,1
+    un = noise_subspaces(R[np.newaxis],precision='double')[0]
 
-    p_music = np.ones((PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS),float)
+    #final payload, evaluated for the whole grid at once
+    if A_uca is None:
+        A_uca = get_manifold_tensor('pipe',fc,theta_offset)[0]
+    p_music = estimate_music_spectrum_grid(A_uca,un)
 
-    z_index=0
-    for z in np.linspace(PIPE_HEIGHT+PIPE_DIAMETER/2,PIPE_HEIGHT-PIPE_DIAMETER/2,PIPE_DIAMETER_INTERVALS): #ALPHA
-    #for z in np.linspace(0,1000,PIPE_DIAMETER_INTERVALS):
-        y_index = 0
-        for y_val in np.linspace(PIPE_LENGTH/2,-PIPE_LENGTH/2,PIPE_LENGTH_INTERVALS): #BETA
-            
-            x=PIPE_DISTANCE
-            r=np.sqrt(x**2+y_val**2+z**2) #to find phi only.
-            theta = np.arctan(y_val/x)
-            phi = np.arccos(z/r) #always +ve
-
-            #theta winding
-            if x>=0 and y_val>=0:
-                theta=theta
-            elif x<0 and y_val>=0: #2nd quadrant
-                theta = np.pi+theta
-            elif x<0 and y_val<0: #3rd quadrant
-                theta = np.pi+theta
-            elif x>=0 and y_val<0:
-                theta = 2*np.pi+theta
-
-
-            #final payload
-            A_uca = Generate_manifoldmatrix_UCA_2D(rad,theta*180/np.pi, phi*180/np.pi, lambda1,theta_offset)
-            temp1 = np.matmul(np.transpose(np.conjugate(A_uca)),un)
-            temp2 = np.matmul(np.transpose(np.conjugate(un)),A_uca) 
-            p_music[y_index][z_index] = abs(1/np.matmul(temp1,temp2))
-            
-            y_index+=1
-            
-        z_index+=1
-        
     return p_music
 
-def estimate_music_spectrum_2D(data,bpFilt,fc,indx,theta_offset=0): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
+def estimate_music_spectrum_2D(data,bpFilt,fc,indx,theta_offset=0,A_uca=None): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
     global THETA_INTERVALS,PHI_INTERVALS, MIC_RADIUS    
     tmp1 = sp.signal.filtfilt(bpFilt[:,0],1,data[:,0],padlen=0)
     temp_data = np.zeros((len(tmp1),N_MICS), float);
@@ -195,30 +133,16 @@ def estimate_music_spectrum_2D(data,bpFilt,fc,indx,theta_offset=0): #Here, fc is
     
     R = np.matmul(np.conjugate(np.transpose(temp_data1)),temp_data1)/len(temp_data1) #temp_data1^Hermitian . temp_data1
     #print(R)
-    u, s, vh = np.linalg.svd(R, full_matrices=True)
-    un = u.take(np.arange(2,N_MICS,1),axis=1)
+    un = noise_subspaces(R[np.newaxis],precision='double')[0]
 
-    p_music = np.ones((THETA_INTERVALS,PHI_INTERVALS),float)
-    
-    #p_music_max=-np.inf
-    theta_index= 0
-    for theta in np.linspace(0,360,THETA_INTERVALS):
-        phi_index = 0
-        for phi in np.linspace(0,90,PHI_INTERVALS):
-            A_uca = Generate_manifoldmatrix_UCA_2D(rad,theta, phi, lambda1,theta_offset)
-            temp1 = np.matmul(np.transpose(np.conjugate(A_uca)),un)
-            temp2 = np.matmul(np.transpose(np.conjugate(un)),A_uca) 
-            p_music[theta_index][phi_index] = abs(1/np.matmul(temp1,temp2))
+    #final payload, evaluated for the whole grid at once
+    if A_uca is None:
+        A_uca = get_manifold_tensor('spherical',fc,theta_offset)[0]
+    p_music = estimate_music_spectrum_grid(A_uca,un)
 
-            #if p_music[theta_index][phi_index]>p_music_max: p_music_max=p_music[theta_index][phi_index]
-
-            
-            phi_index+=1
-        theta_index+=1
-        
     return p_music
 
-def estimate_music_spectrum_2D_cylinder_nf(data,bpFilt,fc,indx,theta_offset=0): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
+def estimate_music_spectrum_2D_cylinder_nf(data,bpFilt,fc,indx,theta_offset=0,A_uca=None): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
     global MIC_RADIUS,THETA_INTERVALS,PHI_INTERVALS, CYLINDER_Y_INTERVALS, CYLINDER_DELTA_INTERVALS, CYLINDER_HEIGHT, CYLINDER_RADIUS, CYLINDER_LENGTH, CYLINDER_CHI
     
     tmp1 = sp.signal.filtfilt(bpFilt[:,0],1,data[:,0],padlen=0)
@@ -236,18 +160,13 @@ def estimate_music_spectrum_2D_cylinder_nf(data,bpFilt,fc,indx,theta_offset=0):
     
     R = np.matmul(np.conjugate(np.transpose(temp_data1)),temp_data1)/len(temp_data1) #temp_data1^Hermitian . temp_data1
     #print(R)
-    u, s, vh = np.linalg.svd(R, full_matrices=True)
-    un = u.take(np.arange(2,6,1),axis=1)
+    un = noise_subspaces(R[np.newaxis],precision='double')[0]
 
-    p_music = np.ones((CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS),float)
+    #final payload, evaluated for the whole grid at once
+    if A_uca is None:
+        A_uca = get_manifold_tensor('cylinder_nf',fc,theta_offset)[0]
+    p_music = estimate_music_spectrum_grid(A_uca,un)
 
-    for delta_index in range(CYLINDER_DELTA_INTERVALS):
-        for y_index in range(CYLINDER_Y_INTERVALS):
-            A_uca = Generate_manifoldmatrix_UCA_2D_cyl_nf(rad, y_index, delta_index, lambda1)
-            temp1 = np.matmul(np.transpose(np.conjugate(A_uca)),un)
-            temp2 = np.matmul(np.transpose(np.conjugate(un)),A_uca) 
-            p_music[y_index][delta_index] = abs(1/np.matmul(temp1,temp2))
-            
     return p_music
 
 def Generate_manifoldmatrix_UCA_2D(R,theta, phi, lambda1, theta_offset=0):
@@ -264,14 +183,186 @@ def Generate_manifoldmatrix_UCA_2D(R,theta, phi, lambda1, theta_offset=0):
         A.append(1) #If odd mics, last mic is at centre. Therefore, its steering vector is unity.
     return np.array(A)
 
+def mic_positions():
+    #(N_MICS x 3) mic positions in meters, array centre at the origin, same layout as the near field LUT's:
+    #mic i at angle -2*pi*i/N_MICS_EVEN + MIC_ROT + THETA_OFFSET, anti clockwise, the last mic at the centre if N_MICS is odd
+    N_MICS_EVEN = N_MICS-N_MICS%2
+    i = np.arange(N_MICS)
+    mic_angle = -i/N_MICS_EVEN*np.pi*2 + MIC_ROT*np.pi/180 + THETA_OFFSET*np.pi/180
+    on_circle = i < N_MICS_EVEN
+    return np.stack([np.where(on_circle,MIC_RADIUS*np.cos(mic_angle),0),np.where(on_circle,MIC_RADIUS*np.sin(mic_angle),0),np.zeros(N_MICS)],axis=1)
+
+#Vectorized grid engine==================================================
+def angles_from_xyz(x,y,z):
+    #theta,phi (degrees) of points x,y,z (arrays, broadcastable) as seen from the array centre
+    r=np.sqrt(x**2+y**2+z**2) #to find phi only.
+    theta = np.mod(np.arctan2(y,x),2*np.pi) #same winding as the per-point loops
+    phi = np.arccos(z/r) #always +ve
+    return theta*180/np.pi,phi*180/np.pi
+
+def pipe_axes(n_length=PIPE_LENGTH_INTERVALS,n_diameter=PIPE_DIAMETER_INTERVALS,z_start=None,z_stop=None):
+    #y (along the pipe, rows) and z (cols) coordinates in cm of a pipe grid. y runs from +PIPE_LENGTH/2 to -PIPE_LENGTH/2,
+    #z from z_start to z_stop, by default over the pipe diameter from top to bottom.
+    z_start = PIPE_HEIGHT+PIPE_DIAMETER/2 if z_start is None else z_start
+    z_stop = PIPE_HEIGHT-PIPE_DIAMETER/2 if z_stop is None else z_stop
+    y_val = np.linspace(PIPE_LENGTH/2,-PIPE_LENGTH/2,n_length) #BETA
+    z = np.linspace(z_start,z_stop,n_diameter) #ALPHA
+    return y_val,z
+
+def pipe_point_angles(y,z):
+    #theta,phi (degrees) of pipe points at y (along the pipe) and height z, in cm (arrays, broadcastable)
+    return angles_from_xyz(PIPE_DISTANCE,y,z)
+
+def pipe_grid_angles(z_start=None,z_stop=None,shape=None):
+    #theta,phi (degrees) for every pipe grid point, shape (PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS) unless given
+    shape = (PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS) if shape is None else shape
+    y_val,z = np.meshgrid(*pipe_axes(shape[0],shape[1],z_start,z_stop),indexing='ij')
+    return pipe_point_angles(y_val,z)
+
+def Generate_manifoldmatrix_UCA_2D_grid(R,theta, phi, lambda1, theta_offset=0):
+    #Vectorized Generate_manifoldmatrix_UCA_2D. theta and phi (degrees) are arrays of any shape,
+    #returns the steering vectors of all points stacked along a last axis of length N_MICS.
+    #lambda1 may be an array broadcasting against theta/phi, e.g. (bands,1,1) for all bands at once.
+    N_MICS_EVEN = N_MICS-N_MICS%2
+    mic_angles = -2*np.pi*np.arange(N_MICS_EVEN)/N_MICS_EVEN
+    theta = np.asarray(theta,float)[...,np.newaxis]
+    phi = np.asarray(phi,float)[...,np.newaxis]
+    lambda1 = np.asarray(lambda1,float)[...,np.newaxis]
+
+    phase = (2*np.pi/lambda1)*R*( np.cos((theta-theta_offset)*np.pi/180-mic_angles) * np.sin(phi*np.pi/180) )
+    A = np.ones(phase.shape[:-1]+(N_MICS,),complex) #If odd mics, last mic is at centre. Therefore, its steering vector is unity.
+    A[...,:N_MICS_EVEN] = np.exp(1j*phase)
+    return A
+
+def estimate_music_spectrum_grid(A,un):
+    #MUSIC pseudospectrum 1/|a^H.un|^2 for every steering vector in A (shape (...,N_MICS)),
+    #computed with a single matmul against the noise subspace un (N_MICS x N_MICS-2).
+    proj = np.matmul(np.conjugate(A),un)
+    return 1/np.sum(proj.real**2+proj.imag**2,axis=-1)
+
+def plane_axes(n_y=PLANE_LENGTH_INTERVALS,n_x=PLANE_LENGTH_INTERVALS):
+    #y (rows) and x (cols) coordinates in cm of a plane grid, both from -PLANE_LENGTH/2 to PLANE_LENGTH/2
+    y_val = np.linspace(-PLANE_LENGTH/2,PLANE_LENGTH/2,n_y)
+    x_val = np.linspace(-PLANE_LENGTH/2,PLANE_LENGTH/2,n_x)
+    return y_val,x_val
+
+def plane_point_angles(y,x,height=None):
+    #theta,phi (degrees) of points at y,x (cm, arrays, broadcastable) on a plane height cm above the array
+    height = PLANE_HEIGHT if height is None else height
+    return angles_from_xyz(x,y,height)
+
+def plane_grid_angles(height=None,shape=None):
+    #theta,phi (degrees) for every plane grid point, shape (PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS) unless given,
+    #indexed [y_index][x_index]
+    shape = (PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS) if shape is None else shape
+    y_val,x_val = np.meshgrid(*plane_axes(shape[0],shape[1]),indexing='ij')
+    return plane_point_angles(y_val,x_val,height)
+
+def spherical_grid_angles():
+    #theta,phi (degrees) for the THETA_INTERVALS x PHI_INTERVALS far field grid
+    theta = np.linspace(0,360,THETA_INTERVALS)
+    phi = np.linspace(0,90,PHI_INTERVALS)
+    return np.meshgrid(theta,phi,indexing='ij')
+
+def Generate_manifoldmatrix_UCA_2D_plane_nf_grid(lambda1):
+    #Vectorized Generate_manifoldmatrix_UCA_2D_plane_nf for the whole plane, shape (PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS,N_MICS)
+    A = np.exp(1j*(2*np.pi/lambda1)*(glob_vars.PLANE_MIC_CENTRE_R_LUT-glob_vars.PLANE_NF_R_LUT))
+    return np.moveaxis(A,0,-1)
+
+def Generate_manifoldmatrix_UCA_2D_cyl_nf_grid(lambda1):
+    #Vectorized Generate_manifoldmatrix_UCA_2D_cyl_nf for the whole cylinder, shape (CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS,6)
+    reference_rad = glob_vars.MIC_CENTRE_R_LUT
+    local_rad = glob_vars.CYL_NF_R_LUT[:6]
+    A = reference_rad/local_rad*np.exp(1j*(2*np.pi/lambda1)*(local_rad-reference_rad)*( np.cos(glob_vars.CYL_NF_THETA_LUT[:6])*np.sin(glob_vars.CYL_NF_PHI_LUT[:6]) ))
+    return np.moveaxis(A,0,-1)
+
+def generate_manifold_grid(geometry,lambda1,theta_offset=0,**params):
+    #Steering vectors of every grid point of a geometry ('pipe','plane','plane_nf','cylinder_nf','spherical') for one wavelength.
+    #params go to the grid function of the geometry (z_start/z_stop for the pipe, height for the plane, shape for both).
+    if geometry == 'pipe':
+        theta,phi = pipe_grid_angles(**params)
+    elif geometry == 'plane':
+        theta,phi = plane_grid_angles(**params)
+    elif geometry == 'spherical':
+        theta,phi = spherical_grid_angles()
+    elif geometry == 'plane_nf':
+        return Generate_manifoldmatrix_UCA_2D_plane_nf_grid(lambda1)
+    elif geometry == 'cylinder_nf':
+        return Generate_manifoldmatrix_UCA_2D_cyl_nf_grid(lambda1)
+    else:
+        raise ValueError(f"Unknown geometry: {geometry}")
+    return Generate_manifoldmatrix_UCA_2D_grid(MIC_RADIUS,theta,phi,lambda1,theta_offset)
+
+def manifold_geometry_params(geometry,theta_offset=0):
+    #Everything from glob_vars the steering vectors of a geometry depend on (apart from the band centres)
+    if geometry == 'pipe':
+        params = (PIPE_LENGTH,PIPE_DIAMETER,PIPE_DISTANCE,PIPE_HEIGHT,PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS)
+    elif geometry in ('plane','plane_nf'):
+        params = (PLANE_LENGTH,PLANE_HEIGHT,PLANE_LENGTH_INTERVALS)
+    elif geometry == 'cylinder_nf':
+        params = (CYLINDER_HEIGHT,CYLINDER_RADIUS,CYLINDER_LENGTH,CYLINDER_CHI,CYLINDER_X_OFFSET,CYLINDER_CHI_OFFSET,CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS)
+    elif geometry == 'spherical':
+        params = (THETA_INTERVALS,PHI_INTERVALS)
+    else:
+        raise ValueError(f"Unknown geometry: {geometry}")
+    return params+(N_MICS,MIC_RADIUS,MIC_ROT,THETA_OFFSET,SPEED_OF_SOUND,theta_offset)
+
+def get_manifold_tensor(geometry,fc,theta_offset=0,cache_dir=None,precision='double',**params):
+    #(bands x grid rows x grid cols x mics) steering tensor for the band centres fc, built once and cached.
+    #Pass cache_dir to persist it across restarts, precision='single' for a complex64 tensor.
+    complex_dtype,_ = precision_dtypes(precision)
+    fc = tuple(float(f) for f in np.atleast_1d(fc))
+    key = (geometry,manifold_geometry_params(geometry,theta_offset),tuple(sorted(params.items())),fc,np.dtype(complex_dtype).name)
+    builder = lambda: np.stack([generate_manifold_grid(geometry,SPEED_OF_SOUND/f,theta_offset,**params) for f in fc]).astype(complex_dtype)
+    return get_cached_manifold(key,builder,cache_dir)
+
+#Wideband covariances from a single spectrum===============================
+def wideband_band_weights(fc,bw,n_samples,fs=SAMPLING_RATE,weighting='butter'):
+    #(bands x rfft bins) weights selecting the bins of every band. 'mask' keeps the bins inside [fc-bw/2,fc+bw/2],
+    #'butter' weights every bin by |H|^4, i.e. the power response of the order 5 filtfilt band pass of the per band path.
+    #Cached, the designs only change with the band plan or the frame length.
+    return _wideband_band_weights(tuple(float(f) for f in fc),float(bw),int(n_samples),float(fs),weighting)
+
+@functools.lru_cache(maxsize=16)
+def _wideband_band_weights(fc,bw,n_samples,fs,weighting):
+    freqs = np.fft.rfftfreq(n_samples,1/fs)
+    W = np.zeros((len(fc),len(freqs)),float)
+    for k,f in enumerate(fc):
+        if weighting == 'mask':
+            W[k] = (freqs>=f-bw/2)&(freqs<=f+bw/2)
+        elif weighting == 'butter':
+            _,h = signal.sosfreqz(butter_sos(5,f-bw/2,f+bw/2,fs),worN=freqs,fs=fs)
+            W[k] = np.abs(h)**4
+        else:
+            raise ValueError(f"Unknown weighting: {weighting}")
+    W[W<1e-6*W.max(axis=1,keepdims=True)] = 0 #drop the stop band, it only costs time
+    W = W/W.sum(axis=1,keepdims=True)
+    W.flags.writeable = False #shared between callers
+    return W
+
+def band_covariances_wideband(data,W,precision=None):
+    #Spatial covariance of every band (bands x N_MICS x N_MICS) from one rfft per channel.
+    #data is (samples x mics), W comes from wideband_band_weights for the same number of samples.
+    complex_dtype,real_dtype = precision_dtypes(precision)
+    used = np.flatnonzero(W.any(axis=0))
+    X = np.fft.rfft(data,axis=0)[used].astype(complex_dtype,copy=False) #only the bins some band needs
+    n_mics = X.shape[1]
+    Q = (np.conjugate(X)[:,:,np.newaxis]*X[:,np.newaxis,:]).reshape(len(used),n_mics*n_mics) #per bin X^H.X
+    return np.matmul(W[:,used].astype(real_dtype),Q).reshape(len(W),n_mics,n_mics)
+
+def estimate_music_spectrum_from_covariance(R,A_uca,n_sources=2,precision=None):
+    #MUSIC pseudospectrum of the grid A_uca (...,mics) for one band covariance R
+    un = noise_subspaces(R[np.newaxis],n_sources,precision)
+    return music_pseudospectra(A_uca[np.newaxis],un,precision)[0]
+
 def Generate_manifoldmatrix_UCA_2D_cyl_nf(R, y_index, delta_index, lambda1):
     A=[]
     #reference_rad = CYL_NF_R_LUT[4][y_index][delta_index] #use instead of R
-    reference_rad = MIC_CENTRE_R_LUT[y_index][delta_index] #use instead of R
+    reference_rad = glob_vars.MIC_CENTRE_R_LUT[y_index][delta_index] #use instead of R
     for mic_index in range(6):
-        theta = CYL_NF_THETA_LUT[mic_index][y_index][delta_index]
-        phi = CYL_NF_PHI_LUT[mic_index][y_index][delta_index]
-        local_rad = CYL_NF_R_LUT[mic_index][y_index][delta_index] #use instead of R
+        theta = glob_vars.CYL_NF_THETA_LUT[mic_index][y_index][delta_index]
+        phi = glob_vars.CYL_NF_PHI_LUT[mic_index][y_index][delta_index]
+        local_rad = glob_vars.CYL_NF_R_LUT[mic_index][y_index][delta_index] #use instead of R
         #A.append( np.exp(1j*(2*np.pi/lambda1)*   R   *( np.cos((theta))* np.sin(phi) ) ) ) #No near field assumptions except theta and phi
         A.append( reference_rad/local_rad*np.exp(1j*(2*np.pi/lambda1)*   (local_rad-reference_rad)   *( np.cos((theta))* np.sin(phi) ) ) ) #as per paper #attempt 1 folder
         #A.append( reference_rad/local_rad*np.exp(1j*(2*np.pi/lambda1)*   abs(local_rad-reference_rad)   *( np.cos((theta))* np.sin(phi) ) ) ) #abs of path difference
@@ -279,7 +370,7 @@ def Generate_manifoldmatrix_UCA_2D_cyl_nf(R, y_index, delta_index, lambda1):
 
     return np.array(A)
 
-def estimate_music_spectrum_2D_plane_another(data,bpFilt,fc,indx,theta_offset=0): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
+def estimate_music_spectrum_2D_plane_another(data,bpFilt,fc,indx,theta_offset=0,A_uca=None): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
     global MIC_RADIUS, PLANE_LENGTH,PLANE_HEIGHT,PLANE_LENGTH_INTERVALS,N_MICS
     
     tmp1 = sp.signal.filtfilt(bpFilt[:,0],1,data[:,0],padlen=0)
@@ -297,56 +388,19 @@ def estimate_music_spectrum_2D_plane_another(data,bpFilt,fc,indx,theta_offset=0)
     
     R = np.matmul(np.conjugate(np.transpose(temp_data1)),temp_data1)/len(temp_data1) #temp_data1^Hermitian . temp_data1
     #print(R)
-    u, s, vh = np.linalg.svd(R, full_matrices=True)
-    un = u.take(np.arange(2,N_MICS,1),axis=1) #was 2,4,1
-
-    p_music = np.ones((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float)
-
-    x_index=0
-    for x_val in np.linspace(-PLANE_LENGTH/2,PLANE_LENGTH/2,PLANE_LENGTH_INTERVALS):
-        x=x_val
-        z=PLANE_HEIGHT#always +ve
-        
-        y_index = 0
-        for y_val in np.linspace(-PLANE_LENGTH/2,PLANE_LENGTH/2,PLANE_LENGTH_INTERVALS):
-            
-            r=np.sqrt(x**2+y_val**2+z**2) #to find phi only.
-            theta = np.arctan(y_val/x)
-            phi = np.arccos(z/r) #always +ve
-
-            #theta winding
-            if x>=0 and y_val>=0:
-                theta=theta
-            elif x<0 and y_val>=0: #2nd quadrant
-                theta = np.pi+theta
-            elif x<0 and y_val<0: #3rd quadrant
-                theta = np.pi+theta
-            elif x>=0 and y_val<0:
-                theta = 2*np.pi+theta
+    un = noise_subspaces(R[np.newaxis],precision='double')[0]
 
+    #final payload, evaluated for the whole grid at once
+    if A_uca is None:
+        A_uca = get_manifold_tensor('plane',fc,theta_offset)[0]
+    p_music = estimate_music_spectrum_grid(A_uca,un)
 
-            #final payload
-            A_uca = Generate_manifoldmatrix_UCA_2D(rad,theta*180/np.pi, phi*180/np.pi, lambda1,theta_offset)
-            temp1 = np.matmul(np.transpose(np.conjugate(A_uca)),un)
-            temp2 = np.matmul(np.transpose(np.conjugate(un)),A_uca) 
-            p_music[y_index][x_index] = abs(1/np.matmul(temp1,temp2))
-            
-            y_index+=1
-            
-        x_index+=1
-        
     return p_music
 
-def estimate_music_spectrum_2D_plane_varyband(data,fc,bw,indx,theta_offset=0): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
+def estimate_music_spectrum_2D_plane_varyband(data,fc,bw,indx,theta_offset=0,A_uca=None): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
     global MIC_RADIUS, PLANE_LENGTH,PLANE_HEIGHT,PLANE_LENGTH_INTERVALS,N_MICS
-    tmp1 = butter_bandpass_filter(data[:,0],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5)
-    temp_data = np.zeros((len(tmp1),N_MICS), float);
-    temp_data1 = np.zeros((int(len(tmp1)/2),N_MICS), complex);
-    for k in range(N_MICS):
-        temp_data[:,k] = butter_bandpass_filter(data[:,k],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5)
-        temp1 = np.fft.fft(temp_data[:,k])
-        temp2 = temp1[0:int(len(temp1)/2):1]
-        temp_data1[:,k] = temp2
+    temp_data = butter_bandpass_filter(data[:,:N_MICS],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5, axis=0) #all channels at once
+    temp_data1 = np.fft.fft(temp_data,axis=0)[:len(temp_data)//2]
 
     lambda1 = SPEED_OF_SOUND/fc
     #d = 5.72e-2
@@ -354,44 +408,13 @@ def estimate_music_spectrum_2D_plane_varyband(data,fc,bw,indx,theta_offset=0): #
     
     R = np.matmul(np.conjugate(np.transpose(temp_data1)),temp_data1)/len(temp_data1) #temp_data1^Hermitian . temp_data1
     #print(R)
-    u, s, vh = np.linalg.svd(R, full_matrices=True)
-    un = u.take(np.arange(2,N_MICS,1),axis=1) #was 2,4,1
+    un = noise_subspaces(R[np.newaxis],precision='double')[0]
 
-    p_music = np.ones((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float)
+    #final payload, evaluated for the whole grid at once
+    if A_uca is None:
+        A_uca = get_manifold_tensor('plane',fc,theta_offset)[0]
+    p_music = estimate_music_spectrum_grid(A_uca,un)
 
-    x_index=0
-    for x_val in np.linspace(-PLANE_LENGTH/2,PLANE_LENGTH/2,PLANE_LENGTH_INTERVALS):
-        x=x_val
-        z=PLANE_HEIGHT#always +ve
-        
-        y_index = 0
-        for y_val in np.linspace(-PLANE_LENGTH/2,PLANE_LENGTH/2,PLANE_LENGTH_INTERVALS):
-            
-            r=np.sqrt(x**2+y_val**2+z**2) #to find phi only.
-            theta = np.arctan(y_val/x)
-            phi = np.arccos(z/r) #always +ve
-
-            #theta winding
-            if x>=0 and y_val>=0:
-                theta=theta
-            elif x<0 and y_val>=0: #2nd quadrant
-                theta = np.pi+theta
-            elif x<0 and y_val<0: #3rd quadrant
-                theta = np.pi+theta
-            elif x>=0 and y_val<0:
-                theta = 2*np.pi+theta
-
-
-            #final payload
-            A_uca = Generate_manifoldmatrix_UCA_2D(rad,theta*180/np.pi, phi*180/np.pi, lambda1,theta_offset)
-            temp1 = np.matmul(np.transpose(np.conjugate(A_uca)),un)
-            temp2 = np.matmul(np.transpose(np.conjugate(un)),A_uca) 
-            p_music[y_index][x_index] = abs(1/np.matmul(temp1,temp2))
-            
-            y_index+=1
-            
-        x_index+=1
-        
     return p_music
 
 
@@ -399,11 +422,11 @@ def estimate_music_spectrum_2D_plane_varyband(data,fc,bw,indx,theta_offset=0): #
 def Generate_manifoldmatrix_UCA_2D_plane_nf(R, y_index, x_index, lambda1):
     A=[]
     #reference_rad = CYL_NF_R_LUT[4][y_index][delta_index] #use instead of R
-    reference_rad = PLANE_MIC_CENTRE_R_LUT[y_index][x_index] #use instead of R
+    reference_rad = glob_vars.PLANE_MIC_CENTRE_R_LUT[y_index][x_index] #use instead of R
     for mic_index in range(N_MICS):
-        theta = PLANE_NF_THETA_LUT[mic_index][y_index][x_index]
-        phi = PLANE_NF_PHI_LUT[mic_index][y_index][x_index]
-        local_rad = PLANE_NF_R_LUT[mic_index][y_index][x_index] #use instead of R
+        theta = glob_vars.PLANE_NF_THETA_LUT[mic_index][y_index][x_index]
+        phi = glob_vars.PLANE_NF_PHI_LUT[mic_index][y_index][x_index]
+        local_rad = glob_vars.PLANE_NF_R_LUT[mic_index][y_index][x_index] #use instead of R
         #A.append( np.exp(1j*(2*np.pi/lambda1)*   R   *( np.cos((theta))* np.sin(phi) ) ) ) #No near field assumptions except theta and phi
         #A.append( reference_rad/local_rad*np.exp(1j*(2*np.pi/lambda1)*   (local_rad-reference_rad)   *( np.cos((theta))* np.sin(phi) ) ) ) #as per paper #attempt 1 folder
         #A.append( reference_rad/local_rad*np.exp(1j*(2*np.pi/lambda1)*   abs(local_rad-reference_rad)   *( np.cos((theta))* np.sin(phi) ) ) ) #abs of path difference
@@ -415,16 +438,10 @@ def Generate_manifoldmatrix_UCA_2D_plane_nf(R, y_index, x_index, lambda1):
     return np.array(A)
 
 
-def estimate_music_spectrum_2D_plane_varyband_nf(data,fc,bw,indx,theta_offset=0): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
+def estimate_music_spectrum_2D_plane_varyband_nf(data,fc,bw,indx,theta_offset=0,A_uca=None): #Here, fc is frequency of the band which was selected in the above function. indx is the corresponding band index.
     global MIC_RADIUS, PLANE_LENGTH,PLANE_HEIGHT,PLANE_LENGTH_INTERVALS,N_MICS
-    tmp1 = butter_bandpass_filter(data[:,0],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5)
-    temp_data = np.zeros((len(tmp1),N_MICS), float);
-    temp_data1 = np.zeros((int(len(tmp1)/2),N_MICS), complex);
-    for k in range(N_MICS):
-        temp_data[:,k] = butter_bandpass_filter(data[:,k],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5)
-        temp1 = np.fft.fft(temp_data[:,k])
-        temp2 = temp1[0:int(len(temp1)/2):1]
-        temp_data1[:,k] = temp2
+    temp_data = butter_bandpass_filter(data[:,:N_MICS],fc-bw/2, fc+bw/2, SAMPLING_RATE, order=5, axis=0) #all channels at once
+    temp_data1 = np.fft.fft(temp_data,axis=0)[:len(temp_data)//2]
 
     lambda1 = SPEED_OF_SOUND/fc
     #d = 5.72e-2
@@ -432,42 +449,11 @@ def estimate_music_spectrum_2D_plane_varyband_nf(data,fc,bw,indx,theta_offset=0)
     
     R = np.matmul(np.conjugate(np.transpose(temp_data1)),temp_data1)/len(temp_data1) #temp_data1^Hermitian . temp_data1
     #print(R)
-    u, s, vh = np.linalg.svd(R, full_matrices=True)
-    un = u.take(np.arange(2,N_MICS,1),axis=1) #was 2,4,1
-
-    p_music = np.ones((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float)
-
-    x_index=0
-    for x_val in np.linspace(-PLANE_LENGTH/2,PLANE_LENGTH/2,PLANE_LENGTH_INTERVALS):
-        x=x_val
-        z=PLANE_HEIGHT#always +ve
-        
-        y_index = 0
-        for y_val in np.linspace(-PLANE_LENGTH/2,PLANE_LENGTH/2,PLANE_LENGTH_INTERVALS):
-            
-            r=np.sqrt(x**2+y_val**2+z**2) #to find phi only.
-            theta = np.arctan(y_val/x)
-            phi = np.arccos(z/r) #always +ve
-
-            #theta winding
-            if x>=0 and y_val>=0:
-                theta=theta
-            elif x<0 and y_val>=0: #2nd quadrant
-                theta = np.pi+theta
-            elif x<0 and y_val<0: #3rd quadrant
-                theta = np.pi+theta
-            elif x>=0 and y_val<0:
-                theta = 2*np.pi+theta
+    un = noise_subspaces(R[np.newaxis],precision='double')[0]
 
+    #final payload, evaluated for the whole grid at once
+    if A_uca is None:
+        A_uca = get_manifold_tensor('plane_nf',fc,theta_offset)[0]
+    p_music = estimate_music_spectrum_grid(A_uca,un)
 
-            #final payload
-            A_uca = Generate_manifoldmatrix_UCA_2D_plane_nf(rad,y_index, x_index, lambda1)
-            temp1 = np.matmul(np.transpose(np.conjugate(A_uca)),un)
-            temp2 = np.matmul(np.transpose(np.conjugate(un)),A_uca) 
-            p_music[y_index][x_index] = abs(1/np.matmul(temp1,temp2))
-            
-            y_index+=1
-            
-        x_index+=1
-        
     return p_music
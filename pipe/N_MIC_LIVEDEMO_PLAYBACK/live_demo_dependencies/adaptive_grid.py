@@ -0,0 +1,124 @@
+import numpy as np
+from scipy import ndimage
+from .glob_vars import *
+from .music_engine import *
+
+#Coarse-to-fine MUSIC search for geometries with continuous coordinates (pipe, plane). The pseudospectrum is
+#evaluated on a coarse grid, then only around the top_k coarse peaks on successively finer local grids until the
+#spacing reaches target_resolution (cm). The full resolution heatmap is the coarse map interpolated to out_shape,
+#with the grid points around every peak evaluated exactly.
+
+def combine_bands(spectra,scale,magType='linadd'):
+    #Composite of (bands x ...) pseudospectra, the same combinations as MusicEngine.process_covariances.
+    #scale holds the per band normalization (the band maxima of the coarse grid), so values from different
+    #refinement levels stay comparable.
+    scale = np.reshape(scale,(len(spectra),)+(1,)*(spectra.ndim-1))
+    if magType == 'lin':
+        return np.prod(spectra/scale,axis=0)
+    elif magType == 'log':
+        return 10*np.sum(np.log10(spectra),axis=0)/len(spectra)
+    elif magType == 'linadd':
+        return np.sum(spectra/scale,axis=0)
+    else: #linaddwithoutnorm
+        return np.sum(spectra,axis=0)
+
+MAX_REFINE_LEVELS = 32 #bound on the refinement levels per peak (a 5 point grid shrinks 2^32 fold)
+
+class AdaptiveMusic:
+    #engine: MusicEngine of a pipe or plane geometry, supplies covariances, noise subspaces, band plan and magType.
+    #coarse_shape: grid of the first pass (default: the engine grid halved, at least 3 points per axis).
+    #out_shape: shape of the returned heatmap (default: the engine grid). refine_points: points per axis of every
+    #local grid (at least 4), each level shrinks the spacing by (refine_points-1)/2. Refinement also stops after
+    #MAX_REFINE_LEVELS levels, whatever target_resolution is.
+    def __init__(self,engine,coarse_shape=None,out_shape=None,top_k=2,target_resolution=1.,refine_points=5):
+        if refine_points < 4:
+            raise ValueError("refine_points must be at least 4, with 3 the local grids do not shrink")
+        geometry = engine.geometry
+        self.engine = engine
+        self.geometry = geometry
+        self.top_k = top_k
+        self.target_resolution = target_resolution
+        self.refine_points = refine_points
+        self.coarse_shape = tuple(max(3,n//2) for n in geometry.shape) if coarse_shape is None else tuple(coarse_shape)
+        self.out_shape = geometry.shape if out_shape is None else tuple(out_shape)
+
+        #Coarse steering tensor is fixed, build it once
+        self.coarse_axes = geometry.axes(self.coarse_shape)
+        rows,cols = np.meshgrid(*self.coarse_axes,indexing='ij')
+        self.coarse_manifold = geometry.point_steering(engine.fc,rows,cols,engine.precision)
+        self.out_axes = geometry.axes(self.out_shape)
+        self.step = np.array([abs(a[1]-a[0]) if len(a)>1 else 0. for a in self.coarse_axes])
+        self.bounds = np.array([[min(a[0],a[-1]),max(a[0],a[-1])] for a in self.coarse_axes])
+
+    def _composite(self,un,rows,cols):
+        #composite at arbitrary points
+        A = self.geometry.point_steering(self.engine.fc,rows,cols,self.engine.precision)
+        return combine_bands(music_pseudospectra(A,un,self.engine.precision),self.scale,self.engine.magType)
+
+    def _refine(self,un,centre):
+        #local grid search around one coarse peak down to target_resolution
+        offsets = np.linspace(-1,1,self.refine_points)
+        step = self.step.copy()
+        for _ in range(MAX_REFINE_LEVELS):
+            rows = np.clip(centre[0]+offsets*step[0],*self.bounds[0])
+            cols = np.clip(centre[1]+offsets*step[1],*self.bounds[1])
+            values = self._composite(un,rows[:,np.newaxis],cols[np.newaxis,:])
+            i,j = np.unravel_index(np.argmax(values),values.shape)
+            centre,value = (rows[i],cols[j]),values[i,j]
+            step = step*2/(self.refine_points-1) #spacing of the grid just evaluated
+            if step.max() <= self.target_resolution:
+                break
+        return centre,value
+
+    def _fill_exact(self,heatmap,un,centre):
+        #replace the interpolated values within one coarse step of a peak by exact evaluations
+        near = [np.flatnonzero(np.abs(a-c)<=s) for a,c,s in zip(self.out_axes,centre,self.step)]
+        if len(near[0]) and len(near[1]):
+            heatmap[np.ix_(*near)] = self._composite(un,self.out_axes[0][near[0],np.newaxis],self.out_axes[1][np.newaxis,near[1]])
+
+    def process_covariances(self,R=None):
+        #Heatmap (out_shape) and peaks (top_k x 3: row coordinate, col coordinate, composite value, strongest first)
+        #from band covariances (engine.R unless R is given)
+        R = self.engine.R if R is None else R
+        un = noise_subspaces(R,self.engine.n_sources,self.engine.precision)
+
+        spectra = music_pseudospectra(self.coarse_manifold,un,self.engine.precision)
+        self.scale = spectra.reshape(len(spectra),-1).max(axis=1)
+        coarse = combine_bands(spectra,self.scale,self.engine.magType)
+
+        #top_k local maxima of the coarse map
+        is_peak = coarse == ndimage.maximum_filter(coarse,size=3,mode='nearest')
+        candidates = np.flatnonzero(is_peak)
+        candidates = candidates[np.argsort(coarse.ravel()[candidates])[::-1][:self.top_k]]
+
+        #interpolated full resolution map
+        fractional = [np.linspace(0,n-1,m) for n,m in zip(self.coarse_shape,self.out_shape)]
+        heatmap = ndimage.map_coordinates(coarse,np.meshgrid(*fractional,indexing='ij'),order=1,mode='nearest')
+
+        peaks = []
+        for index in candidates:
+            i,j = np.unravel_index(index,coarse.shape)
+            centre,value = self._refine(un,(self.coarse_axes[0][i],self.coarse_axes[1][j]))
+            self._fill_exact(heatmap,un,centre)
+            peaks.append((centre[0],centre[1],value))
+        peaks = np.array(sorted(peaks,key=lambda p: -p[2])).reshape(-1,3)
+        return heatmap,peaks
+
+    def process(self,frame):
+        #(samples x channels) frame -> (heatmap, peaks)
+        self.engine.covariances(frame)
+        return self.process_covariances()
+
+_ADAPTIVE = {}
+
+def get_adaptive_music(engine,**kwargs):
+    #AdaptiveMusic shared per engine and settings
+    key = (id(engine),tuple(sorted(kwargs.items())))
+    adaptive = _ADAPTIVE.get(key)
+    if adaptive is None or adaptive.engine is not engine:
+        _ADAPTIVE.pop(key,None)
+        if len(_ADAPTIVE) >= MAX_ENGINES: #keeps its engine alive, bounded like the engines
+            _ADAPTIVE.pop(next(iter(_ADAPTIVE)))
+        adaptive = AdaptiveMusic(engine,**kwargs)
+        _ADAPTIVE[key] = adaptive
+    return adaptive
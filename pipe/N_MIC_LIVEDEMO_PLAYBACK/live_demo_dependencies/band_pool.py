@@ -0,0 +1,94 @@
+import atexit
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from .music_engine import *
+
+#Band parallel covariances for the filtered covariance modes ('butter','fir') of MusicEngine. The filtfilt + FFT per
+#band is the expensive part of these modes, so band groups are spread over a persistent process pool. The frame is
+#handed to the workers through one shared memory block (it is not pickled per task) and only the small band
+#covariances come back; eigendecompositions, spectra and band combination stay batched in the calling process.
+#The pool is usually started lazily from a processing thread while other threads (Flask, acquisition) hold locks, so
+#workers are never forked from the caller: they come from a forkserver (spawned where there is none, Windows). Either
+#way they import the entry script, which needs a __main__ guard.
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+#Worker side================================================================
+_attached = {} #shared memory blocks attached in this worker, by name
+
+def _attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        for old in _attached.values(): #the parent reallocated, drop the old block
+            old.close()
+        _attached.clear()
+        shm = _attached[name] = shared_memory.SharedMemory(name=name)
+    return shm
+
+def _group_covariances(name,shape,dtype,filters,padlen,complex_dtype):
+    data = np.ndarray(shape,dtype,buffer=_attach(name).buf)
+    out = np.empty((len(filters),shape[1],shape[1]),complex_dtype)
+    band_covariances_filtered(data,filters,out,padlen)
+    del data #release the view before the block can be closed
+    return out
+
+#Pool=========================================================================
+class BandPool:
+    #Persistent pool of max_workers processes (default os.cpu_count()), bands are split into that many groups.
+    #Calls are synchronous and reuse one shared frame, so use one pool per processing thread.
+    def __init__(self,max_workers=None):
+        self.executor = ProcessPoolExecutor(max_workers,mp_context=multiprocessing.get_context(START_METHOD))
+        self.max_workers = self.executor._max_workers
+        self.shm = None
+        self.frame = None
+
+    def _share(self,data):
+        #copy data (float64) into the shared block, growing it if needed
+        nbytes = data.shape[0]*data.shape[1]*8
+        if self.shm is None or self.shm.size < nbytes:
+            self._release()
+            self.shm = shared_memory.SharedMemory(create=True,size=max(nbytes,1))
+        self.frame = np.ndarray(data.shape,np.float64,buffer=self.shm.buf)
+        self.frame[...] = data
+        return self.frame
+
+    def covariances(self,engine,frame):
+        #engine.covariances(frame), with the bands computed in parallel. Returns engine.R. Timed as the engine's
+        #'covariance' stage, like the serial path.
+        if engine.covariance == 'wideband': #one FFT for all bands, nothing to distribute
+            return engine.covariances(frame)
+        with engine._stage('covariance'):
+            data = self._share(np.asarray(frame)[:,:engine.geometry.n_mics])
+            groups = [g for g in np.array_split(np.arange(len(engine.fc)),self.max_workers) if len(g)]
+            futures = [self.executor.submit(_group_covariances,self.shm.name,data.shape,data.dtype.str,
+                                            [engine.filters[k] for k in g],engine.padlen,engine.R.dtype.str) for g in groups]
+            for g,future in zip(groups,futures): #in band order
+                engine.R[g] = future.result()
+        return engine.R
+
+    def process(self,engine,frame):
+        #engine.process(frame) with parallel band covariances: (composite, per_band)
+        self.covariances(engine,frame)
+        return engine.process_covariances()
+
+    def _release(self):
+        if self.shm is not None:
+            self.frame = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        self.executor.shutdown()
+        self._release()
+
+_POOL = None
+
+def get_band_pool(max_workers=None):
+    #Process wide BandPool, started on first use and shut down at exit
+    global _POOL
+    if _POOL is None:
+        _POOL = BandPool(max_workers)
+        atexit.register(_POOL.close)
+    return _POOL
@@ -0,0 +1,234 @@
+import time
+import numpy as np
+from scipy import signal
+from .glob_vars import *
+from .DOA_supporting_functions import mic_positions
+
+#Acquisition backends. Every backend fills (channels x samples) float64 buffers in place and blocks like
+#nidaqmx's AnalogMultiChannelReader.read_many_sample, so acquisition loops do not care whether samples come from
+#NI-DAQ hardware or from the simulator:
+#   with make_daq_backend(DAQ_BACKEND,"Dev1/ai1:9",9,SAMPLING_RATE) as daq:
+#       daq.read(buffer)
+
+DAQ_BACKENDS = ('nidaq','simulator')
+
+class DaqBackend:
+    channels = None
+    sampling_rate = None
+
+    def start(self):
+        pass
+
+    def read(self,buffer):
+        #fill buffer (channels x samples) in place, blocking until the samples are available
+        raise NotImplementedError
+
+    def is_running(self):
+        return True
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+#NI-DAQmx===================================================================
+class NidaqBackend(DaqBackend):
+    #physical_channels e.g. "Dev1/ai1:9" (RSE). samps_per_chan sizes the DAQmx buffer (continuous mode) or the
+    #acquisition (finite mode). nidaqmx is only imported here, so the simulator works without it.
+    def __init__(self,physical_channels,channels,sampling_rate=SAMPLING_RATE,samps_per_chan=None,finite=False):
+        self.physical_channels = physical_channels
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+        self.samps_per_chan = samps_per_chan
+        self.finite = finite
+        self.task = None
+        self.reader = None
+
+    def start(self):
+        import nidaqmx
+        from nidaqmx import stream_readers
+        from nidaqmx.constants import AcquisitionType, TerminalConfiguration
+        self._timeout = nidaqmx.constants.WAIT_INFINITELY
+        self.task = nidaqmx.Task()
+        self.task.ai_channels.add_ai_voltage_chan(self.physical_channels,terminal_config=TerminalConfiguration.RSE)
+        timing = dict(rate=self.sampling_rate,sample_mode=AcquisitionType.FINITE if self.finite else AcquisitionType.CONTINUOUS)
+        if self.samps_per_chan is not None:
+            timing['samps_per_chan'] = self.samps_per_chan
+        self.task.timing.cfg_samp_clk_timing(**timing)
+        self.reader = stream_readers.AnalogMultiChannelReader(self.task.in_stream)
+
+    def read(self,buffer):
+        self.reader.read_many_sample(buffer,buffer.shape[1],timeout=self._timeout)
+        return buffer
+
+    def is_running(self):
+        try:
+            return self.task is not None and self.task.is_task_done() is False
+        except Exception:
+            return False
+
+    def close(self):
+        if self.task is not None:
+            self.task.stop()
+            self.task.close()
+            self.task = None
+
+#Simulator==================================================================
+#Source positions are (x,y,z) cm in the frame of mic_positions(). The steering vectors conjugate against the
+#covariances (R = X^H.X), which THETA_OFFSET (180) compensates by half a turn, so every grid is mirrored through
+#the array axis: pipe grid point (y,z) sits at (-PIPE_DISTANCE,-y,z), plane grid point (y,x) at (-x,-y,height).
+def pipe_source_position(y,z=PIPE_HEIGHT):
+    return (-PIPE_DISTANCE,-y,z)
+
+def plane_source_position(y,x,height=PLANE_HEIGHT):
+    return (-x,-y,height)
+
+class SimulatedSource:
+    #Point source for the simulator. position: (x,y,z) in cm, see above. band: (low,high) Hz of a band limited
+    #noise source, or tones: list of frequencies (Hz) of a tonal one. snr_db: level at the array centre relative
+    #to the sensor noise.
+    def __init__(self,position,band=(1000,7000),tones=None,snr_db=10):
+        self.position = np.asarray(position,float)/100
+        self.band = band
+        self.tones = tones
+        self.snr_db = snr_db
+
+class SimulatedBackend(DaqBackend):
+    #Synthesizes the signals of a UCA with the glob_vars geometry (mic_positions()) from point sources: every
+    #source signal reaches mic m after r_m/SPEED_OF_SOUND with 1/r_m spreading (spherical waves, so near and far
+    #field are both exact), applied as a windowed sinc fractional delay. Plus white sensor noise of noise_level
+    #V rms and a DC offset per channel. Signals are continuous across reads. realtime=True paces reads at
+    #sampling_rate like hardware, realtime=False returns as fast as possible (benchmarks).
+    def __init__(self,sources=(),channels=N_MICS,sampling_rate=SAMPLING_RATE,noise_level=0.01,offset=0.,
+                 realtime=True,seed=None,half_taps=16):
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+        self.sources = list(sources)
+        self.noise_level = noise_level
+        self.offset = offset
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.half_taps = half_taps
+
+        mics = mic_positions()[:channels]
+        if len(mics) < channels: #extra channels (not mics) only get noise and offset
+            mics = np.vstack([mics,np.full((channels-len(mics),3),np.nan)])
+        self._states = [self._source_state(source,mics) for source in self.sources]
+        self.samples_read = 0
+        self.t_start = None
+
+    def _source_state(self,source,mics):
+        #fractional delay kernels (channels x taps) and signal generator state of one source
+        fs = self.sampling_rate
+        amplitude = self.noise_level*10**(source.snr_db/20)
+        r_centre = np.linalg.norm(source.position)
+        r = np.linalg.norm(mics-source.position,axis=1)
+        delays = (r-np.nanmin(r))/SPEED_OF_SOUND*fs #relative delays in samples
+        n_taps = 2*self.half_taps+int(np.ceil(np.nanmax(delays)))+1
+        n = np.arange(n_taps)[np.newaxis,:]
+        centre = self.half_taps+delays[:,np.newaxis]
+        kernels = np.sinc(n-centre)*np.where(np.abs(n-centre)<=self.half_taps,np.cos(np.pi*(n-centre)/(2*self.half_taps))**2,0)
+        kernels *= (r_centre/r)[:,np.newaxis] #spherical spreading, unity at the array centre
+        kernels[np.isnan(kernels)] = 0 #channels without a mic
+
+        state = {'source':source,'kernels':kernels[:,::-1].T.copy(),'history':np.zeros(n_taps-1),'amplitude':amplitude}
+        if source.tones is not None:
+            state['phase'] = self.rng.uniform(0,2*np.pi,len(source.tones))
+        else:
+            low,high = source.band
+            state['sos'] = signal.butter(6,[low,high],btype='band',fs=fs,output='sos')
+            state['zi'] = np.zeros((state['sos'].shape[0],2))
+            state['noise_gain'] = amplitude/np.sqrt(2*(high-low)/fs) #white noise std giving amplitude rms in band
+        return state
+
+    def _source_signal(self,state,n_samples):
+        source = state['source']
+        if source.tones is not None:
+            t = np.arange(n_samples)/self.sampling_rate
+            omega = 2*np.pi*np.asarray(source.tones,float)
+            tones = np.sin(state['phase'][:,np.newaxis]+omega[:,np.newaxis]*t)
+            state['phase'] = np.mod(state['phase']+omega*n_samples/self.sampling_rate,2*np.pi)
+            return state['amplitude']*np.sqrt(2/len(source.tones))*tones.sum(axis=0)
+        noise = self.rng.standard_normal(n_samples)*state['noise_gain']
+        out,state['zi'] = signal.sosfilt(state['sos'],noise,zi=state['zi'])
+        return out
+
+    def synthesize(self,n_samples):
+        #next (channels x n_samples) block
+        data = self.rng.standard_normal((self.channels,n_samples))*self.noise_level+self.offset
+        for state in self._states:
+            stream = np.concatenate([state['history'],self._source_signal(state,n_samples)])
+            windows = np.lib.stride_tricks.sliding_window_view(stream,len(state['history'])+1)
+            data += (windows@state['kernels']).T
+            state['history'] = stream[n_samples:]
+        return data
+
+    def start(self):
+        self.t_start = time.time()
+        self.samples_read = 0
+
+    def read(self,buffer):
+        buffer[...] = self.synthesize(buffer.shape[1])
+        self.samples_read += buffer.shape[1]
+        if self.realtime:
+            if self.t_start is None:
+                self.start()
+                self.samples_read = buffer.shape[1]
+            wait = self.t_start+self.samples_read/self.sampling_rate-time.time()
+            if wait > 0:
+                time.sleep(wait)
+        return buffer
+
+def make_daq_backend(kind,physical_channels,channels,sampling_rate=SAMPLING_RATE,samps_per_chan=None,finite=False,**simulator_kwargs):
+    #Backend by name ('nidaq' or 'simulator'). simulator_kwargs (sources, noise_level, offset, realtime, seed) only
+    #apply to the simulator.
+    if kind == 'nidaq':
+        return NidaqBackend(physical_channels,channels,sampling_rate,samps_per_chan,finite)
+    elif kind == 'simulator':
+        return SimulatedBackend(channels=channels,sampling_rate=sampling_rate,**simulator_kwargs)
+    raise ValueError(f"Unknown DAQ backend: {kind}")
+
+#Frame assembly=============================================================
+class BlockFrameBuffer:
+    #Preallocated acquisition of (samples x channels) frames of frame_blocks reads of block_size samples each, a new
+    #frame every hop_blocks reads (default frame_blocks; fewer gives overlapping frames). Every read goes straight
+    #into its own contiguous (channels x block_size) slot of a block ring, as read_many_sample needs, and nothing grows:
+    #   daq.read(frames.write_slot())
+    #   if frames.commit(): data = frames.assemble(gain)
+    def __init__(self,channels,block_size,frame_blocks,hop_blocks=None):
+        self.block_size = block_size
+        self.frame_blocks = frame_blocks
+        self.hop_blocks = frame_blocks if hop_blocks is None else hop_blocks
+        if not 0 < self.hop_blocks <= frame_blocks:
+            raise ValueError(f"hop_blocks must be between 1 and {frame_blocks}")
+        self.blocks = np.zeros((frame_blocks,channels,block_size))
+        self.frame = np.zeros((frame_blocks*block_size,channels))
+        self.index = 0 #slot of the next read, i.e. the oldest block
+        self.pending = frame_blocks #reads until the next frame, the first one needs all blocks
+
+    def write_slot(self):
+        #(channels x block_size) slot of the next read, to be filled in place
+        return self.blocks[self.index]
+
+    def commit(self):
+        #the slot from write_slot() is filled, True when a frame is complete
+        self.index = (self.index+1)%self.frame_blocks
+        self.pending -= 1
+        return self.pending == 0
+
+    def assemble(self,gain=1):
+        #the newest frame_blocks reads in order as (samples x channels), mean removed per channel and times gain.
+        #Returns self.frame, overwritten by the next assemble().
+        self.pending = self.hop_blocks
+        frame = self.frame.reshape(self.frame_blocks,self.block_size,-1)
+        older = self.frame_blocks-self.index
+        frame[:older] = self.blocks[self.index:].transpose(0,2,1)
+        frame[older:] = self.blocks[:self.index].transpose(0,2,1)
+        self.frame -= self.frame.mean(axis=0)
+        self.frame *= gain
+        return self.frame
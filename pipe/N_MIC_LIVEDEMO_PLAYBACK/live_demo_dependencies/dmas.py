@@ -1,8 +1,21 @@
 import numpy as np
 from scipy.io import wavfile
 import scipy.signal as signal
+import scipy.fft as sp_fft
 from .BPF import *
-def dmas(data1, sample_rate,theta, phi, radius, lowcut=None,highcut=None,speed_of_sound=343): #mic radius in meters
+
+def fractional_delay(channels,shifts):
+    #Delay every row of channels (channels x samples) by shifts (samples, may be fractional) with a linear phase in the
+    #frequency domain, zeros before the delayed signal. Zero padded past the largest shift so nothing wraps around.
+    num_samples = channels.shape[1]
+    n_fft = sp_fft.next_fast_len(num_samples+int(np.ceil(np.max(shifts,initial=0)))+1,real=True)
+    spectrum = sp_fft.rfft(channels,n_fft,axis=1)
+    spectrum *= np.exp(-2j*np.pi*sp_fft.rfftfreq(n_fft)*np.asarray(shifts,float)[:,np.newaxis])
+    delayed = sp_fft.irfft(spectrum,n_fft,axis=1)[:,:num_samples]
+    delayed[np.arange(num_samples)<np.ceil(shifts)[:,np.newaxis]] = 0 #interpolation ripple ahead of the signal
+    return delayed
+
+def dmas(data1, sample_rate,theta, phi, radius, lowcut=None,highcut=None,speed_of_sound=343,fractional=False): #mic radius in meters
     # Read the input wav file============================================
     #sample_rate, data1 = wavfile.read(input_wav)
 
@@ -50,30 +63,45 @@ def dmas(data1, sample_rate,theta, phi, radius, lowcut=None,highcut=None,speed_o
     delays -= np.min(delays)  # Normalize delays so that the smallest delay is zero
     #print(delays)
 
+    #Delayed signed roots of every channel=============================
+    #DMAS multiplies delayed channels pairwise and takes sign(x)*sqrt(|x|) of every product. That is multiplicative,
+    #so the roots are taken once per channel: root_j[c] is the signed root of channel c slid right by its delay, with
+    #ones before the channel starts (a reference is left unmultiplied there). fractional=True applies the exact delays
+    #as frequency domain phase shifts instead of truncating them to whole samples.
+    shifts = delays*sample_rate
+    valid = shifts < num_samples
+    if fractional:
+        shifted = fractional_delay(data.T,shifts)
+        started = np.arange(num_samples)>=np.ceil(shifts)[:,np.newaxis]
+        root_j = np.copysign(np.sqrt(np.abs(shifted)),shifted)
+        root_j[~started] = 1
+    else:
+        shifts = np.minimum(shifts.astype(int),num_samples)
+        started = np.arange(num_samples)>=shifts[:,np.newaxis]
+        max_shift = shifts.max()
+        padded = np.ones((max_shift+num_samples,num_channels))
+        root = padded[max_shift:]
+        np.abs(data,out=root)
+        np.sqrt(root,out=root)
+        np.copysign(root,data,out=root)
+        #all delayed copies in one strided gather
+        root_j = np.lib.stride_tricks.sliding_window_view(padded,num_samples,axis=0)[max_shift-shifts,np.arange(num_channels)]
+
     #Multiplication======================================================
-    #Step 1: Find the mic nearest to current theta.
-    nearest_mic_index = int(np.round((-theta/(2*np.pi)*N_MICS_EVEN)%N_MICS_EVEN,0))
-    #Step 2: DMAS
-    #i=nearest_mic_index
-    dmas_array = np.zeros(num_samples)
-    #for i in [nearest_mic_index]:
-    total_product_count = 0
-    for i in [(nearest_mic_index-1)%N_MICS_EVEN,nearest_mic_index,(nearest_mic_index+1)%N_MICS_EVEN]:
-        delay_i = int(sample_rate * delays[i])
-        for j in range(N_MICS):
-            if j!= i:
-                delay_j = int(sample_rate * delays[j])
-                if delay_j < num_samples and delay_i<num_samples:
-                    current_product_array = np.append(np.array([0]*delay_i), data[:num_samples-delay_i,i]) #slide reference channel to the right
-                    current_product_array[delay_j:] = np.multiply(current_product_array[delay_j:],data[:num_samples-delay_j,j]) #slide current channel to the right and multiply with ref channel.
-                    current_product_array = np.multiply(np.sign(current_product_array),np.sqrt(np.abs(current_product_array))) #abs, square root, and give sign.
-                    dmas_array = np.add(dmas_array,current_product_array) #accumulate the product array in dmas array.
-                    total_product_count+=1
+    #Step 1: Find the mic nearest to current theta, the reference mics are it and its two neighbours.
+    nearest_mic_index = int(np.round(-theta/(2*np.pi)*N_MICS_EVEN))%N_MICS_EVEN
+    refs = np.array([(nearest_mic_index-1)%N_MICS_EVEN,nearest_mic_index,(nearest_mic_index+1)%N_MICS_EVEN])
+    #Step 2: DMAS. Sum over the pairs (reference i, channel j != i) of root_ref[i]*root_j[j] as one matrix product.
+    root_ref = np.where(started[refs],root_j[refs],0)
+    pairs = valid[refs][:,np.newaxis]&valid[np.newaxis,:] #(refs x channels), skipping delays beyond the data
+    pairs[np.arange(len(refs)),refs] = False
+    dmas_array = np.einsum('rt,rt->t',root_ref,pairs@root_j) #accumulate all products
+    total_product_count = pairs.sum()
     dmas_array = np.divide(dmas_array,total_product_count) #divide by number of summations to preserve the original scale
     dmas_array = np.abs(signal.hilbert(dmas_array)) #find envelope
     
     if lowcut!=None:
-        dmas_array=butter_bandpass_filter(dmas_array,lowcut = lowcut, highcut=lowcut, fs=sample_rate, order=5) #band pass filter
+        dmas_array=butter_bandpass_filter(dmas_array,lowcut = lowcut, highcut=highcut, fs=sample_rate, order=5) #band pass filter
 
     return dmas_array
     # Write the output wav file===========================================
@@ -1,5 +1,8 @@
 from .glob_vars import *
 from .DOA_supporting_functions import *
+from .music_engine import *
+from .adaptive_grid import *
+from .band_pool import get_band_pool
 import numpy as np
 from scipy.io import wavfile
 import scipy.io as spio
@@ -7,23 +10,26 @@ import time
 
 frequency = SAMPLING_RATE # Frequency of the input data
 
+#All drivers below run on a shared MusicEngine (see music_engine.py). The engine reuses its buffers every frame,
+#so the maps handed back here are copies. parallel=True computes the filtered band covariances on the shared
+#process pool (see band_pool.py).
+
+def _run_engine(engine,data,parallel=False):
+    p_music,per_band = get_band_pool().process(engine,data) if parallel else engine.process(data)
+    return p_music.copy(),[m.copy() for m in per_band]
+
 def data_process_plane_animated(entire_data,fc,bpFilt,FRAMES_PER_PLOT,ub=int(frequency*1+6000),magType='lin', theta_offset=180, PLANE_HEIGHT=55,filtering=False,normalization=False):
     global frequency,THETA_INTERVALS, PHI_INTERVALS, PLANE_LENGTH_INTERVALS
 
 
     #Plotting steps===================================================
 
-    data = np.zeros((FRAMES_PER_PLOT,4),float)
-    
-    for k in range(0,4,1):
-        print(k)
-        data[:,k] = 1*entire_data[ub-FRAMES_PER_PLOT:ub:1,k]
-
+    data = 1*entire_data[ub-FRAMES_PER_PLOT:ub:1,:N_MICS]
     data = data.astype(float)
 
     #Normalize (mandatory)
     if filtering or normalization:
-        for k in range(0,4,1):
+        for k in range(N_MICS):
             #filter
             if filtering:
                 #data[:,k] = np.convolve(data[:,k], np.ones(moving_average_window_size) / moving_average_window_size, mode='same')
@@ -32,285 +38,71 @@ def data_process_plane_animated(entire_data,fc,bpFilt,FRAMES_PER_PLOT,ub=int(fre
             if normalization:
                 data[:,k] = data[:,k]/max(data[:,k])
 
-    bands_id =    list(range(len(fc))) #detect_significant_bands(bpFilt, data) #changed
-    print("significant band id's: ",bands_id)
-    if magType == 'lin':
-        p_music = np.ones((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float) #2D array #changed from ones to zeros
-    else:
-        p_music = np.zeros((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float) #2D array #changed from ones to zeros
-    p_music_temp = np.ones((PLANE_LENGTH_INTERVALS,len(bands_id),PLANE_LENGTH_INTERVALS),float) #3d array
-    
-    len_bands_id=len(bands_id)
-    for k in range(len_bands_id):
-
-        p_music_temp[::,k] = estimate_music_spectrum_2D_plane(data,bpFilt,fc[bands_id[k]],
-                                                              bands_id[k],
-                                                              PLANE_HEIGHT,
-                                                              theta_offset=theta_offset) #2d array (theta vs phi)
-
-        temp1 = np.reshape(p_music_temp[::,k],(PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS)) #2d array (theta vs phi)
-        if magType == "lin":
-            p_music = p_music*(temp1/np.max(temp1)) #Normalization
-        elif magType == "log":
-            p_music = p_music+10*np.log10(temp1)/len_bands_id
-
-        elif magType == "linadd":
-            p_music = p_music+temp1/np.max(temp1)#len_bands_id
-        elif magType == "linaddwithoutnorm":
-            p_music = p_music+temp1#len_bands_id
-        #p_music = p_music*(temp1)
-        #p_music = p_music+temp1/(np.max(temp1)*len_bands_id) #Changed normalization
-
+    engine = get_music_engine(PlaneGeometry(theta_offset,height=PLANE_HEIGHT),fc,bpFilt=bpFilt,covariance='fir',magType=magType)
+    p_music,_ = _run_engine(engine,data)
     return p_music
 
 def data_process_pipe_animated(entire_data,fc,bpFilt,magType='linadd',theta_offset=180):
-    global frequency,PIPE_LENGTH,PIPE_DIAMETER,PIPE_DISTANCE,PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS
-
-
-    #Plotting steps===================================================
-
-    data = entire_data
-    data = data.astype(float)
-    #print(np.max(data),np.min(data))
-    bands_id =    list(range(len(fc))) #detect_significant_bands(bpFilt, data) #changed
-    print("significant band id's: ",bands_id)
-    
-    p_music = np.zeros((PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS),float) #2D array #changed from ones to zeros
-    p_music_temp = np.ones((PIPE_LENGTH_INTERVALS,len(bands_id),PIPE_DIAMETER_INTERVALS),float) #3d array
-    
-    len_bands_id=len(bands_id)
-    for k in range(len_bands_id):
-
-        p_music_temp[::,k] = estimate_music_spectrum_2D_pipe_another(data,bpFilt,fc[bands_id[k]],bands_id[k],theta_offset=theta_offset)
-
-        temp1 = np.reshape(p_music_temp[::,k],(PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS)) #2d array (theta vs phi)
-        if magType == "lin":
-            p_music = p_music*(temp1/np.max(temp1)) #Normalization
-        elif magType == "log":
-            p_music = p_music+10*np.log10(temp1)/len_bands_id
-
-        elif magType == "linadd":
-            p_music = p_music+temp1/np.max(temp1)#len_bands_id
-        elif magType == "linaddwithoutnorm":
-            p_music = p_music+temp1#len_bands_id
-
+    engine = get_music_engine(PipeGeometry(theta_offset,z_start=PIPE_HEIGHT-40,z_stop=PIPE_HEIGHT+40),fc,bpFilt=bpFilt,covariance='fir',magType=magType)
+    p_music,_ = _run_engine(engine,entire_data)
     return p_music
 
-def data_process_pipe_animated_varyband(entire_data,fc,bw,magType='linadd',theta_offset=180):
-    global frequency,PIPE_LENGTH,PIPE_DIAMETER,PIPE_DISTANCE,PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS
-
-
-    #Plotting steps===================================================
-
-    data = entire_data
-    data = data.astype(float)
-    #print(np.max(data),np.min(data))
-    bands_id =    list(range(len(fc))) #detect_significant_bands(bpFilt, data) #changed
-    print("significant band id's: ",bands_id)
-    
-    p_music = np.zeros((PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS),float) #2D array #changed from ones to zeros
-    p_music_temp = np.ones((PIPE_LENGTH_INTERVALS,len(bands_id),PIPE_DIAMETER_INTERVALS),float) #3d array
-    
-    len_bands_id=len(bands_id)
-    for k in range(len_bands_id):
-
-        p_music_temp[::,k] = estimate_music_spectrum_2D_pipe_varyband(data,fc[bands_id[k]],bw,bands_id[k],theta_offset=theta_offset)
-
-        temp1 = np.reshape(p_music_temp[::,k],(PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS)) #2d array (theta vs phi)
-        if magType == "lin":
-            p_music = p_music*(temp1/np.max(temp1)) #Normalization
-        elif magType == "log":
-            p_music = p_music+10*np.log10(temp1)/len_bands_id
-
-        elif magType == "linadd":
-            p_music = p_music+temp1/np.max(temp1)#len_bands_id
-        elif magType == "linaddwithoutnorm":
-            p_music = p_music+temp1#len_bands_id
-
+def data_process_pipe_animated_varyband(entire_data,fc,bw,magType='linadd',theta_offset=180,parallel=False):
+    engine = get_music_engine(PipeGeometry(theta_offset),fc,bw=bw,covariance='butter',magType=magType)
+    p_music,_ = _run_engine(engine,entire_data,parallel)
     return p_music
 
-def data_process_pipe_animated_varyband_sfreqs(entire_data,fc,bw,magType='linadd',theta_offset=180):
-    global frequency,PIPE_LENGTH,PIPE_DIAMETER,PIPE_DISTANCE,PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS
-
-
-    #Plotting steps===================================================
-
-    data = entire_data
-    data = data.astype(float)
-    #print(np.max(data),np.min(data))
-    bands_id =    list(range(len(fc))) #detect_significant_bands(bpFilt, data) #changed
-    print("significant band id's: ",bands_id)
-    
-    p_music = np.zeros((PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS),float) #2D array #changed from ones to zeros
-    p_music_temp = np.ones((PIPE_LENGTH_INTERVALS,len(bands_id),PIPE_DIAMETER_INTERVALS),float) #3d array
-    
-    len_bands_id=len(bands_id)
-
-    sfreq_maps_list=[]
-    for k in range(len_bands_id):
-
-        p_music_temp[::,k] = estimate_music_spectrum_2D_pipe_varyband(data,fc[bands_id[k]],bw,bands_id[k],theta_offset=theta_offset)
-
-        temp1 = np.reshape(p_music_temp[::,k],(PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS)) #2d array (theta vs phi)
-        if magType == "lin":
-            p_music = p_music*(temp1/np.max(temp1)) #Normalization
-        elif magType == "log":
-            p_music = p_music+10*np.log10(temp1)/len_bands_id
-
-        elif magType == "linadd":
-            p_music = p_music+temp1/np.max(temp1)#len_bands_id
-        elif magType == "linaddwithoutnorm":
-            p_music = p_music+temp1#len_bands_id
-
-        tempmax = np.max(temp1)
-        tempmin = np.min(temp1)
-        sfreq_maps_list.append((temp1-tempmin)/(tempmax-tempmin))
-
-    return p_music,sfreq_maps_list
+def data_process_pipe_animated_varyband_sfreqs(entire_data,fc,bw,magType='linadd',theta_offset=180,parallel=False):
+    engine = get_music_engine(PipeGeometry(theta_offset),fc,bw=bw,covariance='butter',magType=magType)
+    return _run_engine(engine,entire_data,parallel)
 
 def data_process_animated(entire_data,fc,bpFilt,magType='linadd',theta_offset=180):
-    global frequency,THETA_INTERVALS,PHI_INTERVALS
-
-
-    #Plotting steps===================================================
-
-    data = entire_data
-    data = data.astype(float)
-    #print(np.max(data),np.min(data))
-    
-    bands_id =    list(range(len(fc))) #detect_significant_bands(bpFilt, data) #changed
-    print("significant band id's: ",bands_id)
-    
-    p_music = np.zeros((THETA_INTERVALS,PHI_INTERVALS),float) #2D array #changed from ones to zeros
-    p_music_temp = np.ones((THETA_INTERVALS,len(bands_id),PHI_INTERVALS),float) #3d array
-    
-    len_bands_id=len(bands_id)
-    for k in range(len_bands_id):
-
-        p_music_temp[::,k] = estimate_music_spectrum_2D(data,bpFilt,fc[bands_id[k]],bands_id[k],theta_offset=theta_offset)
-
-        temp1 = np.reshape(p_music_temp[::,k],(THETA_INTERVALS,PHI_INTERVALS)) #2d array (theta vs phi)
-        if magType == "lin":
-            p_music = p_music*(temp1/np.max(temp1)) #Normalization
-        elif magType == "log":
-            p_music = p_music+10*np.log10(temp1)/len_bands_id
-
-        elif magType == "linadd":
-            p_music = p_music+temp1/np.max(temp1)#len_bands_id
-        elif magType == "linaddwithoutnorm":
-            p_music = p_music+temp1#len_bands_id
-
+    engine = get_music_engine(SphericalGeometry(theta_offset),fc,bpFilt=bpFilt,covariance='fir',magType=magType)
+    p_music,_ = _run_engine(engine,entire_data)
     return p_music
 
 def data_process_plane_animated_2(entire_data,fc,bpFilt,magType='linadd',theta_offset=180):
-    global frequency,PLANE_LENGTH,PLANE_HEIGHT,PLANE_LENGTH_INTERVALS
-
-
-    #Plotting steps===================================================
-
-    data = entire_data
-    data = data.astype(float)
-    #print(np.max(data),np.min(data))
-    bands_id =    list(range(len(fc))) #detect_significant_bands(bpFilt, data) #changed
-    print("significant band id's: ",bands_id)
-    
-    p_music = np.zeros((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float) #2D array #changed from ones to zeros
-    p_music_temp = np.ones((PLANE_LENGTH_INTERVALS,len(bands_id),PLANE_LENGTH_INTERVALS),float) #3d array
-    
-    len_bands_id=len(bands_id)
-    for k in range(len_bands_id):
-
-        p_music_temp[::,k] = estimate_music_spectrum_2D_plane_another(data,bpFilt,fc[bands_id[k]],bands_id[k],theta_offset=theta_offset)
-
-        temp1 = np.reshape(p_music_temp[::,k],(PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS)) #2d array (theta vs phi)
-        if magType == "lin":
-            p_music = p_music*(temp1/np.max(temp1)) #Normalization
-        elif magType == "log":
-            p_music = p_music+10*np.log10(temp1)/len_bands_id
-
-        elif magType == "linadd":
-            p_music = p_music+temp1/np.max(temp1)#len_bands_id
-        elif magType == "linaddwithoutnorm":
-            p_music = p_music+temp1#len_bands_id
-
+    engine = get_music_engine(PlaneGeometry(theta_offset),fc,bpFilt=bpFilt,covariance='fir',magType=magType)
+    p_music,_ = _run_engine(engine,entire_data)
     return p_music
 
 #Plane live================================================
-def data_process_plane_animated_varyband_sfreqs(entire_data,fc,bw,magType='linadd',theta_offset=180):
-    global frequency,PLANE_LENGTH,PLANE_HEIGHT,PLANE_LENGTH_INTERVALS
-
-
-    #Plotting steps===================================================
-
-    data = entire_data
-    data = data.astype(float)
-    #print(np.max(data),np.min(data))
-    bands_id =    list(range(len(fc))) #detect_significant_bands(bpFilt, data) #changed
-    print("significant band id's: ",bands_id)
-    
-    p_music = np.zeros((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float) #2D array #changed from ones to zeros
-    p_music_temp = np.ones((PLANE_LENGTH_INTERVALS,len(bands_id),PLANE_LENGTH_INTERVALS),float) #3d array
-    
-    len_bands_id=len(bands_id)
-
-    sfreq_maps_list=[]
-    for k in range(len_bands_id):
-
-        p_music_temp[::,k] = estimate_music_spectrum_2D_plane_varyband(data,fc[bands_id[k]],bw,bands_id[k],theta_offset=theta_offset)
-
-        temp1 = np.reshape(p_music_temp[::,k],(PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS)) #2d array (theta vs phi)
-        if magType == "lin":
-            p_music = p_music*(temp1/np.max(temp1)) #Normalization
-        elif magType == "log":
-            p_music = p_music+10*np.log10(temp1)/len_bands_id
-
-        elif magType == "linadd":
-            p_music = p_music+temp1/np.max(temp1)#len_bands_id
-        elif magType == "linaddwithoutnorm":
-            p_music = p_music+temp1#len_bands_id
-
-        tempmax = np.max(temp1)
-        tempmin = np.min(temp1)
-        sfreq_maps_list.append((temp1-tempmin)/(tempmax-tempmin))
-
-    return p_music,sfreq_maps_list
+def data_process_plane_animated_varyband_sfreqs(entire_data,fc,bw,magType='linadd',theta_offset=180,parallel=False):
+    engine = get_music_engine(PlaneGeometry(theta_offset),fc,bw=bw,covariance='butter',magType=magType)
+    return _run_engine(engine,entire_data,parallel)
 
 #Plane live nearfied===================================================
 def data_process_plane_animated_varyband_sfreqs_nf(entire_data,fc,bw,magType='linadd',theta_offset=180):
-    global frequency,PLANE_LENGTH,PLANE_HEIGHT,PLANE_LENGTH_INTERVALS
-
-
-    #Plotting steps===================================================
-
-    data = entire_data
-    data = data.astype(float)
-    #print(np.max(data),np.min(data))
-    bands_id =    list(range(len(fc))) #detect_significant_bands(bpFilt, data) #changed
-    print("significant band id's: ",bands_id)
-    
-    p_music = np.zeros((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float) #2D array #changed from ones to zeros
-    p_music_temp = np.ones((PLANE_LENGTH_INTERVALS,len(bands_id),PLANE_LENGTH_INTERVALS),float) #3d array
-    
-    len_bands_id=len(bands_id)
+    engine = get_music_engine(PlaneNearFieldGeometry(theta_offset),fc,bw=bw,covariance='butter',magType=magType)
+    p_music,_ = engine.process(entire_data)
 
+    #normalized and raw map of every band, interleaved
     sfreq_maps_list=[]
-    for k in range(len_bands_id):
-
-        p_music_temp[::,k] = estimate_music_spectrum_2D_plane_varyband_nf(data,fc[bands_id[k]],bw,bands_id[k],theta_offset=theta_offset)
-
-        temp1 = np.reshape(p_music_temp[::,k],(PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS)) #2d array (theta vs phi)
-        if magType == "lin":
-            p_music = p_music*(temp1/np.max(temp1)) #Normalization
-        elif magType == "log":
-            p_music = p_music+10*np.log10(temp1)/len_bands_id
-
-        elif magType == "linadd":
-            p_music = p_music+temp1/np.max(temp1)#len_bands_id
-        elif magType == "linaddwithoutnorm":
-            p_music = p_music+temp1#len_bands_id
-
-        tempmax = np.max(temp1)
-        tempmin = np.min(temp1)
-        sfreq_maps_list.append((temp1-tempmin)/(tempmax-tempmin))
-        sfreq_maps_list.append(temp1)
-    return p_music,sfreq_maps_list
+    for k in range(len(fc)):
+        sfreq_maps_list.append(engine.per_band[k].copy())
+        sfreq_maps_list.append(engine.spectra[k].copy())
+    return p_music.copy(),sfreq_maps_list
+
+#Pipe live, single FFT wideband==========================================
+def data_process_pipe_animated_varyband_sfreqs_wideband(entire_data,fc,bw,magType='linadd',theta_offset=180,weighting='butter',precision=None):
+    #Same output as data_process_pipe_animated_varyband_sfreqs, but every band covariance comes from one rfft per
+    #channel (see band_covariances_wideband) instead of a filtfilt + FFT per band and channel. The noise subspaces
+    #and spectra of all bands are computed in one batch, in MUSIC_PRECISION unless precision is given.
+    engine = get_music_engine(PipeGeometry(theta_offset),fc,bw=bw,covariance='wideband',magType=magType,weighting=weighting,precision=precision)
+    return _run_engine(engine,entire_data)
+
+#Adaptive (coarse-to-fine) grid==========================================
+def data_process_pipe_adaptive(entire_data,fc,bw,magType='linadd',theta_offset=180,target_resolution=1.,top_k=2,out_shape=None):
+    #Wideband pipe map from a coarse grid refined around the top_k peaks down to target_resolution cm.
+    #Returns (heatmap, peaks), peaks is (top_k x 3): y along the pipe, z (cm) and composite value, strongest first.
+    engine = get_music_engine(PipeGeometry(theta_offset),fc,bw=bw,covariance='wideband',magType=magType)
+    adaptive = get_adaptive_music(engine,target_resolution=target_resolution,top_k=top_k,out_shape=out_shape)
+    heatmap,peaks = adaptive.process(entire_data)
+    return heatmap,peaks
+
+def data_process_plane_adaptive(entire_data,fc,bw,magType='linadd',theta_offset=180,target_resolution=1.,top_k=2,out_shape=None):
+    #Plane counterpart of data_process_pipe_adaptive, peaks hold y, x (cm) and composite value
+    engine = get_music_engine(PlaneGeometry(theta_offset),fc,bw=bw,covariance='wideband',magType=magType)
+    adaptive = get_adaptive_music(engine,target_resolution=target_resolution,top_k=top_k,out_shape=out_shape)
+    heatmap,peaks = adaptive.process(entire_data)
+    return heatmap,peaks
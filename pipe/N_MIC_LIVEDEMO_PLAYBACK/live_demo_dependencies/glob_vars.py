@@ -1,10 +1,12 @@
+import os
+import hashlib
 import numpy as np
-from matplotlib import pyplot as plt
 SAMPLING_RATE = 48000
 MIC_RADIUS_CM = 5 #cm
 N_MICS = 9#9
 THETA_OFFSET = 180 #To correct any azimuth DC errors.
 MIC_ROT=0 #Use this in case mic is rotated relative to its own frame of reference.
+DAQ_BACKEND = os.environ.get('DAQ_BACKEND','nidaq') #'nidaq' for hardware, 'simulator' for synthesized UCA signals (daq_backends.py)
 
 THETA_INTERVALS = 50#361 #361
 PHI_INTERVALS = 30#91#91
@@ -34,6 +36,18 @@ CYLINDER_Y_INTERVALS = 50
 CYLINDER_DELTA_INTERVALS = 50
 SPEED_OF_SOUND = 340 #ms-1
 
+#MUSIC numerics: 'double' (complex128) or 'single' (complex64) covariances, steering tensors and spectra
+MUSIC_PRECISION = 'double'
+
+#Precomputed steering manifolds are persisted here (see manifold_cache.py)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','cache')
+
+#Latest acquired frame, shared by DAQEXPRESS with the GUI (see shared_frames.py)
+SHARED_FRAMES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','pickles','audio_frames.shm')
+
+#Raw acquisition archive of the recorders (see segment_archive.py)
+RECORDING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','recordings')
+
 
 #ground to mic: 22.5cm
 #ground to pipe: 67cm
@@ -45,128 +59,112 @@ CYLINDER_HEIGHT_METERS = CYLINDER_HEIGHT/100#m
 CYLINDER_RADIUS_METERS = CYLINDER_RADIUS/100 #m
 CYLINDER_LENGTH_METERS = CYLINDER_LENGTH/100 #m
 
-#TODO========================================================
-#Near field LUT's for cylindrical surface
-CYL_NF_THETA_LUT = np.ones((N_MICS,CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS),float)
-CYL_NF_PHI_LUT = np.ones((N_MICS,CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS),float)
-CYL_NF_R_LUT= np.ones((N_MICS,CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS),float)
-MIC_CENTRE_R_LUT=np.ones((CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS),float)
-
-for i in range(N_MICS): #i = mic index
-
-    N_MICS_EVEN = N_MICS-1 if N_MICS%2 !=0 else N_MICS
-    #Determine mic position
-    mic_angle = -i/N_MICS_EVEN*np.pi*2 + MIC_ROT*np.pi/180 + THETA_OFFSET*np.pi/180#Mics are placed anti clockwise.
-    mic_x = MIC_RADIUS*np.cos(mic_angle) if (N_MICS_EVEN == N_MICS and i== N_MICS-1) else 0
-    mic_y = MIC_RADIUS*np.sin(mic_angle) if (N_MICS_EVEN == N_MICS and i== N_MICS-1) else 0
-
-    #determine cylinder x,y,z from cylinder coordinates
-    delta_index=0
-    for delta_val in np.linspace(-np.pi/2-CYLINDER_CHI+CYLINDER_CHI_OFFSET,-np.pi/2+CYLINDER_CHI+CYLINDER_CHI_OFFSET,CYLINDER_DELTA_INTERVALS):
-        cyl_x=CYLINDER_RADIUS_METERS*np.cos(delta_val) + CYLINDER_X_OFFSET#+-ve
-        cyl_z=CYLINDER_HEIGHT_METERS+CYLINDER_RADIUS_METERS*(1+np.sin(delta_val)) #always +ve
-
-        #Find relative cyl x,z
-        x=cyl_x-mic_x
-        z=cyl_z-0 #mic z is always 0
-        
-        y_index = 0
-        for y_val in np.linspace(-CYLINDER_LENGTH_METERS/2,CYLINDER_LENGTH_METERS/2,CYLINDER_Y_INTERVALS):
-            cyl_y=y_val
-
-            #Find relative cyl_y
-            y=cyl_y-mic_y
-            
-            r=np.sqrt(x**2+y**2+z**2) #to find phi only.
-            theta = np.arctan(y/x)
-            phi = np.arccos(z/r) #always +ve
-
-            #theta winding
-            if x>=0 and y>=0:
-                theta=theta
-            elif x<0 and y>=0: #2nd quadrant
-                theta = np.pi+theta
-            elif x<0 and y<0: #3rd quadrant
-                theta = np.pi+theta
-            elif x>=0 and y<0:
-                theta = 2*np.pi+theta
-
-            #Fill the LUT's
-            CYL_NF_THETA_LUT[i][y_index][delta_index]=theta-mic_angle
-            CYL_NF_PHI_LUT[i][y_index][delta_index]=phi
-            CYL_NF_R_LUT[i][y_index][delta_index]=r
-            if i==0:
-                MIC_CENTRE_R_LUT[y_index][delta_index]=np.sqrt(cyl_x**2+cyl_y**2+cyl_z**2)
-            y_index+=1
-        delta_index+=1
-
-
-#TODO========================================================
-#Near field LUT's for plane surface
-PLANE_NF_THETA_LUT = np.ones((N_MICS,PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float)
-PLANE_NF_PHI_LUT = np.ones((N_MICS,PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float)
-PLANE_NF_R_LUT= np.ones((N_MICS,PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float) #in meters
-PLANE_MIC_CENTRE_R_LUT=np.ones((PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS),float) #in meters
-
 PLANE_HEIGHT_METERS = PLANE_HEIGHT/100#meters
 PLANE_LENGTH_METERS = PLANE_LENGTH/100 #meters
 
-for i in range(N_MICS): #i = mic index
+#Near field LUT's============================================================
+#CYL_NF_*_LUT, MIC_CENTRE_R_LUT, PLANE_NF_*_LUT and PLANE_MIC_CENTRE_R_LUT are only built when first accessed
+#(see __getattr__ below), so importing this module stays cheap when only the pipe geometry is used. Built tables
+#are saved under CACHE_DIR in a directory named by a hash of the constants they depend on and are loaded back
+#memory-mapped (read only) on the next start.
+LUT_VERSION = 1 #bump when the LUT construction changes, so cached tables are rebuilt
+
+def _theta_winding(x,y):
+    #angle of (x,y) in [0,2pi), same quadrant handling as arctan(y/x) + winding
+    return np.mod(np.arctan2(y,x),2*np.pi)
 
+def _mic_angles():
     N_MICS_EVEN = N_MICS-1 if N_MICS%2 !=0 else N_MICS
-    #Determine mic position
-    mic_angle = -i/N_MICS_EVEN*np.pi*2 + MIC_ROT*np.pi/180 + THETA_OFFSET*np.pi/180#Mics are placed anti clockwise.
-    #If odd mics
-    if N_MICS_EVEN != N_MICS:
-        if i!=N_MICS-1:
-            mic_x = MIC_RADIUS*np.cos(mic_angle)
-            mic_y = MIC_RADIUS*np.sin(mic_angle)
-
-        else:
-            mic_x=0
-            mic_y=0
-    else:
-        mic_x = MIC_RADIUS*np.cos(mic_angle)
-        mic_y = MIC_RADIUS*np.sin(mic_angle)
-    #mic_x = MIC_RADIUS*np.cos(mic_angle) if (N_MICS_EVEN != N_MICS and i< N_MICS-1) else 0
-    #mic_y = MIC_RADIUS*np.sin(mic_angle) if (N_MICS_EVEN != N_MICS and i< N_MICS-1) else 0
-    print(mic_x,mic_y)
+    i = np.arange(N_MICS)
+    #Mics are placed anti clockwise.
+    return i,N_MICS_EVEN,-i/N_MICS_EVEN*np.pi*2 + MIC_ROT*np.pi/180 + THETA_OFFSET*np.pi/180
+
+def _build_cylinder_nf_luts():
+    #Near field LUT's for cylindrical surface, shape (N_MICS,CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS)
+    i,N_MICS_EVEN,mic_angle = _mic_angles()
+    #Mic position, same condition as the original per mic loop (only an even array's last mic is off centre)
+    on_circle = (N_MICS_EVEN == N_MICS) & (i == N_MICS-1)
+    mic_x = np.where(on_circle,MIC_RADIUS*np.cos(mic_angle),0)[:,None,None]
+    mic_y = np.where(on_circle,MIC_RADIUS*np.sin(mic_angle),0)[:,None,None]
 
     #determine cylinder x,y,z from cylinder coordinates
-    x_index=0
-    for x_val in np.linspace(-PLANE_LENGTH_METERS/2,PLANE_LENGTH_METERS/2,PLANE_LENGTH_INTERVALS):
-
-        #Find relative cyl x,z
-        x=x_val-mic_x
-        z=PLANE_HEIGHT_METERS-0 #mic z is always 0
-        
-        y_index = 0
-        for y_val in np.linspace(-PLANE_LENGTH_METERS/2,PLANE_LENGTH_METERS/2,PLANE_LENGTH_INTERVALS):
-
-            y=y_val-mic_y
-            
-            r=np.sqrt(x**2+y**2+z**2) #to find phi only.
-            theta = np.arctan(y/x)
-            phi = np.arccos(z/r) #always +ve
-
-            #theta winding
-            if x>=0 and y>=0:
-                theta=theta
-            elif x<0 and y>=0: #2nd quadrant
-                theta = np.pi+theta
-            elif x<0 and y<0: #3rd quadrant
-                theta = np.pi+theta
-            elif x>=0 and y<0:
-                theta = 2*np.pi+theta
-
-            #Fill the LUT's
-            PLANE_NF_THETA_LUT[i][y_index][x_index]=theta-mic_angle
-            PLANE_NF_PHI_LUT[i][y_index][x_index]=phi
-            PLANE_NF_R_LUT[i][y_index][x_index]=r
-            if i==0:
-                PLANE_MIC_CENTRE_R_LUT[y_index][x_index]=np.sqrt(x_val**2+y_val**2+PLANE_HEIGHT_METERS**2)
-            y_index+=1
-        x_index+=1
+    delta_val = np.linspace(-np.pi/2-CYLINDER_CHI+CYLINDER_CHI_OFFSET,-np.pi/2+CYLINDER_CHI+CYLINDER_CHI_OFFSET,CYLINDER_DELTA_INTERVALS)[None,None,:]
+    y_val = np.linspace(-CYLINDER_LENGTH_METERS/2,CYLINDER_LENGTH_METERS/2,CYLINDER_Y_INTERVALS)[None,:,None]
+    cyl_x = CYLINDER_RADIUS_METERS*np.cos(delta_val) + CYLINDER_X_OFFSET#+-ve
+    cyl_z = CYLINDER_HEIGHT_METERS+CYLINDER_RADIUS_METERS*(1+np.sin(delta_val)) #always +ve
+
+    #relative to each mic
+    x = cyl_x-mic_x
+    y = y_val-mic_y
+    z = cyl_z-0 #mic z is always 0
+    x,y,z = np.broadcast_arrays(x,y,z)
+    r = np.sqrt(x**2+y**2+z**2)
+
+    return {
+        'CYL_NF_THETA_LUT': _theta_winding(x,y)-mic_angle[:,None,None],
+        'CYL_NF_PHI_LUT': np.arccos(z/r), #always +ve
+        'CYL_NF_R_LUT': r,
+        'MIC_CENTRE_R_LUT': np.sqrt(cyl_x**2+y_val**2+cyl_z**2)[0],
+    }
+
+def _build_plane_nf_luts():
+    #Near field LUT's for plane surface, shape (N_MICS,PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS), indexed [mic][y][x], in meters
+    i,N_MICS_EVEN,mic_angle = _mic_angles()
+    #If odd mics, the last one is at the centre
+    at_centre = (N_MICS_EVEN != N_MICS) & (i == N_MICS-1)
+    mic_x = np.where(at_centre,0,MIC_RADIUS*np.cos(mic_angle))[:,None,None]
+    mic_y = np.where(at_centre,0,MIC_RADIUS*np.sin(mic_angle))[:,None,None]
+
+    x_val = np.linspace(-PLANE_LENGTH_METERS/2,PLANE_LENGTH_METERS/2,PLANE_LENGTH_INTERVALS)[None,None,:]
+    y_val = np.linspace(-PLANE_LENGTH_METERS/2,PLANE_LENGTH_METERS/2,PLANE_LENGTH_INTERVALS)[None,:,None]
+
+    #relative to each mic
+    x = x_val-mic_x
+    y = y_val-mic_y
+    z = PLANE_HEIGHT_METERS-0 #mic z is always 0
+    x,y = np.broadcast_arrays(x,y)
+    r = np.sqrt(x**2+y**2+z**2)
+
+    return {
+        'PLANE_NF_THETA_LUT': _theta_winding(x,y)-mic_angle[:,None,None],
+        'PLANE_NF_PHI_LUT': np.arccos(z/r), #always +ve
+        'PLANE_NF_R_LUT': r,
+        'PLANE_MIC_CENTRE_R_LUT': np.sqrt(x_val**2+y_val**2+PLANE_HEIGHT_METERS**2)[0],
+    }
+
+#LUT name -> (builder, constants it depends on)
+_LUT_GROUPS = {
+    'cylinder_nf': (_build_cylinder_nf_luts,('CYL_NF_THETA_LUT','CYL_NF_PHI_LUT','CYL_NF_R_LUT','MIC_CENTRE_R_LUT'),
+                    (CYLINDER_HEIGHT,CYLINDER_RADIUS,CYLINDER_LENGTH,CYLINDER_CHI,CYLINDER_X_OFFSET,CYLINDER_CHI_OFFSET,CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS)),
+    'plane_nf': (_build_plane_nf_luts,('PLANE_NF_THETA_LUT','PLANE_NF_PHI_LUT','PLANE_NF_R_LUT','PLANE_MIC_CENTRE_R_LUT'),
+                 (PLANE_HEIGHT,PLANE_LENGTH,PLANE_LENGTH_INTERVALS)),
+}
+
+def _load_lut_group(group):
+    builder,names,params = _LUT_GROUPS[group]
+    key = (LUT_VERSION,group,N_MICS,MIC_RADIUS,MIC_ROT,THETA_OFFSET)+params
+    lut_dir = os.path.join(CACHE_DIR,f"lut_{group}_{hashlib.sha1(repr(key).encode()).hexdigest()[:16]}")
+    try:
+        luts = {name: np.load(os.path.join(lut_dir,name+'.npy'),mmap_mode='r') for name in names}
+    except (OSError,ValueError): #not cached yet (or unreadable): build and try to save
+        luts = builder()
+        try:
+            os.makedirs(lut_dir,exist_ok=True)
+            for name in names:
+                tmp_path = os.path.join(lut_dir,f"{name}.npy.{os.getpid()}.tmp") #per process, servers may build the LUT's at once
+                with open(tmp_path,'wb') as f:
+                    np.save(f,luts[name])
+                os.replace(tmp_path,os.path.join(lut_dir,name+'.npy'))
+        except OSError:
+            pass #read only install, keep the in memory tables
+    globals().update(luts) #later accesses are plain module attributes
+    return luts
+
+def __getattr__(name):
+    for group,(builder,names,params) in _LUT_GROUPS.items():
+        if name in names:
+            return _load_lut_group(group)[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 #plt.figure()
 #plt.imshow(PLANE_NF_R_LUT[8])
@@ -0,0 +1,46 @@
+import os
+import hashlib
+import numpy as np
+
+#Steering-manifold tensors only depend on the array/grid geometry and on the band centres, so they are
+#built once and reused for every frame. Keys are (geometry name, geometry parameters, band centres).
+_MANIFOLD_CACHE = {}
+
+def manifold_cache_path(key,cache_dir):
+    #content-hashed file name, so a geometry or band change never picks up a stale tensor from disk
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir,f"manifold_{key[0]}_{digest}.npy")
+
+def get_cached_manifold(key,builder,cache_dir=None):
+    #Return the tensor for key, building it with builder() on a miss. If cache_dir is given the tensor is
+    #also persisted as .npy there and reloaded on the next start.
+    A = _MANIFOLD_CACHE.get(key)
+    if A is not None:
+        return A
+
+    path = manifold_cache_path(key,cache_dir) if cache_dir else None
+    if path and os.path.exists(path):
+        try:
+            A = np.load(path)
+        except (OSError,ValueError): #partial or corrupt file, rebuild it
+            A = None
+
+    if A is None:
+        A = builder()
+        if path:
+            os.makedirs(cache_dir,exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp" #per process, pool workers may build the same tensor at once
+            with open(tmp_path,'wb') as f:
+                np.save(f,A)
+            os.replace(tmp_path,path) #never leave a half written tensor behind
+
+    A.flags.writeable = False #shared by every engine and geometry, an in place edit would corrupt all later maps
+
+    #Geometry changed for this name: drop the stale tensors.
+    for stale_key in [k for k in _MANIFOLD_CACHE if k[0]==key[0] and k[1]!=key[1]]:
+        del _MANIFOLD_CACHE[stale_key]
+    _MANIFOLD_CACHE[key] = A
+    return A
+
+def clear_manifold_cache():
+    _MANIFOLD_CACHE.clear()
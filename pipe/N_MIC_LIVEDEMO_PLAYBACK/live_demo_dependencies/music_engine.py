@@ -0,0 +1,249 @@
+import contextlib
+import numpy as np
+from scipy import signal
+from .glob_vars import *
+from .DOA_supporting_functions import *
+from .music_numerics import *
+from .BPF import butter_sos
+
+#One MUSIC pipeline for every geometry: covariance -> batched eigendecomposition -> one contraction with the
+#cached steering tensor -> band combination. Filters, manifold and work buffers are owned by the engine and
+#reused every frame.
+#Stage timing: set engine.timer to a callable stage -> context manager (e.g. a metrics histogram timer) to time the
+#'covariance', 'subspace', 'spectra' and 'combine' stages of every frame. None (default) costs nothing.
+
+MAG_TYPES = ('lin','log','linadd','linaddwithoutnorm')
+_NO_TIMER = contextlib.nullcontext()
+COVARIANCE_MODES = ('wideband','butter','fir')
+
+#Filtered band covariances================================================
+def butter_band_filters(fc,bw,fs=SAMPLING_RATE):
+    #sos of the order 5 band pass of every band, as used by the *_varyband estimators (cached designs, see BPF)
+    return [butter_sos(5,f-bw/2,f+bw/2,fs) for f in fc]
+
+def band_covariances_filtered(data,filters,out,padlen=None):
+    #Spatial covariance of every band of data (samples x mics) from a filtfilt + FFT per band.
+    #filters is a list of sos arrays or (b,a) tuples, one per band, out a (bands x mics x mics) buffer. padlen is
+    #passed to (sos)filtfilt.
+    for k,band_filter in enumerate(filters):
+        if isinstance(band_filter,tuple):
+            filtered = signal.filtfilt(*band_filter,data,axis=0,padlen=padlen)
+        else:
+            filtered = signal.sosfiltfilt(band_filter,data,axis=0,padlen=padlen)
+        X = np.fft.fft(filtered,axis=0)[:len(filtered)//2]
+        np.matmul(np.conjugate(X.T),X,out=out[k])
+        out[k] /= len(X)
+    return out
+
+#Geometries================================================================
+class Geometry:
+    #Scan grid of a MUSIC map. name selects the grid builder in DOA_supporting_functions.generate_manifold_grid,
+    #params are passed on to it.
+    name = None
+    n_mics = N_MICS
+
+    def __init__(self,theta_offset=0,**params):
+        self.theta_offset = theta_offset
+        self.params = params
+
+    @property
+    def shape(self):
+        raise NotImplementedError
+
+    def key(self):
+        return (self.name,manifold_geometry_params(self.name,self.theta_offset),tuple(sorted(self.params.items())))
+
+    def manifold(self,fc,precision=None,cache_dir=None):
+        #(bands x rows x cols x mics) steering tensor, shared through the manifold cache
+        precision = MUSIC_PRECISION if precision is None else precision
+        return get_manifold_tensor(self.name,fc,self.theta_offset,cache_dir,precision,**self.params)
+
+    #Continuous coordinates, only for geometries with a physical (cm) grid. Used by the adaptive grid search.
+    def axes(self,shape=None):
+        #row and col coordinates of a grid of the given shape (default self.shape) over the same extent
+        raise NotImplementedError(f"{type(self).__name__} has no continuous coordinates")
+
+    def point_angles(self,rows,cols):
+        #theta,phi (degrees) of points at row,col coordinates (arrays, broadcastable)
+        raise NotImplementedError(f"{type(self).__name__} has no continuous coordinates")
+
+    def point_steering(self,fc,rows,cols,precision=None):
+        #(bands x ... x mics) steering vectors of arbitrary points, not cached
+        complex_dtype,_ = precision_dtypes(precision)
+        theta,phi = self.point_angles(rows,cols)
+        lambda1 = (SPEED_OF_SOUND/np.atleast_1d(fc)).reshape((-1,)+(1,)*np.ndim(phi))
+        return Generate_manifoldmatrix_UCA_2D_grid(MIC_RADIUS,theta,phi,lambda1,self.theta_offset).astype(complex_dtype,copy=False)
+
+class PipeGeometry(Geometry):
+    #Pipe in front of the array, grid PIPE_LENGTH_INTERVALS x PIPE_DIAMETER_INTERVALS. z_start/z_stop override the vertical
+    #extent, shape=(rows,cols) the grid.
+    name = 'pipe'
+
+    @property
+    def shape(self):
+        return tuple(self.params.get('shape',(PIPE_LENGTH_INTERVALS,PIPE_DIAMETER_INTERVALS)))
+
+    def axes(self,shape=None):
+        #y along the pipe (rows) and z (cols), cm
+        shape = self.shape if shape is None else shape
+        return pipe_axes(shape[0],shape[1],self.params.get('z_start'),self.params.get('z_stop'))
+
+    def point_angles(self,rows,cols):
+        return pipe_point_angles(rows,cols)
+
+class PlaneGeometry(Geometry):
+    #Far field plane above the array, grid PLANE_LENGTH_INTERVALS x PLANE_LENGTH_INTERVALS. height overrides PLANE_HEIGHT,
+    #shape=(rows,cols) the grid.
+    name = 'plane'
+
+    @property
+    def shape(self):
+        return tuple(self.params.get('shape',(PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS)))
+
+    def axes(self,shape=None):
+        #y (rows) and x (cols), cm
+        shape = self.shape if shape is None else shape
+        return plane_axes(shape[0],shape[1])
+
+    def point_angles(self,rows,cols):
+        return plane_point_angles(rows,cols,self.params.get('height'))
+
+class PlaneNearFieldGeometry(Geometry):
+    #Near field plane from the PLANE_NF LUT's
+    name = 'plane_nf'
+
+    @property
+    def shape(self):
+        return (PLANE_LENGTH_INTERVALS,PLANE_LENGTH_INTERVALS)
+
+class CylinderNearFieldGeometry(Geometry):
+    #Near field cylinder from the CYL_NF LUT's, only the first 6 mics are used
+    name = 'cylinder_nf'
+    n_mics = 6
+
+    @property
+    def shape(self):
+        return (CYLINDER_Y_INTERVALS,CYLINDER_DELTA_INTERVALS)
+
+class SphericalGeometry(Geometry):
+    #Far field theta/phi hemisphere
+    name = 'spherical'
+
+    @property
+    def shape(self):
+        return (THETA_INTERVALS,PHI_INTERVALS)
+
+#Engine====================================================================
+class MusicEngine:
+    #covariance: 'wideband' (one rfft per channel, see band_covariances_wideband), 'butter' (order 5 filtfilt per band,
+    #needs bw) or 'fir' (filtfilt with the columns of bpFilt). process(frame) returns (composite, per_band) where
+    #per_band holds the min-max normalized map of every band. Both are engine buffers, overwritten by the next frame.
+    def __init__(self,geometry,fc,bw=None,bpFilt=None,covariance='wideband',magType='linadd',weighting='butter',
+                 precision=None,n_sources=2,fs=SAMPLING_RATE,cache_dir=None):
+        if covariance not in COVARIANCE_MODES:
+            raise ValueError(f"Unknown covariance mode: {covariance}")
+        if magType not in MAG_TYPES:
+            raise ValueError(f"Unknown magType: {magType}")
+        if covariance == 'fir' and bpFilt is None:
+            raise ValueError("covariance='fir' needs bpFilt")
+        if covariance != 'fir' and bw is None:
+            raise ValueError(f"covariance='{covariance}' needs bw")
+
+        self.geometry = geometry
+        self.fc = np.asarray(fc,float)
+        self.bw = bw
+        self.bpFilt = bpFilt
+        self.covariance = covariance
+        self.magType = magType
+        self.weighting = weighting
+        self.precision = MUSIC_PRECISION if precision is None else precision
+        self.n_sources = n_sources
+        self.fs = fs
+        complex_dtype,real_dtype = precision_dtypes(self.precision)
+
+        self.manifold = geometry.manifold(self.fc,self.precision,cache_dir)
+        #per band filters (sos, or (b,a) for fir) and filtfilt padlen of the filtered modes
+        if covariance == 'butter':
+            self.filters,self.padlen = butter_band_filters(self.fc,bw,fs),None
+        elif covariance == 'fir':
+            self.filters,self.padlen = [(bpFilt[:,k],1) for k in range(len(self.fc))],0
+
+        #Work buffers
+        n_bands,n_mics,shape = len(self.fc),geometry.n_mics,geometry.shape
+        self.R = np.zeros((n_bands,n_mics,n_mics),complex_dtype)
+        self.spectra = np.zeros((n_bands,)+shape,real_dtype) #raw pseudospectra
+        self.per_band = np.zeros((n_bands,)+shape,real_dtype) #normalized pseudospectra
+        self.composite = np.zeros(shape,real_dtype)
+        self._proj = np.zeros((n_bands,int(np.prod(shape)),n_mics-n_sources),complex_dtype)
+        self._power = np.zeros(self._proj.shape,real_dtype)
+        self._scratch = np.zeros(self.spectra.shape,real_dtype)
+        self.timer = None
+
+    def _stage(self,stage):
+        return _NO_TIMER if self.timer is None else self.timer(stage)
+
+    def covariances(self,frame):
+        #Spatial covariance of every band of a (samples x channels) frame, written into self.R
+        data = np.asarray(frame)[:,:self.geometry.n_mics].astype(float)
+        with self._stage('covariance'):
+            if self.covariance == 'wideband':
+                W = wideband_band_weights(self.fc,self.bw,len(data),self.fs,self.weighting)
+                self.R[...] = band_covariances_wideband(data,W,self.precision)
+                return self.R
+
+            return band_covariances_filtered(data,self.filters,self.R,self.padlen)
+
+    def process_covariances(self,R=None):
+        #Maps from band covariances (self.R unless R is given): returns (composite, per_band)
+        R = self.R if R is None else R
+        with self._stage('subspace'):
+            un = noise_subspaces(R,self.n_sources,self.precision)
+        with self._stage('spectra'):
+            music_pseudospectra(self.manifold,un,self.precision,out=self.spectra,proj=self._proj,power=self._power)
+        with self._stage('combine'):
+            return self._combine()
+
+    def _combine(self):
+        #Composite map and normalized per band maps from self.spectra
+        n_bands = len(self.spectra)
+        flat = self.spectra.reshape(n_bands,-1)
+        maxes = flat.max(axis=1).reshape((n_bands,)+(1,)*(self.spectra.ndim-1))
+        mins = flat.min(axis=1).reshape(maxes.shape)
+
+        if self.magType == 'lin':
+            np.divide(self.spectra,maxes,out=self._scratch)
+            np.prod(self._scratch,axis=0,out=self.composite)
+        elif self.magType == 'log':
+            np.log10(self.spectra,out=self._scratch)
+            np.sum(self._scratch,axis=0,out=self.composite)
+            self.composite *= 10/n_bands
+        elif self.magType == 'linadd':
+            np.divide(self.spectra,maxes,out=self._scratch)
+            np.sum(self._scratch,axis=0,out=self.composite)
+        else: #linaddwithoutnorm
+            np.sum(self.spectra,axis=0,out=self.composite)
+
+        np.subtract(self.spectra,mins,out=self.per_band)
+        self.per_band /= maxes-mins
+        return self.composite,self.per_band
+
+    def process(self,frame):
+        #(samples x channels) frame -> (composite, per_band)
+        self.covariances(frame)
+        return self.process_covariances()
+
+#Shared engines for the data_process_* entry points, keyed by everything that shapes them. Each holds its manifold
+#and work buffers, so only the MAX_ENGINES most recently created are kept (band plans and bpFilt's may change per call).
+MAX_ENGINES = 8
+_ENGINES = {}
+
+def get_music_engine(geometry,fc,bw=None,bpFilt=None,covariance='wideband',magType='linadd',**kwargs):
+    key = (geometry.key(),tuple(np.asarray(fc,float)),bw,id(bpFilt),covariance,magType,tuple(sorted(kwargs.items())))
+    engine = _ENGINES.get(key)
+    if engine is None or engine.bpFilt is not bpFilt:
+        _ENGINES.pop(key,None)
+        if len(_ENGINES) >= MAX_ENGINES:
+            _ENGINES.pop(next(iter(_ENGINES)))
+        engine = MusicEngine(geometry,fc,bw=bw,bpFilt=bpFilt,covariance=covariance,magType=magType,**kwargs)
+        _ENGINES[key] = engine
+    return engine
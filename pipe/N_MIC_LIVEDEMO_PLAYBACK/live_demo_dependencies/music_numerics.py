@@ -0,0 +1,44 @@
+import numpy as np
+from .glob_vars import MUSIC_PRECISION
+
+#Batched MUSIC numerics. Covariances of all bands are stacked (bands x mics x mics) and decomposed with one
+#Hermitian eigensolver call; the pseudospectra of all bands come from one batched matmul.
+
+PRECISIONS = {
+    'double': (np.complex128, np.float64),
+    'single': (np.complex64, np.float32), #halves memory traffic of the steering tensors
+}
+
+def precision_dtypes(precision=None):
+    #(complex dtype, real dtype) of a precision name, MUSIC_PRECISION if None
+    precision = MUSIC_PRECISION if precision is None else precision
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    return PRECISIONS[precision]
+
+def noise_subspaces(R,n_sources=2,precision=None):
+    #(bands x mics x mics) Hermitian covariances -> (bands x mics x mics-n_sources) noise subspaces.
+    #eigh returns ascending eigenvalues, so the noise subspace is the first mics-n_sources eigenvectors
+    #(the same subspace as u[:,n_sources:] of the SVD).
+    complex_dtype,_ = precision_dtypes(precision)
+    R = np.asarray(R).astype(complex_dtype,copy=False)
+    w,v = np.linalg.eigh(R)
+    return v[...,:R.shape[-1]-n_sources]
+
+def music_pseudospectra(manifold,un,precision=None,out=None,proj=None,power=None):
+    #manifold (bands x ... x mics) steering tensor and un (bands x mics x k) noise subspaces
+    #-> (bands x ...) pseudospectra 1/|a^H.un|^2.
+    #|a^H.un| = |a^T.conj(un)|, so only the small noise subspace is conjugated, never the manifold.
+    #out, proj (bands x grid points x k, complex) and power (same shape, real) are optional preallocated buffers.
+    complex_dtype,real_dtype = precision_dtypes(precision)
+    manifold = manifold.astype(complex_dtype,copy=False)
+    bands,n_mics = manifold.shape[0],manifold.shape[-1]
+    grid_shape = manifold.shape[1:-1]
+    if out is None:
+        out = np.empty((bands,)+grid_shape,real_dtype)
+
+    proj = np.matmul(manifold.reshape(bands,-1,n_mics),np.conjugate(un).astype(complex_dtype,copy=False),out=proj)
+    power = np.abs(proj,out=power)
+    np.square(power,out=power)
+    np.sum(power,axis=-1,out=out.reshape(bands,-1))
+    return np.reciprocal(out,out=out)
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+#Continuous recording of raw acquisition frames into an archive directory of fixed size segments, so past events can
+#be reprocessed (the shared frame file and pickles only ever hold the latest frame).
+#   recorder = SegmentRecorder(RECORDING_DIR,N_MICS,SAMPLING_RATE); recorder.start()
+#   recorder.write(frame)                         #(samples x channels), from the acquisition loop
+#   archive = SegmentArchive(RECORDING_DIR); data,t0 = archive.read(archive.end_time-10,archive.end_time)
+#Every segment is three files named by the wall clock time and sequence number of its first frame:
+#   <name>.dat   samples x channels, float32 or int16 (scaled by full_scale), preallocated to the segment capacity and
+#                written through a memory map. Trimmed to the samples written when the segment is closed.
+#   <name>.idx   one record per frame: sequence number, sample offset in the segment, samples, timestamp of the first
+#                sample. Appended after the frame's samples are in the map, so readers only see complete frames.
+#   <name>.json  channels, sample rate, dtype, full scale and capacity.
+#A segment is closed and the next one opened when it is full (segment_seconds of audio, or segment_bytes) or when a
+#frame is timestamped segment_seconds after the segment start (acquisition paused). max_segments deletes the oldest.
+#write() only copies the frame into a bounded queue, a thread does the file IO: a frame that finds the queue full is
+#dropped (counted in dropped, a gap in the index sequence numbers) rather than blocking acquisition.
+
+VERSION = 1
+INDEX_DTYPE = np.dtype([('seq',np.int64),('offset',np.int64),('samples',np.int64),('timestamp',np.float64)])
+DTYPES = ('float32','int16')
+CLOCK_TOLERANCE = 0.25 #s the sample clock may be off the wall clock before it is set to it again
+
+def _segment_name(timestamp,seq):
+    return time.strftime('%Y%m%d_%H%M%S',time.localtime(timestamp))+f"_{int(timestamp*1e6)%1000000:06d}_{seq:010d}"
+
+class SegmentRecorder:
+    #channels, sample_rate: of the frames written. dtype 'float32' or 'int16' (half the size, samples of
+    #+-full_scale map to +-32767 and are clipped beyond). queue_frames bounds the frames waiting for the writer thread.
+    def __init__(self,directory,channels,sample_rate,dtype='float32',full_scale=10.,segment_seconds=60,
+                 segment_bytes=None,max_segments=None,queue_frames=256):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown recording dtype: {dtype}")
+        self.directory = directory
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.full_scale = full_scale
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self.capacity = int(segment_seconds*sample_rate) #samples per channel per segment
+        if segment_bytes is not None:
+            self.capacity = min(self.capacity,segment_bytes//(channels*self.dtype.itemsize))
+
+        self.seq = 0 #frames written (or dropped) so far
+        self._clock = None #timestamp the next frame continues from
+        self.dropped = 0
+        self.segments_written = 0
+        self._queue = queue.Queue(queue_frames)
+        self._thread = None
+        self._segment = None #(name, data memmap, index file, start timestamp)
+        self._used = 0 #samples in the open segment
+        self._pending = [] #index records of the open segment not written yet
+
+    #Acquisition side-------------------------------------------------------
+    def start(self):
+        os.makedirs(self.directory,exist_ok=True)
+        self._thread = threading.Thread(target=self._run,daemon=True)
+        self._thread.start()
+        return self
+
+    def write(self,data,timestamp=None,seq=None):
+        #Queue a (samples x channels) frame, timestamp of its first sample. By default frames that follow on each other
+        #are timestamped by counting samples (read times jitter), from the wall clock when the frame ended now after a
+        #gap. seq defaults to the recorder's own frame count. Never blocks, returns False if the frame was dropped.
+        n_samples = len(data)
+        if n_samples > self.capacity:
+            raise ValueError(f"Frame of {n_samples} samples exceeds the segment capacity of {self.capacity}")
+        if timestamp is None:
+            timestamp = time.time()-n_samples/self.sample_rate
+            if self._clock is not None and abs(timestamp-self._clock) < CLOCK_TOLERANCE:
+                timestamp = self._clock
+        self._clock = timestamp+n_samples/self.sample_rate
+        seq = self.seq if seq is None else seq
+        self.seq = seq+1
+        try:
+            self._queue.put_nowait((np.array(data,np.float32),timestamp,seq))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        #write out the queued frames and close the open segment
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*exc):
+        self.close()
+
+    #Writer thread----------------------------------------------------------
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            while item is not None: #everything queued by now, then one index write for all of it
+                self._store(*item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._flush()
+            if item is None:
+                self._close_segment()
+                return
+
+    def _store(self,data,timestamp,seq):
+        #samples of one frame into the open segment (rotating first if needed), its index record pending
+        n_samples = len(data)
+        if self._segment is not None and (self._used+n_samples > self.capacity or timestamp-self._segment[3] >= self.segment_seconds):
+            self._close_segment()
+        if self._segment is None:
+            self._open_segment(timestamp,seq)
+        if self.dtype == np.int16:
+            data *= 32767/self.full_scale
+            np.clip(data,-32767,32767,out=data)
+            np.rint(data,out=data)
+        self._segment[1][self._used:self._used+n_samples] = data[:,:self.channels]
+        self._pending.append((seq,self._used,n_samples,timestamp))
+        self._used += n_samples
+
+    def _flush(self):
+        #index records after their samples, a reader never sees a frame that is not written yet
+        if self._pending:
+            self._segment[2].write(np.array(self._pending,INDEX_DTYPE).tobytes())
+            self._segment[2].flush()
+            self._pending = []
+
+    def _open_segment(self,timestamp,seq):
+        name = os.path.join(self.directory,_segment_name(timestamp,seq))
+        with open(name+'.json','w') as f:
+            json.dump({'version':VERSION,'channels':self.channels,'sample_rate':self.sample_rate,'dtype':self.dtype.name,
+                       'full_scale':self.full_scale,'capacity':self.capacity,'start_time':timestamp},f)
+        data = np.memmap(name+'.dat',self.dtype,'w+',shape=(self.capacity,self.channels))
+        self._segment = (name,data,open(name+'.idx','wb'),timestamp)
+        self._used = 0
+        self.segments_written += 1
+        self._expire()
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        self._flush()
+        name,data,index,_ = self._segment
+        data.flush()
+        del data
+        self._segment = None
+        index.close()
+        try:
+            with open(name+'.dat','r+b') as f: #only the samples written
+                f.truncate(self._used*self.channels*self.dtype.itemsize)
+        except OSError: #mapped by a reader (Windows), the index still tells how much is valid
+            pass
+
+    def _expire(self):
+        #delete the oldest segments beyond max_segments
+        if self.max_segments is None:
+            return
+        names = segment_names(self.directory)
+        for name in names[:max(0,len(names)-self.max_segments)]:
+            for extension in ('.json','.idx','.dat'):
+                try:
+                    os.remove(os.path.join(self.directory,name+extension))
+                except OSError:
+                    pass
+
+def segment_names(directory):
+    #names of the segments in directory, oldest first
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f[:-5] for f in os.listdir(directory) if f.endswith('.json'))
+
+#Reading===================================================================
+class Segment:
+    def __init__(self,path):
+        self.path = path
+        with open(path+'.json') as f:
+            meta = json.load(f)
+        self.channels,self.sample_rate = meta['channels'],meta['sample_rate']
+        self.dtype,self.full_scale = np.dtype(meta['dtype']),meta['full_scale']
+        self.index = np.zeros(0,INDEX_DTYPE)
+        self.refresh()
+
+    def refresh(self):
+        #reread the index, the open segment keeps growing (a partially written record is ignored)
+        try:
+            raw = np.fromfile(self.path+'.idx',np.uint8)
+        except FileNotFoundError: #deleted by the recorder's max_segments
+            raw = np.zeros(0,np.uint8)
+        self.index = raw[:len(raw)//INDEX_DTYPE.itemsize*INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+        self.ends = self.index['timestamp']+self.index['samples']/self.sample_rate
+
+    @property
+    def start_time(self):
+        return self.index['timestamp'][0] if len(self.index) else np.inf
+
+    @property
+    def end_time(self):
+        return self.ends[-1] if len(self.index) else -np.inf
+
+    def sample_ranges(self,t_start,t_stop):
+        #(start, stop) sample rows in the .dat of [t_start,t_stop) and the timestamp of the first, merged over
+        #consecutive frames
+        first,last = np.searchsorted(self.ends,t_start,'right'),np.searchsorted(self.index['timestamp'],t_stop)
+        frames = self.index[first:last]
+        if not len(frames):
+            return [],None
+        k0,k1 = (np.clip(np.ceil(np.round((t-frames['timestamp'])*self.sample_rate,6)),0,frames['samples']).astype(np.int64)
+                 for t in (t_start,t_stop)) #first samples at or after t, rounding off timestamp float error
+        keep = k1 > k0
+        if not keep.any():
+            return [],None
+        t_first = (frames['timestamp']+k0/self.sample_rate)[keep][0]
+        starts,stops = (frames['offset']+k0)[keep],(frames['offset']+k1)[keep]
+        breaks = np.flatnonzero(starts[1:] != stops[:-1])+1
+        return list(zip(starts[np.r_[0,breaks]],stops[np.r_[breaks-1,-1]])),t_first
+
+    def read_rows(self,start,stop):
+        #samples start:stop as float32 (samples x channels), mapping only that part of the file
+        itemsize = self.channels*self.dtype.itemsize
+        data = np.memmap(self.path+'.dat',self.dtype,'r',offset=start*itemsize,shape=(stop-start,self.channels))
+        if self.dtype == np.int16:
+            return data*np.float32(self.full_scale/32767)
+        return np.array(data)
+
+class SegmentArchive:
+    #Reader of a SegmentRecorder directory, also while it is being recorded (refresh() picks up new frames).
+    def __init__(self,directory):
+        self.directory = directory
+        self.segments = []
+        self._growing = None #path of the newest segment at the last refresh
+        self.refresh()
+
+    def refresh(self):
+        #New segments read their whole index. Of the known ones only the newest at the last refresh can have grown
+        #since: it is reread even if the recorder rotated past it in between, its last frames were flushed on close.
+        known = {segment.path:segment for segment in self.segments}
+        paths = [os.path.join(self.directory,name) for name in segment_names(self.directory)]
+        segments = []
+        for path in paths:
+            segment = known.get(path)
+            if segment is None:
+                segment = Segment(path)
+            elif path == self._growing:
+                segment.refresh()
+            segments.append(segment)
+        self._growing = paths[-1] if paths else None
+        self.segments = [segment for segment in segments if len(segment.index)]
+
+    @property
+    def channels(self):
+        return self.segments[0].channels if self.segments else None
+
+    @property
+    def sample_rate(self):
+        return self.segments[0].sample_rate if self.segments else None
+
+    @property
+    def start_time(self):
+        return min((segment.start_time for segment in self.segments),default=None)
+
+    @property
+    def end_time(self):
+        return max((segment.end_time for segment in self.segments),default=None)
+
+    def read(self,t_start,t_stop):
+        #Samples recorded in [t_start,t_stop) (wall clock seconds) as (samples x channels) float32, and the timestamp
+        #of the first sample (None if there are none). Only the files of that range are read. Gaps in the recording
+        #(dropped frames, acquisition paused) are not filled, the samples on either side are concatenated.
+        parts,t_first = [],None
+        for segment in self.segments:
+            if segment.end_time <= t_start or segment.start_time >= t_stop:
+                continue
+            ranges,t_segment = segment.sample_ranges(t_start,t_stop)
+            if t_first is None:
+                t_first = t_segment
+            parts += [segment.read_rows(start,stop) for start,stop in ranges]
+        channels = self.channels or 0
+        return (np.concatenate(parts) if parts else np.zeros((0,channels),np.float32)),t_first
@@ -0,0 +1,156 @@
+import os
+import mmap
+import time
+import numpy as np
+
+#Latest audio frame between processes (DAQEXPRESS acquisition -> GUI) through a memory mapped file, instead of
+#pickling every frame to disk. Double buffered: frame k goes into slot k%2 while the other slot keeps frame k-1
+#complete. Every slot has a sequence lock word, odd while the writer fills the slot and 2k once frame k is complete;
+#readers check it before and after copying and retry when it moved, so a torn frame is never returned.
+#   writer = SharedFrameWriter(SHARED_FRAMES_FILE,N_MICS,capacity,SAMPLING_RATE); writer.write(data)
+#   reader = SharedFrameReader(SHARED_FRAMES_FILE); data = reader.read(wait=5)
+#File layout, int64 words: header [magic, version, slots, capacity, channels, latest seq (0: none), 2 reserved], then
+#per slot [lock, seq, samples, sample rate, timestamp (float64), 3 reserved] + capacity x channels float64 samples.
+#The file is reused in place across writer restarts (and only ever grows), so readers that have it mapped stay valid.
+
+MAGIC = 0x454d415246534d42 #b'BMSFRAME'
+VERSION = 1
+N_SLOTS = 2
+HEADER_WORDS = 8
+SLOT_WORDS = 8
+
+class FrameUnavailable(Exception):
+    #no complete frame (writer not started yet, or still writing the first frame)
+    pass
+
+def layout_size(capacity,channels):
+    return 8*(HEADER_WORDS+N_SLOTS*(SLOT_WORDS+capacity*channels))
+
+class _SharedFrames:
+    def _attach(self,fileobj,write):
+        self._mm = mmap.mmap(fileobj.fileno(),0,access=mmap.ACCESS_WRITE if write else mmap.ACCESS_READ)
+        self.header = np.ndarray(HEADER_WORDS,np.int64,self._mm)
+
+    def _map_slots(self):
+        self.capacity,self.channels = int(self.header[3]),int(self.header[4])
+        slot_size = 8*(SLOT_WORDS+self.capacity*self.channels)
+        self.slot_headers = [np.ndarray(SLOT_WORDS,np.int64,self._mm,8*HEADER_WORDS+k*slot_size) for k in range(N_SLOTS)]
+        self.slot_data = [np.ndarray((self.capacity,self.channels),np.float64,self._mm,8*(HEADER_WORDS+SLOT_WORDS)+k*slot_size)
+                          for k in range(N_SLOTS)]
+
+    def _release(self):
+        self.header = self.slot_headers = self.slot_data = None #views first, mmap refuses to close while exported
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+class SharedFrameWriter(_SharedFrames):
+    #Producer side. capacity: the most samples per channel a frame can have.
+    def __init__(self,path,channels,capacity,sample_rate):
+        self.sample_rate = sample_rate
+        size = layout_size(capacity,channels)
+        self._file = open(path,'r+b' if os.path.exists(path) else 'w+b')
+        if os.path.getsize(path) < size:
+            self._file.truncate(size)
+        self._attach(self._file,write=True)
+
+        #continue the sequence of a previous writer, readers only ever see it increase
+        previous = self.header[0] == MAGIC and self.header[1] == VERSION
+        self.seq = int(self.header[5]) if previous else 0
+        self.header[5] = 0 #no valid frame until the first write in this layout
+        self.header[:5] = [MAGIC,VERSION,N_SLOTS,capacity,channels]
+        self._map_slots()
+        for slot_header in self.slot_headers:
+            slot_header[0] = 0
+
+    def write(self,data,timestamp=None):
+        #publish a (samples x channels) frame
+        n_samples = len(data)
+        if n_samples > self.capacity:
+            raise ValueError(f"Frame of {n_samples} samples exceeds the capacity of {self.capacity}")
+        seq = self.seq+1
+        slot_header = self.slot_headers[seq%N_SLOTS]
+        slot_header[0] = 2*seq-1 #writing
+        self.slot_data[seq%N_SLOTS][:n_samples] = data
+        slot_header[1:4] = [seq,n_samples,self.sample_rate]
+        slot_header[4:5].view(np.float64)[0] = time.time() if timestamp is None else timestamp
+        slot_header[0] = 2*seq #complete
+        self.header[5] = seq
+        self.seq = seq
+
+    def close(self):
+        self._release()
+        self._file.close()
+
+class SharedFrameReader(_SharedFrames):
+    #Consumer side. After a read, seq, sample_rate and timestamp describe the frame returned.
+    def __init__(self,path):
+        self.path = path
+        self._file = None
+        self._mm = None
+        self.seq = self.sample_rate = self.timestamp = None
+
+    def _attached(self):
+        #map the file (again, if the writer changed the layout), False while there is nothing to read
+        if self._mm is not None and tuple(self.header[:5]) != self._layout:
+            self._release()
+        if self._mm is None:
+            if not os.path.exists(self.path) or os.path.getsize(self.path) < 8*HEADER_WORDS:
+                return False
+            if self._file is None:
+                self._file = open(self.path,'rb')
+            self._attach(self._file,write=False)
+            if self.header[0] != MAGIC or self.header[1] != VERSION:
+                self._release()
+                return False
+            self._layout = tuple(self.header[:5])
+            self._map_slots()
+        return True
+
+    def _try_read(self,copy):
+        #latest complete frame, or None if the writer overwrote it while copying (or there is none)
+        if not self._attached():
+            return None
+        seq = int(self.header[5])
+        if seq == 0:
+            return None
+        slot_header = self.slot_headers[seq%N_SLOTS]
+        if slot_header[0] != 2*seq:
+            return None
+        n_samples,sample_rate = int(slot_header[2]),int(slot_header[3])
+        timestamp = float(slot_header[4:5].view(np.float64)[0])
+        data = self.slot_data[seq%N_SLOTS][:n_samples]
+        if copy:
+            data = data.copy()
+        if slot_header[0] != 2*seq:
+            return None
+        self.seq,self.sample_rate,self.timestamp = seq,sample_rate,timestamp
+        return data
+
+    def read(self,copy=True,wait=0):
+        #Latest complete (samples x channels) frame, waiting up to wait seconds for one to exist. copy=False returns a
+        #zero-copy view of the slot instead, valid while is_valid(reader.seq) (until the writer is two frames further).
+        deadline = time.time()+wait
+        while True:
+            for _ in range(N_SLOTS+1): #a torn copy means a newer frame is complete, retry right away
+                data = self._try_read(copy)
+                if data is not None:
+                    return data
+            if time.time() >= deadline:
+                raise FrameUnavailable(f"No audio frame in {self.path}")
+            time.sleep(0.005)
+
+    def is_valid(self,seq):
+        #True while frame seq has not been overwritten
+        return self._mm is not None and self.slot_headers[seq%N_SLOTS][0] == 2*seq
+
+    @property
+    def latest_seq(self):
+        #sequence number of the newest complete frame, 0 if none
+        return int(self.header[5]) if self._attached() else 0
+
+    def close(self):
+        self._release()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.fft as sp_fft
 from scipy.io import wavfile
 
 def delay_and_sum_beamforming(input_wav, theta, phi, radius, speed_of_sound=343):
@@ -66,11 +67,68 @@ def delay_and_sum_beamforming(input_wav, theta, phi, radius, speed_of_sound=343)
     # Write the output wav file===========================================
     wavfile.write(input_wav[:-4]+f"_beamformed_{int(theta*180/np.pi)}_{int(phi*180/np.pi)}.wav", sample_rate, output.astype(np.int16))
 
-# Example usage
-file_path = "../../DSB_TEST_21_11_2024/wav/"
-input_wav = 'DSB_TEST_BALLMILL_THETA_MINUS135_PHI_45_audio.wav'
-theta = 45  # Target azimuth in degrees
-phi = 85   # Target elevation in degrees
-radius = 0.05  # Radius of the circular array in meters
+def uca_mic_positions(num_channels, radius):
+    # (num_channels x 3) positions in meters, same layout as above: clockwise ring, last mic at the centre if odd
+    N_MICS_EVEN = num_channels-num_channels%2
+    angles = -2*np.pi*np.arange(N_MICS_EVEN)/N_MICS_EVEN
+    positions = np.zeros((num_channels, 3))
+    positions[:N_MICS_EVEN, 0] = radius*np.cos(angles)
+    positions[:N_MICS_EVEN, 1] = radius*np.sin(angles)
+    return positions
 
-delay_and_sum_beamforming(file_path+input_wav, theta, phi, radius)
+def direction_delays(mic_positions, theta, phi, speed_of_sound=343):
+    # (K x channels) delay and sum delays in seconds towards K directions (theta, phi in degrees, arrays), smallest 0 per direction
+    theta = np.deg2rad(np.atleast_1d(np.asarray(theta, float)))
+    phi = np.deg2rad(np.atleast_1d(np.asarray(phi, float)))
+    target_directions = np.stack([np.sin(phi)*np.cos(theta), np.sin(phi)*np.sin(theta), np.cos(phi)], axis=1)
+    delays = target_directions @ mic_positions.T / speed_of_sound
+    return delays - delays.min(axis=1, keepdims=True)
+
+class MultiBeamformer:
+    # Delay and sum towards K directions at once. The delays of all directions and channels become one
+    # (bins x K x channels) weight tensor, built once; process() is then an rfft per channel, one batched matrix
+    # product per frequency bin and an irfft per direction. Delays are exact (fractional), the FFT is zero padded
+    # past the largest delay so nothing wraps around. band=(low, high) Hz only keeps those bins, which also makes the
+    # weights and the product proportionally smaller.
+    def __init__(self, theta, phi, num_channels, num_samples, sample_rate, radius, band=None, speed_of_sound=343):
+        self.num_channels = num_channels
+        self.num_samples = num_samples
+        self.delays = direction_delays(uca_mic_positions(num_channels, radius), theta, phi, speed_of_sound)
+        self.n_fft = sp_fft.next_fast_len(num_samples+int(np.ceil(self.delays.max()*sample_rate))+1, real=True)
+        freqs = sp_fft.rfftfreq(self.n_fft, 1/sample_rate)
+        self.bins = np.arange(len(freqs)) if band is None else np.flatnonzero((freqs >= band[0]) & (freqs <= band[1]))
+        # weights[f, k, c]: delay channel c by delays[k, c] and average
+        self.weights = (np.exp(-2j*np.pi*freqs[self.bins, np.newaxis, np.newaxis]*self.delays[np.newaxis])/num_channels).astype(np.complex64)
+
+    def process(self, data):
+        # (samples x channels) frame -> (K x samples) beamformed signals
+        X = sp_fft.rfft(np.asarray(data, np.float32), self.n_fft, axis=0)[self.bins]  # (bins x channels)
+        Y = np.zeros((len(self.delays), self.n_fft//2+1), np.complex64)
+        Y[:, self.bins] = np.matmul(self.weights, X[:, :, np.newaxis])[:, :, 0].T
+        return sp_fft.irfft(Y, self.n_fft, axis=1)[:, :self.num_samples]
+
+_BEAMFORMERS = {}
+
+def delay_and_sum_directions(data, theta, phi, sample_rate, radius, band=None, speed_of_sound=343):
+    # (K x samples) delay and sum outputs of a (samples x channels) frame towards the K directions theta[k], phi[k]
+    # (degrees). The weights are cached per direction list and frame shape, so repeated calls only cost the FFTs and
+    # one matrix product.
+    num_samples, num_channels = np.shape(data)
+    key = (tuple(np.atleast_1d(theta).astype(float)), tuple(np.atleast_1d(phi).astype(float)), num_channels, num_samples,
+           sample_rate, radius, None if band is None else tuple(band), speed_of_sound)
+    beamformer = _BEAMFORMERS.get(key)
+    if beamformer is None:
+        if len(_BEAMFORMERS) >= 16:  # cursor/pixel sets change, keep only recent ones
+            _BEAMFORMERS.pop(next(iter(_BEAMFORMERS)))
+        beamformer = _BEAMFORMERS[key] = MultiBeamformer(theta, phi, num_channels, num_samples, sample_rate, radius, band, speed_of_sound)
+    return beamformer.process(data)
+
+if __name__ == "__main__":
+    # Example usage
+    file_path = "../../DSB_TEST_21_11_2024/wav/"
+    input_wav = 'DSB_TEST_BALLMILL_THETA_MINUS135_PHI_45_audio.wav'
+    theta = 45  # Target azimuth in degrees
+    phi = 85   # Target elevation in degrees
+    radius = 0.05  # Radius of the circular array in meters
+
+    delay_and_sum_beamforming(file_path+input_wav, theta, phi, radius)
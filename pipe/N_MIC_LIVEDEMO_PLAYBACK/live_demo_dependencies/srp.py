@@ -0,0 +1,101 @@
+import numpy as np
+from .glob_vars import *
+from .music_engine import MusicEngine, MAX_ENGINES
+from .music_numerics import precision_dtypes
+from .spatial_filtering import uca_mic_positions, direction_delays
+
+#Steered response power (SRP) maps: the output power of a beamformer steered at every grid point, a cheaper and more
+#noise robust complement to MUSIC (no eigendecomposition, no assumed number of sources, but wider peaks).
+#   delay and sum: SrpEngine, in the frequency domain from the same band covariances and cached manifold as
+#                  MusicEngine, a drop in replacement for it (StreamingMusic, stage timers, band combination).
+#   DMAS:          dmas_power_map, in the time domain over all grid points at once, sharper peaks at a higher cost.
+
+#Delay and sum=============================================================
+def srp_spectra(manifold,R,precision=None,out=None):
+    #manifold (bands x ... x mics) steering tensor and R (bands x mics x mics) band covariances
+    #-> (bands x ...) delay and sum power a^H.R.a. R = X^H.X conjugates the same way as MUSIC's |a^H.un|, so both
+    #peak at the same grid points.
+    complex_dtype,real_dtype = precision_dtypes(precision)
+    manifold = manifold.astype(complex_dtype,copy=False)
+    bands,n_mics = manifold.shape[0],manifold.shape[-1]
+    if out is None:
+        out = np.empty((bands,)+manifold.shape[1:-1],real_dtype)
+
+    A = manifold.reshape(bands,-1,n_mics)
+    RA = np.matmul(A,np.swapaxes(R,1,2).astype(complex_dtype,copy=False)) #rows are R.a of every grid point
+    RA *= np.conjugate(A)
+    np.sum(RA.real,axis=-1,out=out.reshape(bands,-1))
+    return out
+
+class SrpEngine(MusicEngine):
+    #MusicEngine with the delay and sum power instead of the MUSIC pseudospectrum as band maps. Covariances,
+    #manifold, magType band combination and the returned (composite, per_band) buffers are the same, n_sources is
+    #unused. Timed stages: 'covariance', 'spectra' and 'combine'.
+    def process_covariances(self,R=None):
+        R = self.R if R is None else R
+        with self._stage('spectra'):
+            srp_spectra(self.manifold,R,self.precision,out=self.spectra)
+        with self._stage('combine'):
+            return self._combine()
+
+_ENGINES = {} #bounded by MAX_ENGINES, like the MUSIC engines
+
+def get_srp_engine(geometry,fc,bw,covariance='wideband',magType='linadd',**kwargs):
+    #Shared SrpEngine, like music_engine.get_music_engine
+    key = (geometry.key(),tuple(np.asarray(fc,float)),bw,covariance,magType,tuple(sorted(kwargs.items())))
+    engine = _ENGINES.get(key)
+    if engine is None:
+        if len(_ENGINES) >= MAX_ENGINES:
+            _ENGINES.pop(next(iter(_ENGINES)))
+        engine = _ENGINES[key] = SrpEngine(geometry,fc,bw=bw,covariance=covariance,magType=magType,**kwargs)
+    return engine
+
+#DMAS======================================================================
+def grid_delays(geometry,shape=None,fs=SAMPLING_RATE):
+    #(grid points x mics) delay and sum delays in samples of a geometry with continuous coordinates (pipe, plane),
+    #grid of the given shape (default geometry.shape). The manifold's theta, offset by theta_offset, is half a turn
+    #from the physical azimuth of the dmas/spatial_filtering mic layout (see Generate_manifoldmatrix_UCA_2D_grid).
+    shape = geometry.shape if shape is None else shape
+    rows,cols = np.meshgrid(*geometry.axes(shape),indexing='ij')
+    theta,phi = geometry.point_angles(rows,cols)
+    delays = direction_delays(uca_mic_positions(geometry.n_mics,MIC_RADIUS),theta.ravel()-geometry.theta_offset+180,
+                              phi.ravel(),SPEED_OF_SOUND)
+    return delays*fs
+
+def dmas_power_map(frame,geometry,shape=None,fs=SAMPLING_RATE,chunk=8):
+    #(rows x cols) DMAS output energy at every grid point of a (samples x channels) frame, band limit it first.
+    #DMAS sums sign(x_i.x_j).sqrt(|x_i.x_j|) = r_i.r_j over all mic pairs, with r the signed root of the delayed
+    #channels, which is ((sum r)^2 - sum |x|)/2: O(mics) per sample instead of O(mics^2). The delays span only a few
+    #samples, so they are applied fractionally, by linear interpolation between two strided gathers of chunk grid
+    #points at a time. The roots have to be taken after the delay, interpolating them is not smooth enough.
+    shape = geometry.shape if shape is None else shape
+    data = np.asarray(frame,np.float32)[:,:geometry.n_mics]
+    num_samples,n_mics = data.shape
+    delays = np.minimum(grid_delays(geometry,shape,fs),num_samples-1)
+    shifts = np.floor(delays).astype(int)
+    fractions = (delays-shifts).astype(np.float32)[:,:,np.newaxis]
+
+    max_shift = shifts.max()+1
+    padded = np.zeros((max_shift+num_samples,n_mics),np.float32) #zeros before a channel starts
+    padded[max_shift:] = data
+    steps = np.zeros_like(padded) #x[t-1]-x[t]
+    np.subtract(padded[:-1],padded[1:],out=steps[1:])
+    windows = np.lib.stride_tricks.sliding_window_view(padded,num_samples,axis=0)
+    step_windows = np.lib.stride_tricks.sliding_window_view(steps,num_samples,axis=0)
+    mics = np.arange(n_mics)
+
+    energy = np.empty(len(delays))
+    n_pairs = n_mics*(n_mics-1)/2
+    for start in range(0,len(delays),chunk):
+        index = max_shift-shifts[start:start+chunk]
+        delayed = step_windows[index,mics] #(points x mics x samples)
+        delayed *= fractions[start:start+chunk]
+        delayed += windows[index,mics]
+        magnitude = np.abs(delayed)
+        root = np.sqrt(magnitude)
+        np.copysign(root,delayed,out=root)
+        dmas_out = root.sum(axis=1)
+        dmas_out *= dmas_out
+        dmas_out -= magnitude.sum(axis=1)
+        energy[start:start+chunk] = np.einsum('pt,pt->p',dmas_out,dmas_out)
+    return (energy/(num_samples*(2*n_pairs)**2)).reshape(shape)
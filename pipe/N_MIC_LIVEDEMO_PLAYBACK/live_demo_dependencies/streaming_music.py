@@ -0,0 +1,50 @@
+import numpy as np
+from .glob_vars import *
+from .music_engine import *
+
+#Streaming MUSIC: instead of one covariance per independent block, the band covariances are updated from every
+#short hop with exponential forgetting, R <- lam*R + (1-lam)*R_hop, and maps are computed from the running estimate
+#every emit_interval seconds of audio. All captured samples contribute, and the cost of a map does not depend on
+#how much history the estimate covers.
+
+class StreamingMusic:
+    #engine: MusicEngine whose covariance mode is applied to every hop (keep hops a fixed length, the wideband
+    #weights and the covariance scale depend on it). time_constant: forgetting time constant in seconds,
+    #lam = exp(-hop/(fs*time_constant)). emit_interval: seconds of audio between maps, 0 emits on every hop.
+    def __init__(self,engine,time_constant=0.5,emit_interval=0.1):
+        self.engine = engine
+        self.time_constant = time_constant
+        self.emit_interval = emit_interval
+        self.R = np.zeros_like(engine.R)
+        self.reset()
+
+    def reset(self):
+        #forget all history, e.g. after a gap in acquisition
+        self.R[...] = 0
+        self.samples_seen = 0
+        self.samples_since_emit = 0
+
+    def forgetting_factor(self,n_samples):
+        return np.exp(-n_samples/(self.engine.fs*self.time_constant))
+
+    def update(self,block):
+        #fold one (samples x channels) hop into the running band covariances
+        n_samples = len(block)
+        lam = self.forgetting_factor(n_samples) if self.samples_seen else 0. #first hop initializes the estimate
+        R_hop = self.engine.covariances(block) #engine buffer, free to scale in place
+        R_hop *= 1-lam
+        self.R *= lam
+        self.R += R_hop
+        self.samples_seen += n_samples
+        self.samples_since_emit += n_samples
+        return self.R
+
+    def push(self,block):
+        #update with one hop, returns (composite, per_band) when a map is due and None otherwise.
+        #The maps are engine buffers, overwritten by the next emitted map.
+        self.update(block)
+        emit_samples = self.emit_interval*self.engine.fs
+        if self.samples_since_emit < emit_samples:
+            return None
+        self.samples_since_emit = self.samples_since_emit % emit_samples if emit_samples else 0
+        return self.engine.process_covariances(self.R)
@@ -5,10 +5,9 @@ import time
 import logging
 import threading
 import queue
-from flask import Flask, jsonify
-import nidaqmx
-from nidaqmx import stream_readers
-from nidaqmx.constants import TerminalConfiguration
+import json
+import base64
+from flask import Flask, Response, jsonify, request
 import scipy.signal as sp
 
 # Setup logging
@@ -19,14 +18,27 @@ logger = logging.getLogger(__name__)
 base_dir = os.path.dirname(os.path.abspath(__file__))
 pipe_path = os.path.abspath(os.path.join(base_dir, '..', 'pipe'))
 sys.path.append(pipe_path)
+sys.path.append(os.path.abspath(os.path.join(base_dir, '..')))
 
 # Local package imports
-from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.doa_data_process import data_process_pipe_animated_varyband_sfreqs
-from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.glob_vars import SAMPLING_RATE, THETA_OFFSET, PIPE_LENGTH_INTERVALS, PIPE_DIAMETER_INTERVALS
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.doa_data_process import data_process_pipe_animated_varyband_sfreqs, data_process_pipe_animated_varyband_sfreqs_wideband
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.glob_vars import SAMPLING_RATE, THETA_OFFSET, PIPE_LENGTH_INTERVALS, PIPE_DIAMETER_INTERVALS, CACHE_DIR, DAQ_BACKEND, RECORDING_DIR
 from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.generate_bpfilt import generate_bpfilt_varyband
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.BPF import butter_sos
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.DOA_supporting_functions import get_manifold_tensor
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.music_engine import MusicEngine, PipeGeometry
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.srp import SrpEngine, get_srp_engine
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.streaming_music import StreamingMusic
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.daq_backends import make_daq_backend, SimulatedSource, pipe_source_position
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.segment_archive import SegmentRecorder
+from utils.ring_buffer import RingBuffer
+from utils.array_transport import BINARY_MIMETYPE, WIRE_DTYPE, wants_binary, encode_array
+from utils.broadcast import Broadcaster, sse_event
+from utils import metrics
 
 # Flask app
 app = Flask(__name__)
+metrics.instrument_app(app, 'audio_server')  # Per route timings and /metrics (Prometheus), METRICS_ENABLED=0 disables
 
 # Configuration
 CHANNELS = 9
@@ -41,77 +53,109 @@ LOWER_FREQ = 1000
 UPPER_FREQ = 7000
 fc, bw = generate_bpfilt_varyband(BAND_DISTANCE, SAMPLING_RATE, LOWER_FREQ, UPPER_FREQ)
 
+# Acquisition backend: DAQ_BACKEND=nidaq (hardware, default) or DAQ_BACKEND=simulator (environment variable)
+DAQ_CHANNELS = f"Dev1/ai1:{CHANNELS}"
+SIMULATED_SOURCES = [SimulatedSource(pipe_source_position(50), band=(LOWER_FREQ, UPPER_FREQ), snr_db=20)]  # 50 cm along the pipe
+
 # Global state
-task = None
-data_queue = queue.Queue(maxsize=500000)
-heatmap_data = None
+daq = None
+latest_heatmap = None  # (seq, normalized heatmap, acquisition timestamp), replaced as a whole on publish
 last_update_time = 0
-ch_data_list = np.array([np.zeros(BUFFER_SIZE) for i in range(CHANNELS)])
 
 # Process configuration
 AUDIO_SIZE_REDUCTION_FACTOR = 4  # Reduce audio size for better time complexity
+WIDEBAND_MUSIC = True  # Derive all band covariances from one FFT per channel instead of a filtfilt per band
+PARALLEL_BANDS = False  # With WIDEBAND_MUSIC off, run the per band filtfilts on a process pool
+HEATMAP_METHOD = 'music'  # 'music', or 'srp' for delay and sum steered response power maps (srp.py): wider peaks, more robust at low SNR
+
+# Streaming configuration (used instead of the 1 s blocks above when STREAMING_MUSIC is set)
+STREAMING_MUSIC = True  # Update band covariances from every hop with exponential forgetting
+HOP_SIZE = 2048  # Samples per DAQ read / covariance update (~43 ms)
+FORGETTING_TIME_CONSTANT = 0.5  # Seconds of audio the running covariances remember
+HEATMAP_INTERVAL = 0.1  # Seconds of audio between heatmap updates
+# With 'latest' SCHEDULING, a backlog of more hops than the covariances remember is dropped (jump to the newest hop)
+STREAMING_MAX_LAG = int(FORGETTING_TIME_CONSTANT * SAMPLING_RATE / HOP_SIZE)
+
+# Acquisition ring buffer: the DAQ reads frames straight into its slots, processing and /audio_data read from it
+RING_DURATION_SEC = 5  # Seconds of audio kept, older frames are overwritten
+FRAME_SIZE = HOP_SIZE if STREAMING_MUSIC else BUFFER_SIZE  # Samples per channel per DAQ read
+audio_ring = RingBuffer(CHANNELS, FRAME_SIZE, RING_DURATION_SEC, SAMPLING_RATE)
+
+# Recording: every raw frame is also archived under RECORDING_DIR (segment_archive.py) by a writer thread, so past
+# events can be reprocessed. Frames the writer cannot keep up with are dropped from the archive, never from acquisition.
+RECORDING_ENABLED = False
+RECORDING_DTYPE = 'float32'  # 'int16' halves the size (scaled by RECORDING_FULL_SCALE volts)
+RECORDING_FULL_SCALE = 10.0
+RECORDING_SEGMENT_SEC = 60  # Seconds of audio per segment file
+RECORDING_MAX_SEGMENTS = 120  # Oldest segments are deleted beyond this, None keeps all
+recorder = None
+
+# Scheduling: 'latest' always processes the newest frame and drops any backlog, so heatmaps stay current when
+# processing is slower than acquisition; 'fifo' processes every frame in order (until the ring overwrites them).
+# STREAMING_MUSIC processes hops in order either way (its filter state and covariances span hops), with 'latest' it
+# only jumps to the newest hop once it is more than STREAMING_MAX_LAG hops behind
+SCHEDULING = 'latest'
+LATENCY_SMOOTHING = 0.1  # Weight of the newest sample in the mean latency
+processing_stats = {
+    "processed_frames": 0,
+    "dropped_frames": 0,
+    "published_heatmaps": 0,
+    "latency_last": None,  # Seconds from acquisition of the newest frame used to heatmap publish
+    "latency_mean": None,
+    "latency_max": None
+}
+
+# Push (Server-Sent Events) configuration
+HEATMAP_EVENTS_QUEUE = 4  # Heatmaps buffered per /events/heatmap client before the oldest are dropped
+AUDIO_EVENTS_QUEUE = 32  # Audio frames buffered per /events/audio client before the oldest are dropped
+SSE_KEEPALIVE_SEC = 15  # Comment line sent when nothing was pushed for this long
+heatmap_events = Broadcaster(HEATMAP_EVENTS_QUEUE)
+audio_events = Broadcaster(AUDIO_EVENTS_QUEUE)
 
 # Filter configuration
 FILTER_ORDER = 5  # Filter order for bandpass filtering
 FILTER_PADDING = 100  # Padding for filter operation
 
 # Initialize filter
-butter_b, butter_a = sp.butter(FILTER_ORDER, [LOWER_FREQ, UPPER_FREQ], btype='band', fs=SAMPLING_RATE)
+bandpass_sos = butter_sos(FILTER_ORDER, LOWER_FREQ, UPPER_FREQ, SAMPLING_RATE)  # Second order sections, numerically stable
+
+
+def stage_timer(stage):
+    """Time a processing stage into the audio_server_stage_seconds histogram"""
+    return metrics.timer('audio_server_stage_seconds', 'Duration of audio_server acquisition and processing stages', stage=stage)
 
 
-def setup_task():
-    """Configure and return a NI-DAQmx task and reader"""
+def setup_daq():
+    """Create and start the acquisition backend"""
     try:
-        t = nidaqmx.Task()
-        t.ai_channels.add_ai_voltage_chan(f"Dev1/ai1:{CHANNELS}",terminal_config=TerminalConfiguration.RSE)
-
-        # for ch in range(CHANNELS):
-        #     t.ai_channels.add_ai_voltage_chan(
-        #         f"Dev1/ai{ch}",
-        #         terminal_config=TerminalConfiguration.RSE,
-        #         min_val=-10.0,
-        #         max_val=10.0
-        #     )
-
-        t.timing.cfg_samp_clk_timing(
-            rate=SAMPLING_RATE,
-            sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS,
-            samps_per_chan=BUFFER_SIZE
-        )
-
-        in_stream = t.in_stream
-        reader = stream_readers.AnalogMultiChannelReader(in_stream)
-
-        return t, reader
+        backend = make_daq_backend(DAQ_BACKEND, DAQ_CHANNELS, CHANNELS, SAMPLING_RATE, samps_per_chan=BUFFER_SIZE,
+                                   sources=SIMULATED_SOURCES)
+        backend.start()
+        logger.info(f"DAQ backend '{DAQ_BACKEND}' started")
+        return backend
     except Exception as e:
-        logger.error(f"Failed to set up NI-DAQ task: {e}")
-        return None, None
+        logger.error(f"Failed to set up DAQ backend '{DAQ_BACKEND}': {e}")
+        return None
 
 
 def acquire_data():
-    """DAQ acquisition loop (producer)"""
-    global task, reader
+    """DAQ acquisition loop (producer): reads every frame in place into the next ring buffer slot"""
     try:
         while True:
-            if not task or not reader:
-                logger.warning("DAQ task or reader not initialized.")
+            if not daq:
+                logger.warning("DAQ backend not initialized.")
                 time.sleep(1)
                 continue
 
             try:
-                # Read data from DAQ
-                reader.read_many_sample(
-                    data=ch_data_list,
-                    number_of_samples_per_channel=BUFFER_SIZE
-                )
-
-                # Convert to numpy array and ensure correct shape
-                data = np.array(ch_data_list).T
-                if len(data.shape) == 1:
-                    data = data.reshape(-1, 1)
-
-                # Add to processing queue
-                data_queue.put(data)
+                slot = audio_ring.write_slot()
+                with stage_timer('daq_read'):
+                    daq.read(slot)
+                audio_ring.commit(time.time())
+                if recorder:
+                    recorder.write(slot.T, seq=audio_ring.latest_seq)  # Copied into the recorder queue
+                if audio_events.has_subscribers:
+                    audio_events.publish(audio_ring.latest_seq)  # Clients copy the frame from the ring themselves
 
             except Exception as e:
                 logger.error(f"Error acquiring data: {str(e)}")
@@ -124,103 +168,321 @@ def acquire_data():
         logger.error(f"Error in acquisition loop: {str(e)}")
         raise
 
-def process_data():
-    """Processing loop (consumer)"""
-    global heatmap_data, last_update_time
-    
+def next_frame(seq, scheduling=None, max_lag=0):
+    """
+    Wait for frame seq and return (seq, acquisition timestamp, (samples x channels) view).
+    With 'latest' scheduling (SCHEDULING unless given) the newest frame is returned instead once seq is more than
+    max_lag frames behind it; frames skipped over (or already overwritten in 'fifo' mode) are counted as dropped.
+    """
+    scheduling = scheduling or SCHEDULING
+    while True:
+        while not audio_ring.wait(seq, timeout=1.0):
+            pass
+        if scheduling == 'latest' and audio_ring.latest_seq - seq > max_lag:
+            newest = audio_ring.latest_seq
+        else:
+            newest = max(seq, audio_ring.oldest_seq)
+        if newest > seq:
+            processing_stats["dropped_frames"] += newest - seq
+            if scheduling == 'fifo' or max_lag:
+                logger.warning(f"Processing fell behind, skipping {newest - seq} frames")
+            seq = newest
+        frame, timestamp = audio_ring.frame(seq) or (None, None)
+        if frame is not None:
+            return seq, timestamp, frame.T
+        # Overwritten since the check above: drop it, the next pass skips ahead to the oldest frame still available
+        processing_stats["dropped_frames"] += 1
+        seq += 1
+
+def publish_heatmap(heatmap, timestamp):
+    """Normalize and publish a heatmap computed from the frame acquired at timestamp, recording the latency"""
+    global latest_heatmap, last_update_time
+
+    # Normalize heatmap
+    heatmap = (heatmap - np.min(heatmap)) / (np.max(heatmap) - np.min(heatmap))
+
+    # Update global state
+    latest_heatmap = (processing_stats["published_heatmaps"], heatmap, timestamp)
+    last_update_time = time.time()
+    heatmap_events.publish(latest_heatmap + (last_update_time,))
+
+    latency = last_update_time - timestamp
+    mean = processing_stats["latency_mean"]
+    processing_stats["latency_last"] = latency
+    processing_stats["latency_mean"] = latency if mean is None else mean + LATENCY_SMOOTHING * (latency - mean)
+    processing_stats["latency_max"] = max(latency, processing_stats["latency_max"] or 0)
+    processing_stats["published_heatmaps"] += 1
+
+def process_streaming():
+    """Streaming processing loop (consumer): every hop updates the running covariances, heatmaps every HEATMAP_INTERVAL"""
+    engine_class = SrpEngine if HEATMAP_METHOD == 'srp' else MusicEngine
+    engine = engine_class(PipeGeometry(THETA_OFFSET), fc, bw=bw, covariance='wideband', cache_dir=CACHE_DIR)
+    engine.timer = lambda stage: stage_timer('music_' + stage)
+    streamer = StreamingMusic(engine, time_constant=FORGETTING_TIME_CONSTANT, emit_interval=HEATMAP_INTERVAL)
+    zi = np.zeros((len(bandpass_sos), 2, CHANNELS))  # Band pass state carried across hops
+    seq = 0
+
     while True:
         try:
-            if data_queue.empty():
-                time.sleep(0.01)
+            # In order: the filter state and running covariances need consecutive hops. Short slow stretches are
+            # caught up on, a longer backlog is dropped with 'latest' scheduling (only overwritten frames with 'fifo')
+            requested = seq
+            seq, timestamp, data = next_frame(seq, max_lag=STREAMING_MAX_LAG)
+            if seq != requested:  # Frames were skipped, the filter state and covariances must not span the gap
+                zi = np.zeros_like(zi)
+                streamer.reset()
+
+            # Causal band pass, hops are too short for filtfilt padding
+            with stage_timer('bandpass'):
+                filtered_data, zi = sp.sosfilt(bandpass_sos, data, axis=0, zi=zi)
+            seq += 1
+            if not audio_ring.is_valid(seq - 1):  # Overwritten while filtering, a gap as well
+                processing_stats["dropped_frames"] += 1
+                zi = np.zeros_like(zi)
+                streamer.reset()
+                continue
+            processing_stats["processed_frames"] += 1
+
+            with stage_timer('music'):
+                maps = streamer.push(filtered_data)
+            if maps is None:
                 continue
+            heatmap, _ = maps
+            with stage_timer('publish'):
+                publish_heatmap(heatmap, timestamp)
 
-            # Get data from queue
-            data = data_queue.get()
+        except Exception as e:
+            logger.error(f"Error processing audio: {str(e)}")
+            streamer.reset()
+            time.sleep(0.1)
+
+def process_data():
+    """Processing loop (consumer)"""
+    seq = 0
+    while True:
+        try:
+            seq, timestamp, data = next_frame(seq)
             
             # Reduce audio size for better time complexity
             audiolen_samples = len(data[:,0])
             data = data[:int(audiolen_samples/AUDIO_SIZE_REDUCTION_FACTOR)]
             
-            # Apply bandpass filter
-            filtered_data = np.zeros_like(data)
-            for k in range(CHANNELS):
-                filtered_data[:, k] = sp.filtfilt(butter_b, butter_a, data[:, k], padlen=FILTER_PADDING)
+            # Apply bandpass filter, all channels in one call
+            with stage_timer('bandpass'):
+                filtered_data = sp.sosfiltfilt(bandpass_sos, data, axis=0, padlen=FILTER_PADDING)
+            seq += 1
+            if not audio_ring.is_valid(seq - 1):  # Overwritten while filtering
+                processing_stats["dropped_frames"] += 1
+                continue
+            processing_stats["processed_frames"] += 1
             
             # Process data
-            heatmap, _ = data_process_pipe_animated_varyband_sfreqs(filtered_data, fc, bw)
-            
-            # Normalize heatmap
-            heatmap = (heatmap - np.min(heatmap)) / (np.max(heatmap) - np.min(heatmap))
-            
-            # Update global state
-            heatmap_data = heatmap.tolist()
-            last_update_time = time.time()
+            with stage_timer('music'):
+                if HEATMAP_METHOD == 'srp':
+                    covariance = 'wideband' if WIDEBAND_MUSIC else 'butter'
+                    heatmap, _ = get_srp_engine(PipeGeometry(THETA_OFFSET), fc, bw, covariance=covariance, cache_dir=CACHE_DIR).process(filtered_data)
+                elif WIDEBAND_MUSIC:
+                    heatmap, _ = data_process_pipe_animated_varyband_sfreqs_wideband(filtered_data, fc, bw, theta_offset=THETA_OFFSET)
+                else:
+                    heatmap, _ = data_process_pipe_animated_varyband_sfreqs(filtered_data, fc, bw, theta_offset=THETA_OFFSET, parallel=PARALLEL_BANDS)
+            with stage_timer('publish'):
+                publish_heatmap(heatmap, timestamp)
             
         except Exception as e:
             logger.error(f"Error processing audio: {str(e)}")
             time.sleep(0.1)
 
 
+def binary_response(array, headers):
+    """Raw float32 response for clients sending Accept: application/octet-stream"""
+    with stage_timer('serialize_binary'):
+        body, headers = encode_array(array, request.headers.get('Accept-Encoding', ''), headers)
+    return Response(body, mimetype=BINARY_MIMETYPE, headers=headers)
+
+
 @app.route('/heatmap', methods=['GET'])
 def get_heatmap():
-    if heatmap_data is None:
+    """Latest heatmap as JSON, or raw float32 with Accept: application/octet-stream. since=<seq> returns 304 if not newer"""
+    heatmap_state = latest_heatmap
+    if heatmap_state is None:
         return jsonify({"error": "No data available"}), 500
+    seq, heatmap, timestamp = heatmap_state
+    if 'since' in request.args and seq <= request.args.get('since', type=int, default=-1):
+        return Response(status=304, headers={"X-Seq": str(seq)})
+
+    if wants_binary(request):
+        return binary_response(heatmap, {"X-Seq": seq, "X-Timestamp": last_update_time, "X-Acquired": timestamp})
+
+    with stage_timer('serialize_json'):
+        return jsonify({
+            "heatmap": heatmap.tolist(),
+            "seq": seq,
+            "timestamp": last_update_time,
+            "dimensions": {
+                "length": PIPE_LENGTH_INTERVALS,
+                "diameter": PIPE_DIAMETER_INTERVALS
+            }
+        })
 
-    return jsonify({
-        "heatmap": heatmap_data,
-        "timestamp": last_update_time,
-        "dimensions": {
-            "length": PIPE_LENGTH_INTERVALS,
-            "diameter": PIPE_DIAMETER_INTERVALS
-        }
-    })
+
+def event_stream(broadcaster, render):
+    """Server-Sent Events response relaying a Broadcaster subscription, render(item, subscription) -> message or None"""
+    subscription = broadcaster.subscribe()
+
+    def generate():
+        try:
+            yield ': connected\n\n'
+            while True:
+                try:
+                    item = subscription.get(timeout=SSE_KEEPALIVE_SEC)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                message = render(item, subscription)
+                if message is not None:
+                    yield message
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/events/heatmap', methods=['GET'])
+def heatmap_event_stream():
+    """Push every published heatmap as a 'heatmap' event (JSON: seq, timestamp, acquired, dropped, heatmap)"""
+    def render(item, subscription):
+        seq, heatmap, acquired, published = item
+        return sse_event(json.dumps({
+            "seq": seq,
+            "timestamp": published,
+            "acquired": acquired,
+            "dropped": subscription.dropped,
+            "heatmap": heatmap.tolist()
+        }), event='heatmap', event_id=seq)
+
+    return event_stream(heatmap_events, render)
+
+
+@app.route('/events/audio', methods=['GET'])
+def audio_event_stream():
+    """
+    Push every acquired frame as an 'audio' event (JSON: seq, timestamp, shape, dtype, dropped and data, the
+    base64 of the (samples x channels) little-endian float32 frame)
+    """
+    def render(seq, subscription):
+        frame = audio_ring.read(seq)
+        if frame is None:  # Overwritten before this client got to it
+            subscription.dropped += 1
+            return None
+        _, timestamp = audio_ring.frame(seq) or (None, None)
+        data = np.ascontiguousarray(frame.T, dtype=WIRE_DTYPE)
+        return sse_event(json.dumps({
+            "seq": seq,
+            "timestamp": timestamp,
+            "shape": data.shape,
+            "dtype": WIRE_DTYPE,
+            "dropped": subscription.dropped,
+            "data": base64.b64encode(data.tobytes()).decode('ascii')
+        }), event='audio', event_id=seq)
+
+    return event_stream(audio_events, render)
 
 
 @app.route('/status', methods=['GET'])
 def get_status():
-    try:
-        running = task.is_task_done() is False if task else False
-    except Exception:
-        running = False
-
     return jsonify({
-        "is_running": running,
+        "is_running": daq.is_running() if daq else False,
+        "daq_backend": DAQ_BACKEND,
         "last_update": last_update_time,
         "sampling_rate": SAMPLING_RATE,
         "chunk_size": CHUNK_SIZE,
-        "queue_size": data_queue.qsize()
+        "frame_size": FRAME_SIZE,
+        "latest_frame": audio_ring.latest_seq,
+        "buffered_frames": audio_ring.seq - audio_ring.oldest_seq,
+        "scheduling": SCHEDULING,
+        "max_lag_frames": STREAMING_MAX_LAG if STREAMING_MUSIC else 0,
+        "heatmap_method": HEATMAP_METHOD,
+        "recording": {
+            "enabled": recorder is not None,
+            "segments_written": recorder.segments_written if recorder else 0,
+            "dropped_frames": recorder.dropped if recorder else 0
+        },
+        "processed_frames": processing_stats["processed_frames"],
+        "dropped_frames": processing_stats["dropped_frames"],
+        "published_heatmaps": processing_stats["published_heatmaps"],
+        "event_clients": {"heatmap": heatmap_events.subscriber_count, "audio": audio_events.subscriber_count},
+        "latency": {
+            "last": processing_stats["latency_last"],
+            "mean": processing_stats["latency_mean"],
+            "max": processing_stats["latency_max"]
+        }
     })
 
 
 @app.route('/audio_data', methods=['GET'])
 def get_audio_data():
-    """Return the current audio data for playback"""
-    global ch_data_list
+    """
+    Return audio data (samples x channels) for playback: the last second, or with since=<seq> only the frames
+    acquired after frame seq. JSON by default, raw float32 with Accept: application/octet-stream.
+    """
     try:
-        # Convert the current audio data to a list format
-        audio_data = ch_data_list.T.tolist()
-        return jsonify({
-            "audio_data": audio_data,
-            "sampling_rate": SAMPLING_RATE,
-            "channels": CHANNELS,
-            "buffer_size": BUFFER_SIZE
-        })
+        dropped = 0
+        if 'since' in request.args:
+            snapshot = audio_ring.read_since(request.args.get('since', type=int, default=-1))
+            if snapshot is not None:
+                seq, dropped, data = snapshot
+        else:
+            # Copy of the last second from the ring buffer
+            snapshot = audio_ring.last_samples(BUFFER_SIZE)
+            if snapshot is not None:
+                seq, data = snapshot
+        if snapshot is None:
+            return jsonify({"error": "No data available"}), 500
+
+        if wants_binary(request):
+            return binary_response(data.T, {"X-Seq": seq, "X-Dropped-Frames": dropped, "X-Sampling-Rate": SAMPLING_RATE})
+
+        with stage_timer('serialize_json'):
+            audio_data = data.T.tolist()
+            return jsonify({
+                "audio_data": audio_data,
+                "seq": seq,
+                "dropped_frames": dropped,
+                "sampling_rate": SAMPLING_RATE,
+                "channels": CHANNELS,
+                "buffer_size": BUFFER_SIZE
+            })
     except Exception as e:
         logger.error(f"Error getting audio data: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
+def warm_manifold_cache():
+    """Build (or load from disk) the pipe steering manifold for all bands before processing starts"""
+    t_start = time.time()
+    manifold = get_manifold_tensor('pipe', fc, THETA_OFFSET, cache_dir=CACHE_DIR)
+    logger.info(f"Steering manifold {manifold.shape} ready in {time.time() - t_start:.2f}s")
+
+
 def start_threads():
-    """Start DAQ and processing threads"""
-    global task, reader
-    task, reader = setup_task()
-    if task is None or reader is None:
-        logger.error("DAQ task or reader could not be initialized.")
-        raise RuntimeError("Failed to initialize DAQ hardware. Please ensure NI-DAQmx is installed and hardware is connected.")
+    """Start DAQ, processing and recording threads"""
+    global daq, recorder
+    warm_manifold_cache()
+    daq = setup_daq()
+    if daq is None:
+        logger.error("DAQ backend could not be initialized.")
+        raise RuntimeError("Failed to initialize DAQ hardware. Please ensure NI-DAQmx is installed and hardware is connected, "
+                           "or run with DAQ_BACKEND=simulator.")
+
+    if RECORDING_ENABLED:
+        recorder = SegmentRecorder(RECORDING_DIR, CHANNELS, SAMPLING_RATE, dtype=RECORDING_DTYPE, full_scale=RECORDING_FULL_SCALE,
+                                   segment_seconds=RECORDING_SEGMENT_SEC, max_segments=RECORDING_MAX_SEGMENTS).start()
+        logger.info(f"Recording raw frames to {RECORDING_DIR}")
 
     threads = [
         threading.Thread(target=acquire_data, daemon=True),
-        threading.Thread(target=process_data, daemon=True)
+        threading.Thread(target=process_streaming if STREAMING_MUSIC else process_data, daemon=True)
     ]
 
     for t in threads:
@@ -243,9 +505,10 @@ if __name__ == '__main__':
         sys.exit(1)
     finally:
         try:
-            if task:
-                task.stop()
-                task.close()
-                logger.info("DAQ task cleaned up.")
+            if daq:
+                daq.close()
+                logger.info("DAQ backend cleaned up.")
         except Exception as e:
-            logger.warning(f"Failed to clean up task: {e}")
+            logger.warning(f"Failed to clean up DAQ backend: {e}")
+        if recorder:
+            recorder.close()  # Writes out the queued frames
@@ -0,0 +1,293 @@
+"""
+Offline batch reprocessing of recorded array audio into MUSIC (or SRP) heatmaps.
+
+Reruns the heatmap pipeline of the live GUI / audio_server (data_process_pipe_animated_varyband_sfreqs: per band
+filtfilt covariances, MUSIC on the pipe grid) over a whole recording, e.g. to compare band plans or grid sizes.
+The recording is streamed in frames of --frame-sec every --hop-sec, chunks of frames are processed on a process
+pool (each worker reads its own frames from the source, nothing large is pickled) and every chunk is written by its
+worker as one compressed .npz, so throughput scales with the number of cores.
+
+Sources:
+  <dir>             segment archive written by the recorders (RECORDING_ENABLED, segment_archive.py), wall clock times
+  <file>.wav        multichannel WAV (memory mapped), times from the start of the file
+  <file>.pkl        pickled (samples x channels) array as in pipe/N_MIC_LIVEDEMO_PLAYBACK/pickles
+
+Output directory:
+  manifest.json     processing parameters (band plan, grid, frames, source) and the chunk list with time ranges
+  chunk_<n>.npz     timestamps (frames,), heatmaps (frames x rows x cols) and band_maps (frames x bands x rows x cols),
+                    float32; band_maps are the min-max normalized maps of every band, as the GUI's sfreq maps.
+                    Frames that fall into gaps of the recording are left out.
+  load_results(output_dir, t_start, t_stop) reads the frames of a time range back.
+
+Usage:
+    python scripts/batch_reprocess.py pipe/N_MIC_LIVEDEMO_PLAYBACK/recordings --output runs/bd400
+    python scripts/batch_reprocess.py pipe/N_MIC_LIVEDEMO_PLAYBACK/pickles/pipe_leak_and_motor.pkl --output runs/pkl \\
+        --band-distance 200 --grid 100x10 --frame-sec 0.25 --hop-sec 0.05
+    python scripts/batch_reprocess.py session.wav --output runs/wav --workers 8 --covariance wideband
+"""
+import os
+
+# One BLAS/FFT thread per worker process, the pool provides the parallelism (set before numpy is imported)
+for _var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(_var, '1')
+
+import sys
+import json
+import time
+import pickle
+import logging
+import numpy as np
+import scipy.signal as sp
+from scipy.io import wavfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Setup path for module imports
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(base_dir, '..', 'pipe')))
+sys.path.append(os.path.abspath(os.path.join(base_dir, '..')))
+
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.glob_vars import SAMPLING_RATE, THETA_OFFSET, N_MICS, CACHE_DIR
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.generate_bpfilt import generate_bpfilt_varyband
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.BPF import butter_sos
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.music_engine import PipeGeometry, PlaneGeometry, get_music_engine, \
+    COVARIANCE_MODES, MAG_TYPES
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.srp import get_srp_engine
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.segment_archive import SegmentArchive
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+GEOMETRIES = {'pipe': PipeGeometry, 'plane': PlaneGeometry}
+FILTER_ORDER = 5  # audio_server's band pass (--bandpass)
+FILTER_PADDING = 100
+
+
+# Sources --------------------------------------------------------------------
+class ArraySource:
+    """(samples x channels) recording in one array (in memory or memory mapped), times from its first sample"""
+
+    def __init__(self, data, sample_rate):
+        self.data = data
+        self.sample_rate = sample_rate
+        self.channels = data.shape[1]
+        self.start_time = 0.0
+        self.end_time = len(data) / sample_rate
+
+    def read(self, t_start, t_stop):
+        """Samples in [t_start, t_stop) as float64 and the time of the first one"""
+        start = max(0, int(np.ceil(round(t_start * self.sample_rate, 6))))
+        stop = min(len(self.data), int(np.ceil(round(t_stop * self.sample_rate, 6))))
+        return self.data[start:max(start, stop)].astype(np.float64), start / self.sample_rate
+
+
+class ArchiveSource:
+    """Segment archive of the recorders (segment_archive.SegmentArchive), wall clock times"""
+
+    def __init__(self, directory):
+        self.archive = SegmentArchive(directory)
+        if not self.archive.segments:
+            raise ValueError(f"No recorded segments in {directory}")
+        self.sample_rate = self.archive.sample_rate
+        self.channels = self.archive.channels
+        self.start_time = self.archive.start_time
+        self.end_time = self.archive.end_time
+
+    def read(self, t_start, t_stop):
+        data, t_first = self.archive.read(t_start, t_stop)
+        return data.astype(np.float64), t_first
+
+
+def open_source(path):
+    """Source of a segment archive directory, a .wav or a pickled (samples x channels) array"""
+    if os.path.isdir(path):
+        return ArchiveSource(path)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.wav':
+        sample_rate, data = wavfile.read(path, mmap=True)
+        return ArraySource(data.reshape(len(data), -1), sample_rate)
+    if extension in ('.pkl', '.pickle'):
+        with open(path, 'rb') as f:
+            data = np.asarray(pickle.load(f))
+        return ArraySource(data.reshape(len(data), -1), SAMPLING_RATE)
+    raise ValueError(f"Unsupported recording: {path} (segment archive directory, .wav or .pkl)")
+
+
+# Worker side ----------------------------------------------------------------
+_sources = {}  # Sources opened in this worker process, by path
+
+
+def worker_source(path):
+    source = _sources.get(path)
+    if source is None:
+        source = _sources[path] = open_source(path)
+    return source
+
+
+def make_engine(config, sample_rate):
+    """MUSIC (or SRP) engine of a run configuration, shared per process like the live entry points"""
+    geometry = GEOMETRIES[config["geometry"]](config["theta_offset"])
+    if tuple(config["grid"]) != geometry.shape:  # Default grids keep sharing the live manifold cache
+        geometry = GEOMETRIES[config["geometry"]](config["theta_offset"], shape=tuple(config["grid"]))
+    if config["method"] == 'srp':
+        return get_srp_engine(geometry, config["fc"], config["bw"], covariance=config["covariance"],
+                              magType=config["mag_type"], fs=sample_rate, cache_dir=CACHE_DIR)
+    return get_music_engine(geometry, config["fc"], bw=config["bw"], covariance=config["covariance"],
+                            magType=config["mag_type"], fs=sample_rate, cache_dir=CACHE_DIR)
+
+
+def process_chunk(source_path, config, chunk, frame_times, output_dir):
+    """
+    Process the frames starting at frame_times and write them to chunk_<chunk>.npz.
+
+    Returns:
+        dict: chunk, file name, frames written and the time range covered (None if no frame was complete)
+    """
+    source = worker_source(source_path)
+    engine = make_engine(config, source.sample_rate)
+    frame_samples = int(round(config["frame_sec"] * source.sample_rate))
+    sos = butter_sos(FILTER_ORDER, config["lower_freq"], config["upper_freq"], source.sample_rate) if config["bandpass"] else None
+
+    n_bands = len(config["fc"])
+    shape = engine.geometry.shape
+    heatmaps = np.empty((len(frame_times),) + shape, np.float32)
+    band_maps = np.empty((len(frame_times), n_bands) + shape, np.float32)
+    timestamps = np.empty(len(frame_times))
+    n = 0
+    for t_frame in frame_times:
+        data, t_first = source.read(t_frame, t_frame + config["frame_sec"])
+        if len(data) < frame_samples:  # Gap in the recording (or its end)
+            continue
+        data = data[:frame_samples, :engine.geometry.n_mics]
+        if sos is not None:
+            data = sp.sosfiltfilt(sos, data, axis=0, padlen=FILTER_PADDING)
+        heatmaps[n], band_maps[n] = engine.process(data)
+        timestamps[n] = t_first
+        n += 1
+
+    name = f"chunk_{chunk:06d}.npz"
+    if n:
+        path = os.path.join(output_dir, name)
+        with open(path + '.tmp', 'wb') as f:  # Complete files only, an interrupted run leaves no truncated chunk
+            np.savez_compressed(f, timestamps=timestamps[:n], heatmaps=heatmaps[:n], band_maps=band_maps[:n])
+        os.replace(path + '.tmp', path)
+    return {"chunk": chunk, "file": name if n else None, "frames": n,
+            "start_time": float(timestamps[0]) if n else None, "end_time": float(timestamps[n - 1]) if n else None}
+
+
+# Driver ---------------------------------------------------------------------
+def parse_grid(text):
+    rows, cols = (int(v) for v in text.lower().split('x'))
+    return rows, cols
+
+
+def run(args):
+    source = open_source(args.source)
+    fs = source.sample_rate
+    if source.channels < N_MICS:
+        raise ValueError(f"{args.source} has {source.channels} channels, the array has {N_MICS}")
+    fc, bw = generate_bpfilt_varyband(args.band_distance, fs, args.lower_freq, args.upper_freq)
+    geometry = GEOMETRIES[args.geometry](args.theta_offset)
+    config = {
+        "geometry": args.geometry, "grid": list(parse_grid(args.grid) if args.grid else geometry.shape),
+        "theta_offset": args.theta_offset, "method": args.method, "covariance": args.covariance, "mag_type": args.mag_type,
+        "band_distance": args.band_distance, "lower_freq": args.lower_freq, "upper_freq": args.upper_freq,
+        "fc": [float(f) for f in fc], "bw": float(bw), "bandpass": args.bandpass,
+        "frame_sec": args.frame_sec, "hop_sec": args.hop_sec or args.frame_sec,
+    }
+
+    t_start = source.start_time if args.start is None else source.start_time + args.start
+    t_stop = source.end_time if args.stop is None else min(source.end_time, source.start_time + args.stop)
+    frame_times = np.arange(t_start, t_stop - config["frame_sec"] + 1e-9, config["hop_sec"])
+    chunks = [frame_times[k:k + args.chunk_frames] for k in range(0, len(frame_times), args.chunk_frames)]
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest = {"version": MANIFEST_VERSION, "source": os.path.abspath(args.source), "sample_rate": fs,
+                "shape": config["grid"], "config": config, "chunks": []}
+    logger.info(f"{len(frame_times)} frames of {config['frame_sec']} s in {len(chunks)} chunks, "
+                f"{len(fc)} bands, grid {config['grid'][0]}x{config['grid'][1]}, {args.workers or os.cpu_count()} workers")
+
+    t0 = time.time()
+    done = 0
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = [pool.submit(process_chunk, args.source, config, k, times, args.output) for k, times in enumerate(chunks)]
+        for future in as_completed(futures):
+            result = future.result()
+            done += result["frames"]
+            if result["file"]:
+                manifest["chunks"].append(result)
+            elapsed = time.time() - t0
+            logger.info(f"chunk {result['chunk']}: {result['frames']} frames ({done}/{len(frame_times)}, {done / elapsed:.1f} frames/s)")
+
+    manifest["chunks"].sort(key=lambda c: c["chunk"])
+    manifest["frames"] = done
+    with open(os.path.join(args.output, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"{done} heatmaps written to {args.output} in {time.time() - t0:.1f}s")
+    return manifest
+
+
+def load_results(output_dir, t_start=None, t_stop=None):
+    """
+    Frames of a reprocessing run with timestamps in [t_start, t_stop) (default all).
+
+    Returns:
+        dict: timestamps (frames,), heatmaps (frames x rows x cols), band_maps (frames x bands x rows x cols) and
+        the run's manifest
+    """
+    with open(os.path.join(output_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    t_start = -np.inf if t_start is None else t_start
+    t_stop = np.inf if t_stop is None else t_stop
+    n_bands, shape = len(manifest["config"]["fc"]), tuple(manifest["shape"])
+    parts = {"timestamps": [np.zeros(0)], "heatmaps": [np.zeros((0,) + shape, np.float32)],
+             "band_maps": [np.zeros((0, n_bands) + shape, np.float32)]}
+    for chunk in manifest["chunks"]:
+        if chunk["end_time"] < t_start or chunk["start_time"] >= t_stop:
+            continue
+        with np.load(os.path.join(output_dir, chunk["file"])) as data:
+            keep = (data["timestamps"] >= t_start) & (data["timestamps"] < t_stop)
+            for key in parts:
+                parts[key].append(data[key][keep])
+    results = {key: np.concatenate(arrays) for key, arrays in parts.items()}
+    results["manifest"] = manifest
+    return results
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Reprocess a recording into MUSIC heatmaps on all cores')
+    parser.add_argument('source', help='Segment archive directory, .wav or .pkl recording')
+    parser.add_argument('--output', required=True, help='Directory for manifest.json and the chunk_<n>.npz files')
+    parser.add_argument('--geometry', choices=sorted(GEOMETRIES), default='pipe', help='Scan grid geometry')
+    parser.add_argument('--grid', help='Grid rows x cols, e.g. 100x10 (default: the glob_vars grid)')
+    parser.add_argument('--theta-offset', type=float, default=THETA_OFFSET, help='Azimuth offset of the array, degrees')
+    parser.add_argument('--method', choices=('music', 'srp'), default='music', help='MUSIC or delay and sum SRP maps')
+    parser.add_argument('--covariance', choices=COVARIANCE_MODES[:2], default='butter',
+                        help="'butter' (per band filtfilt, as data_process_pipe_animated_varyband_sfreqs) or 'wideband'")
+    parser.add_argument('--mag-type', choices=MAG_TYPES, default='linadd', help='Band combination')
+    parser.add_argument('--band-distance', type=float, default=400, help='Band spacing, Hz')
+    parser.add_argument('--lower-freq', type=float, default=1000, help='Lowest band edge, Hz')
+    parser.add_argument('--upper-freq', type=float, default=7000, help='Highest band edge, Hz')
+    parser.add_argument('--bandpass', action='store_true', help="Band pass every frame first, as audio_server does")
+    parser.add_argument('--frame-sec', type=float, default=0.25, help='Seconds of audio per heatmap')
+    parser.add_argument('--hop-sec', type=float, help='Seconds between heatmaps (default: --frame-sec)')
+    parser.add_argument('--start', type=float, help='Seconds into the recording to start at')
+    parser.add_argument('--stop', type=float, help='Seconds into the recording to stop at')
+    parser.add_argument('--chunk-frames', type=int, default=64, help='Frames per task and output chunk')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: all cores)')
+    args = parser.parse_args(argv)
+
+    try:
+        run(args)
+    except (ValueError, OSError) as e:
+        logger.error(str(e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
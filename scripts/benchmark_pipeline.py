@@ -0,0 +1,317 @@
+"""
+Benchmarks of the DOA pipeline stages on simulated UCA data (no DAQ hardware needed).
+
+Every case runs a stage on synthetic array signals from the DAQ simulator (daq_backends.py) repeatedly and
+reports throughput (frames/s) and p50/p99 latency per frame:
+
+  music/<geometry>/<covariance>/bands=<n>/grid=<rows>x<cols>   MusicEngine.process on one frame
+  srp/<geometry>/<das|dmas>                                    steered response power map (srp.py) on one frame
+  streaming/pipe/bands=<n>                                     StreamingMusic.push per DAQ hop
+  adaptive/<geometry>/bands=<n>                                coarse-to-fine AdaptiveMusic.process
+  filtfilt/channels=<n>                                        audio_server's band pass (all channels, one sosfiltfilt)
+  dmas/channels=<n>                                            delay multiply and sum towards one direction
+  das/directions=<k>                                           delay and sum towards k directions in one call
+  endpoint/<route>/<json|binary>                               audio_server Flask endpoints (test client)
+
+Usage:
+    python scripts/benchmark_pipeline.py                          # all cases
+    python scripts/benchmark_pipeline.py --filter music/pipe --quick
+    python scripts/benchmark_pipeline.py --save-baseline bench.json
+    python scripts/benchmark_pipeline.py --baseline bench.json    # exit status 1 on regressions
+
+Baselines are machine specific, record them on the machine they are compared on.
+"""
+import sys
+import os
+import json
+import time
+import platform
+import numpy as np
+import scipy.signal as sp
+
+# Setup path for module imports
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(base_dir, '..', 'pipe')))
+sys.path.append(os.path.abspath(os.path.join(base_dir, '..')))
+
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.glob_vars import SAMPLING_RATE, THETA_OFFSET, N_MICS, MIC_RADIUS
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.music_engine import MusicEngine, PipeGeometry, PlaneGeometry, \
+    PlaneNearFieldGeometry, CylinderNearFieldGeometry
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.srp import SrpEngine, dmas_power_map
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.streaming_music import StreamingMusic
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.adaptive_grid import AdaptiveMusic
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.dmas import dmas
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.BPF import butter_bandpass_filter
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.spatial_filtering import delay_and_sum_directions
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.daq_backends import SimulatedBackend, SimulatedSource, \
+    pipe_source_position, plane_source_position
+
+LOWER_FREQ = 1000
+UPPER_FREQ = 7000
+FRAME_SIZE = SAMPLING_RATE // 4  # Samples per MUSIC frame (audio_server's 1 s buffer / AUDIO_SIZE_REDUCTION_FACTOR)
+HOP_SIZE = 2048  # audio_server's streaming hop
+DEFAULT_TOLERANCE = 0.25  # Allowed relative p50 slowdown before a case counts as a regression
+
+GEOMETRIES = {
+    'pipe': lambda **params: PipeGeometry(THETA_OFFSET, **params),
+    'plane': lambda **params: PlaneGeometry(THETA_OFFSET, **params),
+    'plane_nf': lambda **params: PlaneNearFieldGeometry(THETA_OFFSET, **params),
+    'cylinder_nf': lambda **params: CylinderNearFieldGeometry(THETA_OFFSET, **params),
+}
+SOURCE_POSITIONS = {
+    'pipe': pipe_source_position(50),
+    'plane': plane_source_position(3, -2),
+    'plane_nf': plane_source_position(3, -2),
+    'cylinder_nf': plane_source_position(3, -2),
+}
+
+
+def band_plan(n_bands):
+    """Centre frequencies and bandwidth of n_bands equal bands between LOWER_FREQ and UPPER_FREQ"""
+    bw = (UPPER_FREQ - LOWER_FREQ) / n_bands
+    return LOWER_FREQ + bw * (np.arange(n_bands) + 0.5), bw
+
+
+def simulated_data(n_samples, channels=N_MICS, position=SOURCE_POSITIONS['pipe'], seed=0):
+    """(samples x channels) simulated array signal of one band limited source"""
+    source = SimulatedSource(position, band=(LOWER_FREQ, UPPER_FREQ), snr_db=20)
+    daq = SimulatedBackend([source], channels=channels, realtime=False, seed=seed)
+    return daq.synthesize(n_samples).T
+
+
+# Cases ----------------------------------------------------------------------
+# Every case factory returns (name, step) where step() processes one frame; setup cost stays outside the timing.
+
+def music_cases(quick):
+    cases = []
+    band_counts = [15] if quick else [5, 15, 30]
+    for name, make_geometry in GEOMETRIES.items():
+        frame = simulated_data(FRAME_SIZE, position=SOURCE_POSITIONS[name])
+        shapes = [make_geometry().shape]
+        if name in ('pipe', 'plane') and not quick:
+            shapes.append((2 * shapes[0][0], 2 * shapes[0][1]))
+        covariances = ['wideband', 'butter'] if name == 'pipe' and not quick else ['wideband']
+        for covariance in covariances:
+            for n_bands in band_counts:
+                for shape in shapes:
+                    def make(name=name, shape=shape, covariance=covariance, n_bands=n_bands, frame=frame):
+                        fc, bw = band_plan(n_bands)
+                        engine = MusicEngine(GEOMETRIES[name](shape=shape), fc, bw=bw, covariance=covariance)
+                        if name != 'cylinder_nf':
+                            return lambda: engine.process(frame)
+
+                        def step():
+                            # The CYL_NF LUT steering vectors are all ones, so its maps are constant and their per
+                            # band min-max normalization is 0/0. Timing does not depend on the map content
+                            with np.errstate(invalid='ignore'):
+                                return engine.process(frame)
+                        return step
+                    cases.append((f"music/{name}/{covariance}/bands={n_bands}/grid={shape[0]}x{shape[1]}", make))
+    return cases
+
+
+def srp_cases(quick):
+    cases = []
+    for name in ('pipe', 'plane'):
+        def make(name=name):
+            fc, bw = band_plan(15)
+            engine = SrpEngine(GEOMETRIES[name](), fc, bw=bw)
+            frame = simulated_data(FRAME_SIZE, position=SOURCE_POSITIONS[name])
+            return lambda: engine.process(frame)
+        cases.append((f"srp/{name}/das/bands=15", make))
+
+        def make_dmas(name=name):
+            geometry = GEOMETRIES[name]()
+            frame = simulated_data(FRAME_SIZE, position=SOURCE_POSITIONS[name])
+            return lambda: dmas_power_map(frame, geometry)
+        cases.append((f"srp/{name}/dmas", make_dmas))
+    return cases
+
+
+def streaming_cases(quick):
+    def make():
+        fc, bw = band_plan(15)
+        streamer = StreamingMusic(MusicEngine(PipeGeometry(THETA_OFFSET), fc, bw=bw), emit_interval=HOP_SIZE / SAMPLING_RATE)
+        hops = simulated_data(16 * HOP_SIZE).reshape(16, HOP_SIZE, N_MICS)
+        counter = iter(range(10 ** 9))
+        return lambda: streamer.push(hops[next(counter) % len(hops)])
+    return [("streaming/pipe/bands=15", make)]
+
+
+def adaptive_cases(quick):
+    cases = []
+    for name in ('pipe', 'plane'):
+        def make(name=name):
+            fc, bw = band_plan(15)
+            adaptive = AdaptiveMusic(MusicEngine(GEOMETRIES[name](), fc, bw=bw))
+            frame = simulated_data(FRAME_SIZE, position=SOURCE_POSITIONS[name])
+            return lambda: adaptive.process(frame)
+        cases.append((f"adaptive/{name}/bands=15", make))
+    return cases
+
+
+def filter_cases(quick):
+    cases = []
+    for channels in ([N_MICS] if quick else [5, N_MICS, 17]):
+        def make(channels=channels):
+            frame = simulated_data(FRAME_SIZE, channels)
+            return lambda: butter_bandpass_filter(frame, LOWER_FREQ, UPPER_FREQ, SAMPLING_RATE, order=5, axis=0, padlen=100)
+        cases.append((f"filtfilt/channels={channels}", make))
+    return cases
+
+
+def dmas_cases(quick):
+    cases = []
+    for channels in ([N_MICS] if quick else [5, N_MICS, 17]):  # Odd counts: ring plus centre mic, like the array
+        def make(channels=channels):
+            frame = simulated_data(FRAME_SIZE, channels)
+            return lambda: dmas(frame, SAMPLING_RATE, 80, 80, MIC_RADIUS)
+        cases.append((f"dmas/channels={channels}", make))
+
+    def make_fractional():
+        frame = simulated_data(FRAME_SIZE)
+        return lambda: dmas(frame, SAMPLING_RATE, 80, 80, MIC_RADIUS, fractional=True)
+    cases.append((f"dmas/channels={N_MICS}/fractional", make_fractional))
+    return cases
+
+
+def das_cases(quick):
+    cases = []
+    for n_directions in ([50] if quick else [1, 50, 250]):  # 250: every pixel of the 5x50 pipe heatmap
+        def make(n_directions=n_directions):
+            frame = simulated_data(FRAME_SIZE)
+            theta = np.linspace(-180, 180, n_directions, endpoint=False)
+            phi = np.full(n_directions, 60.)
+            return lambda: delay_and_sum_directions(frame, theta, phi, SAMPLING_RATE, MIC_RADIUS)
+        cases.append((f"das/directions={n_directions}", make))
+    return cases
+
+
+def endpoint_cases(quick):
+    def server():
+        import audio_server
+        # Fill the ring with simulated frames and publish one heatmap, no acquisition or processing threads
+        if audio_server.audio_ring.latest_seq < 0:
+            daq = SimulatedBackend([SimulatedSource(SOURCE_POSITIONS['pipe'])], channels=audio_server.CHANNELS, realtime=False, seed=0)
+            while audio_server.audio_ring.seq < audio_server.audio_ring.n_frames:
+                daq.read(audio_server.audio_ring.write_slot())
+                audio_server.audio_ring.commit(time.time())
+            frame = audio_server.audio_ring.last_samples(FRAME_SIZE)[1].T
+            heatmap, _ = MusicEngine(PipeGeometry(THETA_OFFSET), audio_server.fc, bw=audio_server.bw).process(frame)
+            audio_server.publish_heatmap(heatmap.copy(), time.time())
+        return audio_server.app.test_client()
+
+    cases = []
+    routes = ['/heatmap', '/audio_data'] if not quick else ['/heatmap']
+    for route in routes:
+        for encoding, headers in (('json', {}), ('binary', {'Accept': 'application/octet-stream'})):
+            def make(route=route, headers=headers):
+                client = server()
+
+                def step():
+                    response = client.get(route, headers=headers)
+                    assert response.status_code == 200, response.status_code
+                    return response.data
+                return step
+            cases.append((f"endpoint/{route.strip('/')}/{encoding}", make))
+    return cases
+
+
+CASE_GROUPS = [music_cases, srp_cases, streaming_cases, adaptive_cases, filter_cases, dmas_cases, das_cases, endpoint_cases]
+
+
+# Runner ---------------------------------------------------------------------
+def run_case(step, min_time, min_repeats, max_repeats, warmup):
+    """Time step() until min_time seconds and min_repeats calls have passed (at most max_repeats)"""
+    for _ in range(warmup):
+        step()
+    durations = []
+    t_start = time.perf_counter()
+    while len(durations) < max_repeats and (len(durations) < min_repeats or time.perf_counter() - t_start < min_time):
+        t0 = time.perf_counter()
+        step()
+        durations.append(time.perf_counter() - t0)
+    durations = np.array(durations)
+    return {
+        "repeats": len(durations),
+        "frames_per_s": float(len(durations) / durations.sum()),
+        "mean_ms": float(durations.mean() * 1e3),
+        "p50_ms": float(np.percentile(durations, 50) * 1e3),
+        "p99_ms": float(np.percentile(durations, 99) * 1e3),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Cases whose p50 grew by more than tolerance (relative) over the baseline, as (name, ratio) pairs"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        ratio = result["p50_ms"] / reference["p50_ms"]
+        result["baseline_p50_ms"] = reference["p50_ms"]
+        result["ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the DOA pipeline on simulated UCA data')
+    parser.add_argument('--filter', nargs='*', default=[], help='Only run cases whose name contains one of these')
+    parser.add_argument('--quick', action='store_true', help='Reduced matrix (default grid, 15 bands, 9 channels)')
+    parser.add_argument('--min-time', type=float, default=1.0, help='Seconds to time each case for')
+    parser.add_argument('--min-repeats', type=int, default=10, help='Minimum timed calls per case')
+    parser.add_argument('--max-repeats', type=int, default=1000, help='Maximum timed calls per case')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed calls before timing')
+    parser.add_argument('--output', help='Write the results JSON here')
+    parser.add_argument('--save-baseline', help='Write the results as a baseline JSON')
+    parser.add_argument('--baseline', help='Compare p50 latencies against this baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed relative p50 slowdown')
+    args = parser.parse_args(argv)
+
+    cases = [case for group in CASE_GROUPS for case in group(args.quick)]
+    if args.filter:
+        cases = [(name, make) for name, make in cases if any(f in name for f in args.filter)]
+
+    results = {}
+    print(f"{'case':<52} {'frames/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'n':>6}")
+    for name, make in cases:
+        try:
+            step = make()
+            result = run_case(step, args.min_time, args.min_repeats, args.max_repeats, args.warmup)
+        except Exception as e:
+            print(f"{name:<52} failed: {e}")
+            continue
+        results[name] = result
+        print(f"{name:<52} {result['frames_per_s']:>10.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['repeats']:>6}")
+
+    report = {
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version(),
+                    "numpy": np.__version__, "cpu_count": os.cpu_count()},
+        "frame_size": FRAME_SIZE,
+        "results": results,
+    }
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\nCompared {sum(name in baseline for name in results)} cases against {args.baseline}")
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: p50 {ratio:.2f}x baseline")
+        status = 1 if regressions else 0
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
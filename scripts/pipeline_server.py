@@ -4,9 +4,13 @@ from gpiozero import LED
 from gpiozero.pins.pigpio import PiGPIOFactory
 from gpiozero.pins.pigpio import PiGPIOPin
 import logging
+import os
 import sys
 import time
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import metrics
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,6 +23,7 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+metrics.instrument_app(app, 'pipeline_server')  # Per route timings and /metrics (Prometheus), METRICS_ENABLED=0 disables
 
 # Store GPIO pins for each valve
 VALVE_PINS = [22, 27, 17]  # Same pins as in the original script
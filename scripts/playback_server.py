@@ -13,6 +13,8 @@ from scipy import signal
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.audio_utils import get_angles_from_pixels_pipe
+from utils.array_transport import BINARY_MIMETYPE, decode_array
+from utils import metrics
 
 # Configure logging
 logging.basicConfig(
@@ -23,6 +25,7 @@ logger = logging.getLogger(__name__)
 
 # Flask app configuration
 app = Flask(__name__)
+metrics.instrument_app(app, 'playback_server')  # Per route timings and /metrics (Prometheus), METRICS_ENABLED=0 disables
 
 # Constants
 CHANNELS = 8  # Number of audio channels
@@ -31,6 +34,7 @@ BUFFER_DURATION = 1.0  # Duration of audio buffer in seconds
 SAMPLING_RATE = 44100  # Sampling rate in Hz
 LPF_CUTOFF = 1000  # Low-pass filter cutoff frequency in Hz
 LPF_ORDER = 4  # Filter order (higher = sharper cutoff)
+LPF_SOS = signal.butter(LPF_ORDER, LPF_CUTOFF, btype='low', fs=SAMPLING_RATE, output='sos')  # Designed once, shared by all pixels
 
 # Global variables
 audio_buffer = queue.Queue(maxsize=int(SAMPLING_RATE * BUFFER_DURATION / CHUNK_SIZE))
@@ -39,14 +43,36 @@ audio_server_ready = False
 selected_pixels = {}  # Dictionary to store selected pixels and their audio streams
 is_playing = False
 audio_streams = {}  # Dictionary to store audio streams for each pixel
+audio_seq = None  # Newest audio_server frame received, only newer frames are requested
+audio_window = None  # Rolling BUFFER_DURATION of received audio (samples x channels)
+weights_cache = {}  # (pixel, channels) -> spatial filter weights, see pixel_weights
+
+def stage_timer(stage):
+    """Time a processing stage into the playback_server_stage_seconds histogram"""
+    return metrics.timer('playback_server_stage_seconds', 'Duration of playback_server fetch and filtering stages', stage=stage)
 
 def get_audio_data():
-    """Get audio data from the audio server."""
+    """Get the audio samples acquired since the last call from the audio server (binary, samples x channels)."""
+    global audio_seq, audio_window
     try:
-        response = requests.get('http://localhost:5001/audio_data')
+        params = {} if audio_seq is None else {'since': audio_seq}
+        with stage_timer('fetch'):
+            response = requests.get('http://localhost:5001/audio_data', params=params, headers={'Accept': BINARY_MIMETYPE})
         if response.status_code == 200:
-            data = response.json()
-            return np.array(data['audio_data']), data['sampling_rate']
+            with stage_timer('decode'):
+                data = decode_array(response.content, response.headers)
+            seq = int(response.headers['X-Seq'])
+            if audio_seq is not None and seq < audio_seq:
+                # audio_server restarted and counts frames from 0 again, start over from its last second
+                logger.warning(f"audio_server frame sequence went back from {audio_seq} to {seq}, resyncing")
+                audio_seq = None
+                audio_window = None
+                return data[:0], int(response.headers['X-Sampling-Rate'])
+            audio_seq = seq
+            dropped = int(response.headers.get('X-Dropped-Frames', 0))
+            if dropped:
+                logger.warning(f"Missed {dropped} audio frames")
+            return data, int(response.headers['X-Sampling-Rate'])
         else:
             logger.error(f"Failed to get audio data: {response.status_code}")
             return None, None
@@ -56,7 +82,7 @@ def get_audio_data():
 
 def acquire_data():
     """Continuously acquire audio data from the audio server."""
-    global is_acquiring, audio_server_ready
+    global is_acquiring, audio_server_ready, audio_window
     is_acquiring = True
     retry_count = 0
     max_retries = 3
@@ -73,6 +99,19 @@ def acquire_data():
                 # Ensure correct shape
                 if len(audio_data.shape) == 1:
                     audio_data = audio_data.reshape(-1, 1)
+
+                # Nothing new yet
+                if len(audio_data) == 0:
+                    time.sleep(0.01)
+                    continue
+
+                # Append to the rolling window of the last BUFFER_DURATION seconds
+                window_size = int(sampling_rate * BUFFER_DURATION)
+                if audio_window is None or audio_window.shape[1] != audio_data.shape[1]:
+                    audio_window = audio_data[-window_size:]
+                else:
+                    audio_window = np.concatenate([audio_window, audio_data])[-window_size:]
+                audio_data = audio_window
                 
                 # Log audio data shape and stats
                 logger.info(f"Received audio data: shape={audio_data.shape}, min={np.min(audio_data):.3f}, max={np.max(audio_data):.3f}")
@@ -84,14 +123,16 @@ def acquire_data():
                     audio_buffer.get()  # Remove oldest data
                     audio_buffer.put(audio_data)
                 
-                # Update audio for all selected pixels
-                for pixel_id, stream in audio_streams.items():
-                    if stream and stream.active:
-                        audio_data = get_audio_for_pixel(*pixel_id)
-                        if audio_data is not None:
-                            # Use filtered audio for playback
-                            playback_data = np.array(audio_data['filtered'], dtype=np.float32)
-                            stream.write(playback_data)
+                # Update audio for all selected pixels, filtered towards all of them at once
+                active_streams = [(pixel_id, stream) for pixel_id, stream in list(audio_streams.items()) if stream and stream.active]
+                if active_streams:
+                    audio = get_audio_for_pixels([pixel_id for pixel_id, _ in active_streams])
+                    if audio is not None:
+                        # Use filtered audio for playback
+                        playback_data = audio[1].astype(np.float32)
+                        for i, (pixel_id, stream) in enumerate(active_streams):
+                            if not np.isnan(playback_data[0, i]):
+                                stream.write(np.ascontiguousarray(playback_data[:, i]))
             else:
                 audio_server_ready = False
                 retry_count += 1
@@ -114,10 +155,46 @@ def acquire_data():
             time.sleep(retry_delay)
             retry_delay *= 2  # Exponential backoff
 
-def get_audio_for_pixel(x, y):
-    """Get audio data for a specific pixel using spatial filtering."""
-    global audio_buffer
-    
+def pixel_weights(pixel_ids, num_channels):
+    """
+    Spatial filter weights of the given pixels, one row per pixel (pixels x channels). Rows are cached per
+    pixel and channel count, pixels with invalid coordinates get a row of NaN.
+    """
+    rows = []
+    for pixel_id in pixel_ids:
+        key = (pixel_id, num_channels)
+        if key not in weights_cache:
+            angles = get_angles_from_pixels_pipe(*pixel_id)
+            if angles is None:
+                weights_cache[key] = np.full(num_channels, np.nan)
+            else:
+                theta, phi = angles
+                logger.info(f"Pixel {pixel_id} converted to angles: theta={theta:.2f}, phi={phi:.2f}")
+                # Weight of every channel based on its position
+                channel_angles = 2 * np.pi * np.arange(num_channels) / num_channels
+                weights = np.cos(theta - channel_angles) * np.sin(phi)
+                weights_cache[key] = weights / (np.sum(np.abs(weights)) or 1)  # All zero on the axis (phi = 0): silence
+        rows.append(weights_cache[key])
+    return np.array(rows).reshape(len(rows), num_channels)
+
+def normalize_columns(data):
+    """Scale every column of data (samples x signals) to a peak of 1, silent columns are left as they are"""
+    peaks = np.max(np.abs(data), axis=0)
+    return data / np.where(peaks > 0, peaks, 1)
+
+def get_audio_for_pixels(pixel_ids):
+    """
+    Spatially filter the latest audio towards many pixels at once: the per pixel weights are stacked into one
+    (pixels x channels) matrix applied with a single matrix product, and all outputs are low pass filtered by
+    one filtfilt call.
+
+    Args:
+        pixel_ids (list): (x, y) heatmap pixels
+
+    Returns:
+        tuple: (raw, filtered) arrays (samples x pixels), both peak normalized, columns of invalid pixels are
+        NaN. None if no audio is available.
+    """
     if not audio_server_ready:
         logger.error("Audio server is not ready")
         return None
@@ -130,55 +207,39 @@ def get_audio_for_pixel(x, y):
         # Get the latest audio data
         audio_data = audio_buffer.queue[-1]
         
-        # Convert pixel coordinates to angles
-        angles = get_angles_from_pixels_pipe(x, y)
-        if angles is None:
-            logger.error(f"Invalid pixel coordinates: ({x}, {y})")
-            return None
-            
-        theta, phi = angles
-        logger.info(f"Pixel ({x}, {y}) converted to angles: theta={theta:.2f}, phi={phi:.2f}")
-        
-        # Apply spatial filtering
         # Ensure audio_data is 2D with shape (samples, channels)
         if len(audio_data.shape) == 1:
             audio_data = audio_data.reshape(-1, 1)
         
-        # Create a weight matrix for each channel based on angles
-        weights = np.zeros((audio_data.shape[1],))
-        for i in range(audio_data.shape[1]):
-            # Calculate weight based on channel position
-            channel_angle = 2 * np.pi * i / audio_data.shape[1]
-            weights[i] = np.cos(theta - channel_angle) * np.sin(phi)
-        
-        # Normalize weights
-        weights = weights / np.sum(np.abs(weights))
-        
-        # Apply weights to each channel and sum
-        filtered_audio = np.sum(audio_data * weights, axis=1)
-        
-        # Normalize the output
-        if np.max(np.abs(filtered_audio)) > 0:
-            filtered_audio = filtered_audio / np.max(np.abs(filtered_audio))
-        
-        # Apply low-pass filter
-        nyquist = SAMPLING_RATE / 2
-        normalized_cutoff = LPF_CUTOFF / nyquist
-        b, a = signal.butter(LPF_ORDER, normalized_cutoff, btype='low')
-        low_pass_audio = signal.filtfilt(b, a, filtered_audio)
-        
-        # Normalize low-pass filtered signal
-        if np.max(np.abs(low_pass_audio)) > 0:
-            low_pass_audio = low_pass_audio / np.max(np.abs(low_pass_audio))
-        
-        return {
-            'raw': filtered_audio.tolist(),
-            'filtered': low_pass_audio.tolist()
-        }
+        with stage_timer('spatial_filter'):
+            weights = pixel_weights(pixel_ids, audio_data.shape[1])
+            # Apply the weights of every pixel to the channels and sum, (samples x pixels)
+            filtered_audio = normalize_columns(audio_data @ weights.T)
+
+        with stage_timer('lowpass'):
+            low_pass_audio = normalize_columns(signal.sosfiltfilt(LPF_SOS, filtered_audio, axis=0))
+
+        return filtered_audio, low_pass_audio
     except Exception as e:
-        logger.error(f"Error getting audio for pixel ({x}, {y}): {str(e)}")
+        logger.error(f"Error getting audio for pixels {pixel_ids}: {str(e)}")
         return None
 
+def get_audio_for_pixel(x, y):
+    """Get audio data for a specific pixel using spatial filtering."""
+    audio = get_audio_for_pixels([(x, y)])
+    if audio is None:
+        return None
+    filtered_audio, low_pass_audio = audio
+    if np.isnan(filtered_audio).any():
+        logger.error(f"Invalid pixel coordinates: ({x}, {y})")
+        return None
+
+    with stage_timer('serialize'):
+        return {
+            'raw': filtered_audio[:, 0].tolist(),
+            'filtered': low_pass_audio[:, 0].tolist()
+        }
+
 @app.route('/select_pixel', methods=['POST'])
 def select_pixel():
     """Handle pixel selection for playback."""
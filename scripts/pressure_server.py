@@ -1,12 +1,15 @@
 import asyncio
 import websockets
 import json
-import nidaqmx
-from nidaqmx.constants import AcquisitionType, TerminalConfiguration
-from nidaqmx import stream_readers
+import os
+import sys
 import numpy as np
 import time as t
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipe')))
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.glob_vars import DAQ_BACKEND
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.daq_backends import make_daq_backend
+
 # Server settings
 HOST = '0.0.0.0'
 PORT = 65506
@@ -16,6 +19,7 @@ fs = 2  # Sampling rate (Hz)
 nSamples = 2  # Number of samples per acquisition
 numChannels = 1  # Number of channels to acquire
 totalTime = 1  # Time for each acquisition in seconds
+SIMULATED_OFFSET = 1.0  # Sensor voltage produced by DAQ_BACKEND=simulator
 
 # Normalize the pressure data (conversion from voltage to pressure)
 def normalize(data):
@@ -23,16 +27,13 @@ def normalize(data):
 
 # Function to acquire DAQ pressure data
 def get_daq_pressure():
-    with nidaqmx.Task() as task:
-        task.ai_channels.add_ai_voltage_chan("Dev2/ai1", terminal_config=TerminalConfiguration.RSE)
-        task.timing.cfg_samp_clk_timing(rate=fs, sample_mode=AcquisitionType.FINITE, samps_per_chan=nSamples)
-        reader = stream_readers.AnalogMultiChannelReader(task.in_stream)
-
+    with make_daq_backend(DAQ_BACKEND, "Dev2/ai1", numChannels, fs, samps_per_chan=nSamples, finite=True,
+                          offset=SIMULATED_OFFSET, noise_level=0.005) as daq:
         ch_data_list = []
         t_start = t.time()
         while t.time() - t_start < totalTime:
             buffer = np.zeros((numChannels, nSamples), dtype=np.float64)
-            reader.read_many_sample(buffer, nSamples, timeout=nidaqmx.constants.WAIT_INFINITELY)
+            daq.read(buffer)
             ch_data_list.append(buffer[0])  # From channel 0
 
         normalized_data = normalize(np.concatenate(ch_data_list))
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Same import roots as the scripts: N_MIC_LIVEDEMO_PLAYBACK.* from pipe/, utils.* from the repo root
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(root, 'pipe'))
+sys.path.append(root)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.music_engine import MusicEngine, PipeGeometry
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.adaptive_grid import AdaptiveMusic
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.daq_backends import SimulatedBackend, SimulatedSource, pipe_source_position
+
+
+@pytest.fixture(scope='module')
+def engine():
+    fc = np.array([2000., 3000., 4000.])
+    return MusicEngine(PipeGeometry(180), fc, bw=400)
+
+
+@pytest.fixture(scope='module')
+def frame():
+    daq = SimulatedBackend([SimulatedSource(pipe_source_position(50))], realtime=False, seed=0)
+    return daq.synthesize(4096).T
+
+
+def test_refine_points_3_is_rejected(engine):
+    # A 3 point local grid has the spacing of the level before it, refinement would never converge
+    with pytest.raises(ValueError):
+        AdaptiveMusic(engine, refine_points=3)
+
+
+def test_unreachable_resolution_finishes(engine, frame):
+    adaptive = AdaptiveMusic(engine, refine_points=4, target_resolution=0, top_k=1)
+    heatmap, peaks = adaptive.process(frame)
+    assert heatmap.shape == engine.geometry.shape
+    assert peaks.shape == (1, 3) and np.isfinite(peaks).all()
@@ -0,0 +1,12 @@
+import numpy as np
+import pytest
+
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.BPF import stft_band_weighting
+
+
+@pytest.mark.parametrize('n_samples', [4096, 1000, 17])
+def test_stft_band_weighting_keeps_length(n_samples):
+    # Inputs shorter than nperseg shrink the STFT segments, the gain curve has to follow
+    data = np.random.default_rng(0).standard_normal(n_samples)
+    weighted = stft_band_weighting(data, 48000, [2000., 3000.], 400, [1., 0.5])
+    assert weighted.shape == data.shape and np.isfinite(weighted).all()
@@ -0,0 +1,54 @@
+import time
+import numpy as np
+import pytest
+
+from N_MIC_LIVEDEMO_PLAYBACK.live_demo_dependencies.segment_archive import SegmentRecorder, SegmentArchive
+
+FS = 1000
+FRAME = 25
+
+
+def frames(n, start=0):
+    rng = np.random.default_rng(start)
+    return [rng.standard_normal((FRAME, 3)).astype(np.float32) for _ in range(n)]
+
+
+def wait_for_frames(archive, n, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        archive.refresh()
+        if sum(len(segment.index) for segment in archive.segments) >= n:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"{n} frames not recorded within {timeout}s")
+
+
+def test_read_back(tmp_path):
+    data = frames(10)
+    with SegmentRecorder(str(tmp_path), 3, FS, segment_seconds=0.1) as recorder:
+        for k, frame in enumerate(data):
+            recorder.write(frame, timestamp=k * FRAME / FS)
+    archive = SegmentArchive(str(tmp_path))
+    assert len(archive.segments) == 3  # 100 samples per segment
+    recorded, t_first = archive.read(0.03, 0.2)
+    assert t_first == pytest.approx(0.03)
+    np.testing.assert_array_equal(recorded, np.concatenate(data)[30:200])
+
+
+def test_rotation_between_refreshes(tmp_path):
+    # Frames appended to a segment after the reader last saw it, then a rotation, before the next refresh
+    data = frames(6)
+    recorder = SegmentRecorder(str(tmp_path), 3, FS, segment_seconds=0.1).start()
+    archive = SegmentArchive(str(tmp_path))
+    for k in range(2):
+        recorder.write(data[k], timestamp=k * FRAME / FS)
+    wait_for_frames(archive, 2)
+    assert len(archive.segments) == 1
+    for k in range(2, 6):  # fills the first segment and rotates into the second
+        recorder.write(data[k], timestamp=k * FRAME / FS)
+    recorder.close()
+
+    archive.refresh()
+    assert [len(segment.index) for segment in archive.segments] == [4, 2]
+    recorded, _ = archive.read(0, 1)
+    np.testing.assert_array_equal(recorded, np.concatenate(data))
@@ -0,0 +1,93 @@
+import zlib
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # Optional, deflate (zlib) is always available
+    zstandard = None
+
+BINARY_MIMETYPE = 'application/octet-stream'
+WIRE_DTYPE = '<f4'  # Little-endian float32
+MIN_COMPRESS_BYTES = 4096  # Smaller bodies are sent uncompressed
+
+
+def wants_binary(request):
+    """
+    Content negotiation for array endpoints.
+
+    Args:
+        request: Flask request
+
+    Returns:
+        bool: True if the client prefers application/octet-stream over JSON (JSON stays the default)
+    """
+    return request.accept_mimetypes.best_match(['application/json', BINARY_MIMETYPE]) == BINARY_MIMETYPE
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick a Content-Encoding from an Accept-Encoding header.
+
+    Args:
+        accept_encoding (str): Accept-Encoding header value
+
+    Returns:
+        str: 'zstd' (if zstandard is installed), 'deflate' or None
+    """
+    offered = {token.split(';')[0].strip().lower() for token in (accept_encoding or '').split(',')}
+    if zstandard is not None and 'zstd' in offered:
+        return 'zstd'
+    if 'deflate' in offered:
+        return 'deflate'
+    return None
+
+
+def encode_array(array, accept_encoding='', extra_headers=None):
+    """
+    Serialize an array for a binary HTTP response.
+
+    Args:
+        array (np.ndarray): Data, sent as raw little-endian float32 in C order
+        accept_encoding (str): Accept-Encoding header of the request
+        extra_headers (dict): Additional headers (e.g. X-Seq)
+
+    Returns:
+        tuple: (body bytes, headers dict with X-Shape, X-Dtype and Content-Encoding when compressed)
+    """
+    body = np.ascontiguousarray(array, dtype=WIRE_DTYPE).tobytes()
+    headers = {
+        'X-Shape': ','.join(str(n) for n in np.shape(array)),
+        'X-Dtype': WIRE_DTYPE,
+        'Vary': 'Accept, Accept-Encoding'
+    }
+    encoding = choose_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding == 'zstd':
+        body = zstandard.ZstdCompressor(level=1).compress(body)
+    elif encoding == 'deflate':
+        body = zlib.compress(body, 1)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    headers.update({key: str(value) for key, value in (extra_headers or {}).items()})
+    return body, headers
+
+
+def decode_array(body, headers):
+    """
+    Inverse of encode_array on the client side.
+
+    Args:
+        body (bytes): Response body. requests already decompresses deflate (and zstd when urllib3
+            has zstd support); a body still marked with a Content-Encoding is decompressed here.
+        headers: Response headers
+
+    Returns:
+        np.ndarray: Array with the shape and dtype from X-Shape/X-Dtype
+    """
+    shape = tuple(int(n) for n in headers['X-Shape'].split(',') if n)
+    expected = int(np.prod(shape)) * np.dtype(headers['X-Dtype']).itemsize
+    encoding = headers.get('Content-Encoding')
+    if len(body) != expected and encoding == 'deflate':
+        body = zlib.decompress(body)
+    elif len(body) != expected and encoding == 'zstd':
+        body = zstandard.ZstdDecompressor().decompress(body, max_output_size=expected)
+    return np.frombuffer(body, dtype=headers['X-Dtype']).reshape(shape)
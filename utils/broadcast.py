@@ -0,0 +1,88 @@
+import queue
+import threading
+
+
+class Subscription:
+    """
+    One subscriber of a Broadcaster: a bounded queue plus the number of items dropped because the
+    subscriber did not keep up.
+    """
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def get(self, timeout=None):
+        """Next item, raises queue.Empty after timeout seconds"""
+        return self.queue.get(timeout=timeout)
+
+
+class Broadcaster:
+    """
+    Fan-out of items from one producer to any number of subscribers.
+
+    Every subscriber has its own bounded queue. `publish` never blocks: when a subscriber's queue
+    is full its oldest item is discarded (and counted in `Subscription.dropped`), so a slow client
+    loses frames instead of stalling the producer.
+
+    Args:
+        max_queue (int): Items buffered per subscriber
+    """
+
+    def __init__(self, max_queue=8):
+        self.max_queue = max_queue
+        self._subscribers = []
+        self._lock = threading.Lock()  # Guards the subscriber list only, never held while waiting
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        subscription = Subscription(self.max_queue)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscription]
+
+    def publish(self, item):
+        """Queue item for every subscriber, dropping the oldest item of subscribers that are full"""
+        for subscription in self._subscribers:  # Copy-on-write list, safe to iterate without the lock
+            while True:
+                try:
+                    subscription.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        subscription.queue.get_nowait()
+                        subscription.dropped += 1
+                    except queue.Empty:
+                        pass
+
+
+def sse_event(data, event=None, event_id=None):
+    """
+    Format one Server-Sent Events message.
+
+    Args:
+        data (str): Payload, may span several lines
+        event (str): Event name (default 'message')
+        event_id: Value of the id field, e.g. a sequence number
+
+    Returns:
+        str: The message, terminated by a blank line
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in str(data).split('\n'))
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,230 @@
+import os
+import time
+import bisect
+import threading
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds, from sub millisecond numerics up to the 1 s acquisition buffers
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+
+    Args:
+        name (str): Metric name
+        help (str): Description shown in the exposition
+        label_names (tuple): Names of the labels passed to `inc`
+    """
+    type = 'counter'
+
+    def __init__(self, name, help='', label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, _format_labels(self.label_names, key), value) for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """
+    Histogram of observed values (durations in seconds) with labels, Prometheus style cumulative buckets.
+
+    Args:
+        name (str): Metric name
+        help (str): Description shown in the exposition
+        label_names (tuple): Names of the labels passed to `observe`
+        buckets (tuple): Increasing upper bounds, +Inf is implied
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help='', label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per bucket counts (non cumulative, last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        self._observe(tuple(str(labels[name]) for name in self.label_names), value)
+
+    def _observe(self, key, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        samples = []
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append((self.name + '_bucket', _format_labels(self.label_names, key, [('le', le)]), cumulative))
+            samples.append((self.name + '_sum', _format_labels(self.label_names, key), total))
+            samples.append((self.name + '_count', _format_labels(self.label_names, key), cumulative))
+        return samples
+
+
+class _Timer:
+    """Context manager observing the duration of its block into a histogram series"""
+    __slots__ = ('histogram', 'key', 'start')
+
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram._observe(self.key, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    """Shared do-nothing timer handed out while metrics are disabled"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    """
+    Set of metrics rendered together on a /metrics endpoint.
+
+    Args:
+        enabled (bool): When False `timer()` returns a shared no-op context manager and nothing is recorded
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, label_names, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, help, label_names, **kwargs)
+        if not isinstance(metric, cls) or metric.label_names != tuple(label_names):
+            raise ValueError(f"Metric {name} already registered as a different type or with other labels")
+        return metric
+
+    def histogram(self, name, help='', label_names=(), buckets=DEFAULT_BUCKETS):
+        """Histogram `name`, created on first use"""
+        return self._get(Histogram, name, help, label_names, buckets=buckets)
+
+    def counter(self, name, help='', label_names=()):
+        """Counter `name`, created on first use"""
+        return self._get(Counter, name, help, label_names)
+
+    def timer(self, name, help='', **labels):
+        """
+        Time a block into histogram `name` (labels as keyword arguments):
+
+            with metrics.timer('audio_server_stage_seconds', stage='bandpass'):
+                ...
+
+        Returns:
+            Context manager, a shared no-op one while the registry is disabled
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        histogram = self.histogram(name, help, tuple(labels))
+        return _Timer(histogram, tuple(str(labels[name]) for name in histogram.label_names))
+
+    def render(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format
+        """
+        with self._lock:  # Snapshot, metrics may be registered while rendering
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(f"{sample}{labels} {value}" for sample, labels, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry(METRICS_ENABLED)
+
+
+def timer(name, help='', **labels):
+    """Registry.timer on the process wide registry"""
+    return REGISTRY.timer(name, help, **labels)
+
+
+def instrument_app(app, server, registry=REGISTRY):
+    """
+    Time every request of a Flask app into http_request_duration_seconds{server,route,method,status} and add
+    a /metrics endpoint serving the registry. Requests are not hooked while the registry is disabled.
+
+    Args:
+        app: Flask app
+        server (str): Value of the server label, e.g. 'audio_server'
+        registry (Registry): Registry to record into and to expose
+    """
+    from flask import Response, g, request
+
+    if registry.enabled:
+        durations = registry.histogram('http_request_duration_seconds', 'Time from request start to response',
+                                      ('server', 'route', 'method', 'status'))
+
+        @app.before_request
+        def _start_request_timer():
+            g.metrics_start = time.perf_counter()
+
+        @app.after_request
+        def _observe_request(response):
+            start = g.pop('metrics_start', None)
+            if start is not None:
+                route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+                durations.observe(time.perf_counter() - start, server=server, route=route, method=request.method,
+                                 status=response.status_code)
+            return response
+
+    def metrics():
+        body = registry.render() if registry.enabled else '# metrics disabled (METRICS_ENABLED=0)\n'
+        return Response(body, content_type=PROMETHEUS_MIMETYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
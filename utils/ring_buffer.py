@@ -0,0 +1,132 @@
+import threading
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Single producer multichannel ring buffer of fixed size frames with sequence numbers.
+
+    Frames are stored as (channels, frame_size) slots, the layout NI-DAQmx multichannel readers
+    write, so the producer reads straight into `write_slot()` and then calls `commit()`. Frame
+    `seq` lives in slot `seq % n_frames` and stays readable until the producer starts writing
+    frame `seq + n_frames`. Readers never block the producer: `frame()` returns a zero-copy
+    view (valid while `is_valid(seq)` holds), `read()`/`last_samples()` return copies that are
+    checked against the sequence counter after copying, so a frame overwritten mid-copy is
+    reported instead of returned torn.
+
+    Args:
+        channels (int): Number of channels per frame
+        frame_size (int): Samples per channel in one frame
+        duration_sec (float): Seconds of audio to keep, bounds memory to about this much
+        sampling_rate (int): Sampling rate in Hz
+        dtype: Sample dtype (float64 for NI-DAQmx analog readers)
+    """
+
+    def __init__(self, channels, frame_size, duration_sec, sampling_rate, dtype=np.float64):
+        self.channels = channels
+        self.frame_size = frame_size
+        self.sampling_rate = sampling_rate
+        self.n_frames = max(3, int(np.ceil(duration_sec * sampling_rate / frame_size)))
+        self.frames = np.zeros((self.n_frames, channels, frame_size), dtype)
+        self.timestamps = np.zeros(self.n_frames)
+        self.seq = 0  # Frames committed so far, i.e. sequence number of the frame being written
+        self._new_frame = threading.Condition()
+
+    # Producer ---------------------------------------------------------------
+    def write_slot(self):
+        """Return the (channels, frame_size) slot of the next frame, to be filled in place"""
+        return self.frames[self.seq % self.n_frames]
+
+    def commit(self, timestamp):
+        """Publish the frame written into `write_slot()`, acquired at `timestamp` (seconds)"""
+        self.timestamps[self.seq % self.n_frames] = timestamp
+        self.seq += 1
+        with self._new_frame:
+            self._new_frame.notify_all()
+
+    def write(self, data, timestamp):
+        """Copy a (channels, frame_size) frame into the buffer and commit it"""
+        self.write_slot()[...] = data
+        self.commit(timestamp)
+
+    # Readers ----------------------------------------------------------------
+    @property
+    def latest_seq(self):
+        """Sequence number of the newest committed frame, -1 if none"""
+        return self.seq - 1
+
+    @property
+    def oldest_seq(self):
+        """Sequence number of the oldest frame that is still readable"""
+        return max(0, self.seq - self.n_frames + 1)
+
+    def is_valid(self, seq):
+        """True if frame `seq` is committed and not yet being overwritten"""
+        return self.oldest_seq <= seq < self.seq
+
+    def wait(self, seq, timeout=None):
+        """Block until frame `seq` is committed, returns False on timeout"""
+        with self._new_frame:
+            return self._new_frame.wait_for(lambda: self.seq > seq, timeout)
+
+    def frame(self, seq):
+        """
+        Zero-copy view of frame `seq`.
+
+        Returns:
+            tuple: (view (channels, frame_size), timestamp), or None if the frame is not readable.
+            Check `is_valid(seq)` after using the view if it may have been held for a while.
+        """
+        if not self.is_valid(seq):
+            return None
+        slot = seq % self.n_frames
+        return self.frames[slot], self.timestamps[slot]
+
+    def read(self, start_seq, count=1):
+        """
+        Copy of `count` consecutive frames starting at `start_seq`, concatenated along time.
+
+        Returns:
+            np.ndarray: (channels, count * frame_size) copy, or None if any frame was not readable
+            or was overwritten while copying
+        """
+        if count < 1 or not (self.is_valid(start_seq) and self.is_valid(start_seq + count - 1)):
+            return None
+        slots = np.arange(start_seq, start_seq + count) % self.n_frames
+        data = np.concatenate([self.frames[slot] for slot in slots], axis=1)
+        return data if self.is_valid(start_seq) else None
+
+    def last_samples(self, n_samples, retries=3):
+        """
+        Copy of the newest `n_samples` samples per channel.
+
+        Returns:
+            tuple: (seq of the newest frame included, (channels, n_samples) array), or None if
+            fewer samples have been captured
+        """
+        count = int(np.ceil(n_samples / self.frame_size))
+        for _ in range(retries):
+            latest = self.latest_seq
+            data = self.read(latest - count + 1, count)
+            if data is not None:
+                return latest, data[:, data.shape[1] - n_samples:]
+        return None
+
+    def read_since(self, seq, retries=3):
+        """
+        Copy of all readable frames newer than frame `seq`.
+
+        Returns:
+            tuple: (seq of the newest frame included, frames after `seq` that were already
+            overwritten, (channels, n * frame_size) array with no samples if nothing is newer),
+            or None if the frames kept being overwritten while copying
+        """
+        for _ in range(retries):
+            latest = self.latest_seq
+            start = max(seq + 1, self.oldest_seq)
+            if start > latest:
+                return latest, 0, np.zeros((self.channels, 0), self.frames.dtype)
+            data = self.read(start, latest - start + 1)
+            if data is not None:
+                return latest, start - seq - 1, data
+        return None